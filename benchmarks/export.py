@@ -0,0 +1,214 @@
+"""
+Generates Vumi Go message exports of any size for benchmarking.
+
+The same seed always generates the same export. Messages are USSD
+sessions between subscribers & a short code: an inbound `new` message,
+replies & `resume`s back & forth and usually an inbound `close`. A few
+subscribers are responsible for most of the sessions & sessions are more
+likely during the day, the way real campaigns look. Rows are in
+timestamp order, with the messages of concurrent sessions interleaved.
+"""
+import argparse
+import bisect
+import csv
+import heapq
+import json
+import random
+import sys
+from datetime import datetime, timedelta
+
+
+FIELDS = [
+    'timestamp', 'from_addr', 'to_addr', 'content', 'message_id',
+    'in_reply_to', 'session_event', 'transport_type', 'direction',
+    'network_handover_status', 'network_handover_reason',
+    'delivery_status', 'endpoint',
+]
+
+SHORT_CODE = '*120*8864*1203#'
+
+START = datetime(2013, 9, 1)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Relative number of sessions started in each hour of the day.
+HOURLY_WEIGHTS = [
+    1, 1, 1, 1, 1, 2, 4, 7, 9, 10, 10, 10,
+    11, 11, 10, 10, 10, 11, 12, 12, 10, 7, 4, 2,
+]
+
+# Question & answer pairs, sessions go through some of them in turn.
+MENU = [
+    ('Say something please...', ['HI', 'hello', 'Hi there', '']),
+    ("We think you said '%s'. Correct?\n1. Yes\n2. No", ['1', '2']),
+    ('Thank you! Do you what to know what you said?\n1. Yes\n2. No',
+     ['1', '2', '!restart']),
+    ('What is your age?\n1. Under 18\n2. 18-35\n3. Over 35',
+     ['1', '2', '3']),
+]
+
+
+class ExportGenerator(object):
+    """
+    Generates the rows of an export. `subscribers` is how many different
+    MSISDNs there are & `days` how long the campaign ran for.
+    """
+
+    # How skewed sessions per subscriber are, higher is more even.
+    skew = 1.2
+    # Chance of a session ending with an inbound `close`, the others
+    # time out.
+    close_rate = 0.8
+
+    def __init__(self, seed=0, subscribers=10000, days=28, start=START):
+        self.random = random.Random(seed)
+        self.subscribers = subscribers
+        self.days = days
+        self.start = start
+        self.msisdns = [self.make_msisdn() for _ in range(subscribers)]
+        # Cumulative weights to pick subscribers with.
+        self.subscriber_weights = self.cumulate(
+            1.0 / (rank + 1) ** self.skew for rank in range(subscribers))
+
+    def cumulate(self, weights):
+        total = 0
+        cumulative = []
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+        return cumulative
+
+    def choose(self, cumulative):
+        return bisect.bisect(
+            cumulative, self.random.random() * cumulative[-1])
+
+    def make_msisdn(self):
+        return '+27%s%07d' % (
+            self.random.choice(['72', '73', '74', '76', '78', '81', '82',
+                                '83', '84']),
+            self.random.randint(0, 9999999))
+
+    def make_message_id(self):
+        return '%032x' % (self.random.getrandbits(128),)
+
+    def get_session_starts(self, count):
+        # Sessions arrive at random, more of them during busy hours, at a
+        # rate that spreads `count` rows over the days of the campaign.
+        rows_per_session = 2 + len(MENU) + self.close_rate
+        rate = count / rows_per_session / (self.days * 24 * 3600.0)
+        mean_weight = sum(HOURLY_WEIGHTS) / float(len(HOURLY_WEIGHTS))
+        timestamp = self.start
+        while True:
+            weight = HOURLY_WEIGHTS[timestamp.hour] / mean_weight
+            timestamp += timedelta(
+                seconds=self.random.expovariate(rate * weight))
+            yield timestamp
+
+    def make_row(self, timestamp, msisdn, direction, content, session_event,
+                 in_reply_to=None):
+        inbound = direction == 'inbound'
+        return {
+            'timestamp': timestamp.strftime(TIMESTAMP_FORMAT),
+            'from_addr': msisdn if inbound else SHORT_CODE,
+            'to_addr': SHORT_CODE if inbound else msisdn,
+            'content': content,
+            'message_id': self.make_message_id(),
+            'in_reply_to': in_reply_to,
+            'session_event': session_event,
+            'transport_type': 'ussd',
+            'direction': direction,
+            'network_handover_status': '' if inbound else 'Unknown',
+            'network_handover_reason': '',
+            'delivery_status': '' if inbound else 'Unknown',
+            'endpoint': 'default',
+        }
+
+    def make_session(self, timestamp):
+        msisdn = self.msisdns[self.choose(self.subscriber_weights)]
+        row = self.make_row(timestamp, msisdn, 'inbound', None, 'new')
+        rows = [row]
+        answer = None
+        for question, answers in MENU[:self.random.randint(1, len(MENU))]:
+            # Replies are quick, answers take a human a few seconds.
+            timestamp += timedelta(seconds=self.random.uniform(0.2, 1))
+            content = question % (answer,) if '%s' in question else question
+            reply = self.make_row(timestamp, msisdn, 'outbound', content,
+                                  None, in_reply_to=row['message_id'])
+            rows.append(reply)
+            timestamp += timedelta(seconds=self.random.expovariate(1 / 8.0))
+            answer = self.random.choice(answers)
+            row = self.make_row(timestamp, msisdn, 'inbound', answer,
+                                'resume', in_reply_to=reply['message_id'])
+            rows.append(row)
+        if self.random.random() < self.close_rate:
+            timestamp += timedelta(seconds=self.random.expovariate(1 / 8.0))
+            rows.append(self.make_row(timestamp, msisdn, 'inbound', None,
+                                      'close'))
+        return rows
+
+    def rows(self, count):
+        """
+        Yields `count` rows in timestamp order, sessions still going at
+        the end are cut short.
+        """
+        # The rows of sessions that have started, by timestamp.
+        pending = []
+        starts = self.get_session_starts(count)
+        while count > 0:
+            start = next(starts)
+            timestamp = start.strftime(TIMESTAMP_FORMAT)
+            while pending and pending[0][0] < timestamp and count > 0:
+                count -= 1
+                yield heapq.heappop(pending)[-1]
+            for row in self.make_session(start):
+                heapq.heappush(
+                    pending, (row['timestamp'], row['message_id'], row))
+
+
+def write_csv(stdout, rows):
+    writer = csv.writer(stdout)
+    writer.writerow(FIELDS)
+    for row in rows:
+        # Like Vumi Go's exports, `None` is written as is.
+        writer.writerow([
+            'None' if row[field] is None else row[field]
+            for field in FIELDS])
+
+
+def write_json(stdout, rows):
+    for row in rows:
+        message = dict(row, **{
+            'transport_name': 'mtn_nigeria_ussd_transport',
+            'transport_metadata': {},
+            'provider': 'mtn_nigeria',
+            'routing_metadata': {'go_hops': [], 'endpoint_name': 'default'},
+            'message_version': '20110921',
+            'message_type': 'user_message',
+        })
+        stdout.write(json.dumps(message, sort_keys=True) + '\n')
+
+
+def generate(stdout, count, codec='csv', seed=0, subscribers=10000, days=28):
+    rows = ExportGenerator(seed, subscribers, days).rows(count)
+    if codec == 'json':
+        write_json(stdout, rows)
+    else:
+        write_csv(stdout, rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-n', '--rows', dest='count', type=int,
+                        default=100000, help='Number of rows to generate.')
+    parser.add_argument('-c', '--codec', dest='codec', default='csv',
+                        choices=['csv', 'json'])
+    parser.add_argument('-s', '--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--subscribers', dest='subscribers', type=int,
+                        default=10000)
+    parser.add_argument('--days', dest='days', type=int, default=28)
+    args = parser.parse_args(argv)
+    generate(sys.stdout, **vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""
+Times every `gdt` subcommand on generated exports with both codecs &
+reports rows per second & peak memory. Results can be saved & compared
+with an earlier run to catch regressions:
+
+  $ python -m benchmarks.harness -n 100000 -o baseline.json
+  $ python -m benchmarks.harness -n 100000 -B baseline.json
+
+It exits with 1 if a case isn't faster than one it has to beat, like
+filtering a columnar cache of an export instead of the export itself.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.export import ExportGenerator, generate
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GDT = os.path.join(ROOT, 'scripts', 'gdt')
+
+CODECS = ['csv', 'json']
+
+# The subcommands to time: a name, the arguments, what's read from
+# `--input` & the codecs to run it with. `{...}` are filled in from the
+# files `prepare()` makes. `extract` always writes CSV so what reads its
+# output is only run with CSV.
+CASES = [
+    ('msisdn', ['msisdn', '-m', '{msisdn}', '-t', 'from_addr'], 'export',
+     CODECS),
+    ('daterange', ['daterange', '-s', '2013-09-08', '-e', '2013-09-15'],
+     'export', CODECS),
+    ('weekrange', ['weekrange', '-y', '2013', '-w', '36', '37'], 'export',
+     CODECS),
+    ('direction', ['direction', '-d', 'inbound'], 'export', CODECS),
+    ('cached direction', ['direction', '-d', 'inbound'], 'cache', CODECS),
+    ('session', ['session', '-t', 'new'], 'export', CODECS),
+    ('contacts', ['contacts', '-f', '{contacts}'], 'export', CODECS),
+    ('regex', ['regex', '-f', 'content', '-p', 'correct', '-i'], 'export',
+     CODECS),
+    ('extract', ['extract', '-f', 'from_addr', 'direction',
+                 '-df', '%Y-%m-%d'], 'export', CODECS),
+    ('aggregate', ['aggregate', '-f', 'from_addr'], 'extracted', ['csv']),
+    ('count', ['count', '-f', 'from_addr'], 'extracted', ['csv']),
+    ('rollup', ['aggregate', '-f', 'from_addr', '--rollup'], 'export',
+     CODECS),
+    ('pivot', ['pivot', '-g', 'timestamp', 'direction', '-df', '%Y-%m-%d',
+               '-m', 'count', 'distinct:from_addr'], 'export', CODECS),
+    ('top', ['top', '-f', 'from_addr', '-df', '%Y-%m-%d'], 'export', CODECS),
+    ('sessions', ['sessions'], 'export', CODECS),
+    ('merge', ['merge', '{partial}', '{partial}'], None, ['csv']),
+    ('run', ['run', 'direction -d inbound',
+             'extract -f from_addr -df %Y-%m-%d', 'count -f from_addr'],
+     'export', CODECS),
+    ('convert', ['convert', '-o', '{columnar}'], 'export', CODECS),
+    ('index', ['index', '--addresses', '{copy}'], None, CODECS),
+]
+
+# Relative change in rows per second or peak memory that's a regression.
+THRESHOLD = 0.1
+
+# Cases that have to be faster than another, reading a columnar cache of an
+# export is only worth it if it beats reading the export.
+FASTER = [
+    ('cached direction', 'direction'),
+]
+
+
+class HarnessException(Exception):
+    pass
+
+
+def gdt(args, stdout=None):
+    """
+    Runs `gdt` from this tree & returns how long it took in seconds & its
+    peak memory use in MB.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    devnull = open(os.devnull, 'wb')
+    try:
+        start = time.time()
+        process = subprocess.Popen(
+            [sys.executable, GDT] + args, env=env,
+            stdout=devnull if stdout is None else stdout)
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.time() - start
+    finally:
+        devnull.close()
+    if status:
+        raise HarnessException('`gdt %s` failed.' % (' '.join(args),))
+    # NOTE: `ru_maxrss` is in KB on Linux.
+    return seconds, usage.ru_maxrss / 1024.0
+
+
+def write_gdt(path, args):
+    with open(path, 'wb') as fp:
+        gdt(args, stdout=fp)
+
+
+class Harness(object):
+    """
+    Generates the exports, & what some subcommands read instead, in
+    `data_path` & times the cases with them.
+    """
+
+    def __init__(self, data_path, rows, seed=0, repeat=3):
+        self.data_path = data_path
+        self.rows = rows
+        self.seed = seed
+        self.repeat = repeat
+        self.paths = {}
+
+    def get_path(self, codec, name):
+        return os.path.join(
+            self.data_path,
+            '%s-%s-%s.%s' % (name, self.rows, self.seed, codec))
+
+    def prepare(self, codec):
+        export = self.get_path(codec, 'export')
+        if not os.path.exists(export):
+            with open(export + '.tmp', 'wb') as fp:
+                generate(fp, self.rows, codec=codec, seed=self.seed)
+            os.rename(export + '.tmp', export)
+        extracted = self.get_path(codec, 'extracted')
+        write_gdt(extracted, ['-c', codec, '-i', export, 'extract', '-f',
+                              'from_addr', '-df', '%Y-%m-%d'])
+        cache = self.get_path(codec, 'cache')
+        if os.path.exists(cache):
+            shutil.rmtree(cache)
+        write_gdt(os.devnull, ['-c', codec, '-i', export, 'convert', '-o',
+                               cache])
+        partial = self.get_path(codec, 'partial')
+        write_gdt(partial, ['-i', extracted, 'aggregate', '-f', 'from_addr',
+                            '--partial'])
+        # The most active subscriber & every tenth of the next thousand.
+        msisdns = ExportGenerator(self.seed).msisdns
+        contacts = self.get_path(codec, 'contacts')
+        with open(contacts, 'wb') as fp:
+            fp.write(''.join('%s\n' % (msisdn,)
+                             for msisdn in msisdns[1:1000:10]))
+        self.paths[codec] = {
+            'export': export,
+            'extracted': extracted,
+            'partial': partial,
+            'cache': cache,
+            'contacts': contacts,
+            'msisdn': msisdns[0],
+            # Written by `convert` & `index`, they're removed before every
+            # run. `index` gets a copy so the other cases don't use it.
+            'columnar': self.get_path(codec, 'columnar'),
+            'copy': os.path.join(self.get_path(codec, 'index'), 'export'),
+        }
+
+    def reset(self, codec):
+        paths = self.paths[codec]
+        for path in [paths['columnar'], os.path.dirname(paths['copy'])]:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        os.mkdir(os.path.dirname(paths['copy']))
+        shutil.copy(paths['export'], paths['copy'])
+
+    def count_rows(self, codec, input_name):
+        with open(self.paths[codec][input_name], 'rb') as fp:
+            lines = sum(1 for _ in fp)
+        # Only CSV has a header, a few records span lines but that's close
+        # enough for a rate.
+        return lines if codec == 'json' and input_name == 'export' else (
+            lines - 1)
+
+    def run_case(self, codec, name, args, input_name):
+        paths = self.paths[codec]
+        args = ['-c', codec] + [arg.format(**paths) for arg in args]
+        if input_name is not None:
+            args = ['-i', paths[input_name]] + args
+        # The cache has the rows of the export it was converted from.
+        rows = self.count_rows(
+            codec, 'export' if input_name in (None, 'cache') else input_name)
+        best = None
+        peak = 0
+        for _ in range(self.repeat):
+            self.reset(codec)
+            seconds, memory = gdt(args)
+            best = seconds if best is None else min(best, seconds)
+            peak = max(peak, memory)
+        return {
+            'rows': rows,
+            'seconds': best,
+            'rows_per_second': rows / best,
+            'peak_mb': peak,
+        }
+
+    def run(self, cases=CASES, codecs=CODECS):
+        """
+        Yields the name & result of each case as it's run, they're all
+        kept in `results`.
+        """
+        self.results = {}
+        for codec in codecs:
+            self.prepare(codec)
+            for name, args, input_name, case_codecs in cases:
+                if codec not in case_codecs:
+                    continue
+                key = '%s %s' % (codec, name)
+                self.results[key] = self.run_case(
+                    codec, name, args, input_name)
+                yield key, self.results[key]
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Returns the changes in rows per second & peak memory of each case
+    since the baseline & the cases that regressed.
+    """
+    changes = {}
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        speed = (float(result['rows_per_second']) /
+                 baseline[key]['rows_per_second'] - 1)
+        memory = float(result['peak_mb']) / baseline[key]['peak_mb'] - 1
+        changes[key] = (speed, memory)
+        if speed < -threshold or memory > threshold:
+            regressions.append(key)
+    return changes, regressions
+
+
+def check_faster(results, pairs=FASTER):
+    """
+    Returns the cases that weren't faster than the case they have to beat,
+    with the same codec.
+    """
+    slower = []
+    for codec in CODECS:
+        for name, other in pairs:
+            key, other_key = '%s %s' % (codec, name), '%s %s' % (codec, other)
+            if key not in results or other_key not in results:
+                continue
+            if (results[key]['rows_per_second'] <=
+                    results[other_key]['rows_per_second']):
+                slower.append(key)
+    return slower
+
+
+def format_result(key, result, change=None):
+    line = '%-21s %12.0f %10.1f' % (
+        key, result['rows_per_second'], result['peak_mb'])
+    if change is not None:
+        line += ' %+9.1f%% %+9.1f%%' % (change[0] * 100, change[1] * 100)
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--rows', dest='rows', type=int,
+                        default=100000, help='Rows in the generated exports.')
+    parser.add_argument('-s', '--seed', dest='seed', type=int, default=0)
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='Times to run each case, the fastest counts.')
+    parser.add_argument('-d', '--data', dest='data_path',
+                        help="""Directory to keep the generated exports in
+                        between runs, a temporary one by default.""")
+    parser.add_argument('-k', '--case', dest='names', nargs='+',
+                        help='Only run these cases.')
+    parser.add_argument('-c', '--codec', dest='codecs', nargs='+',
+                        choices=CODECS, default=CODECS)
+    parser.add_argument('-o', '--output', dest='output_path',
+                        help='Save the results as JSON.')
+    parser.add_argument('-B', '--baseline', dest='baseline_path',
+                        help="""Results saved by an earlier run to compare
+                        with, exits with 1 if any case regressed.""")
+    parser.add_argument('-t', '--threshold', dest='threshold', type=float,
+                        default=THRESHOLD, help="""Slow down or memory
+                        increase that's a regression, as a fraction.""")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in CASES
+             if args.names is None or case[0] in args.names]
+    baseline = None
+    if args.baseline_path is not None:
+        with open(args.baseline_path, 'rb') as fp:
+            saved = json.load(fp)
+        # NOTE: rows per second & peak memory depend on the exports, so
+        #       only results for the same rows & seed can be compared.
+        if (saved['rows'], saved['seed']) != (args.rows, args.seed):
+            parser.error(
+                'The baseline is for %s rows with seed %s, run with '
+                '-n %s -s %s to compare with it.' % (
+                    saved['rows'], saved['seed'], saved['rows'],
+                    saved['seed']))
+        baseline = saved['results']
+
+    data_path = args.data_path or tempfile.mkdtemp()
+    if not os.path.exists(data_path):
+        os.makedirs(data_path)
+    try:
+        print '%-21s %12s %10s%s' % (
+            'case', 'rows/s', 'peak MB',
+            '' if baseline is None else ' %10s %10s' % ('rows/s', 'memory'))
+        harness = Harness(data_path, args.rows, args.seed, args.repeat)
+        for key, result in harness.run(cases, args.codecs):
+            change = None
+            if baseline is not None:
+                change = compare({key: result}, baseline)[0].get(key)
+            print format_result(key, result, change)
+            sys.stdout.flush()
+    finally:
+        if args.data_path is None:
+            shutil.rmtree(data_path)
+
+    if args.output_path is not None:
+        with open(args.output_path, 'wb') as fp:
+            json.dump({'rows': args.rows, 'seed': args.seed,
+                       'results': harness.results}, fp, indent=2,
+                      sort_keys=True)
+    status = 0
+    slower = check_faster(harness.results)
+    if slower:
+        print '\nNot faster than they should be: %s' % (', '.join(slower),)
+        status = 1
+    if baseline is not None:
+        _, regressions = compare(harness.results, baseline, args.threshold)
+        if regressions:
+            print '\nRegressed: %s' % (', '.join(regressions),)
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import json
+import os
+import sys
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from gdt.codec import CSVMessageCodec, JSONMessageCodec
+
+from benchmarks.export import ExportGenerator, generate
+from benchmarks.harness import check_faster, compare, main
+
+
+class ExportTestCase(TestCase):
+
+    def generate(self, codec, count=500, seed=0):
+        stdout = StringIO()
+        generate(stdout, count, codec=codec, seed=seed)
+        return stdout.getvalue()
+
+    def test_deterministic(self):
+        self.assertEqual(self.generate('csv'), self.generate('csv'))
+        self.assertNotEqual(self.generate('csv'),
+                            self.generate('csv', seed=1))
+
+    def test_csv(self):
+        codec = CSVMessageCodec(StringIO(self.generate('csv')), StringIO())
+        rows = list(codec.readrows())
+        self.assertEqual(len(rows), 500)
+        timestamps = [row['timestamp'] for row in rows]
+        self.assertEqual(timestamps, sorted(timestamps))
+        # Replies are to a message earlier in the export.
+        message_ids = set()
+        for row in rows:
+            if row['in_reply_to'] != 'None':
+                self.assertTrue(row['in_reply_to'] in message_ids)
+            message_ids.add(row['message_id'])
+        self.assertEqual(
+            set(row['session_event'] for row in rows),
+            set(['new', 'resume', 'close', 'None']))
+
+    def test_json(self):
+        codec = JSONMessageCodec(StringIO(self.generate('json')), StringIO())
+        rows = list(codec.readrows())
+        csv_rows = list(CSVMessageCodec(
+            StringIO(self.generate('csv')), StringIO()).readrows())
+        self.assertEqual([row['message_id'] for row in rows],
+                         [row['message_id'] for row in csv_rows])
+        self.assertEqual(rows[0]['session_event'], 'new')
+        self.assertEqual(rows[1]['session_event'], None)
+
+    def test_skewed(self):
+        counts = {}
+        for row in ExportGenerator(subscribers=1000).rows(5000):
+            if row['session_event'] == 'new':
+                counts[row['from_addr']] = counts.get(row['from_addr'], 0) + 1
+        counts = sorted(counts.values(), reverse=True)
+        # The busiest tenth of subscribers start most sessions.
+        self.assertTrue(sum(counts[:100]) > sum(counts) / 2)
+
+
+class HarnessTestCase(TestCase):
+
+    def result(self, rows_per_second, peak_mb):
+        return {'rows_per_second': rows_per_second, 'peak_mb': peak_mb}
+
+    def test_compare(self):
+        baseline = {
+            'csv direction': self.result(1000, 20),
+            'csv count': self.result(1000, 20),
+            'csv pivot': self.result(1000, 20),
+        }
+        changes, regressions = compare({
+            'csv direction': self.result(950, 21),
+            'csv count': self.result(800, 20),
+            'csv pivot': self.result(1000, 30),
+            'json pivot': self.result(10, 30),
+        }, baseline)
+        self.assertAlmostEqual(changes['csv direction'][0], -0.05)
+        self.assertAlmostEqual(changes['csv direction'][1], 0.05)
+        self.assertFalse('json pivot' in changes)
+        self.assertEqual(regressions, ['csv count', 'csv pivot'])
+
+    def test_check_faster(self):
+        self.assertEqual(check_faster({
+            'csv direction': self.result(1000, 20),
+            'csv cached direction': self.result(3000, 20),
+            'json direction': self.result(1000, 20),
+            'json cached direction': self.result(900, 20),
+            'csv pivot': self.result(10, 20),
+        }, [('cached direction', 'direction'), ('cached pivot', 'pivot')]),
+            ['json cached direction'])
+
+    def test_baseline_mismatch(self):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as fp:
+            json.dump({'rows': 1000, 'seed': 0, 'results': {}}, fp)
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self.assertRaises(SystemExit, main, ['-B', path, '-n', '500'])
+            self.assertRaises(SystemExit, main,
+                              ['-B', path, '-n', '1000', '-s', '1'])
+            self.assertTrue('-n 1000 -s 0' in sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+            os.remove(path)
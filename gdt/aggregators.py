@@ -1,40 +1,179 @@
-import csv
+import re
 import sys
 from collections import defaultdict
+from itertools import groupby, izip
 
-from gdt.codec import CSVMessageCodec
+from gdt.batch import get_batches, read_rows
+from gdt.checkpoint import Checkpoint
+from gdt.codec import CSVMessageCodec, get_input_fields, make_writer
+from gdt.sketches import (DEFAULT_PRECISION, DEFAULT_COUNTERS, HyperLogLog,
+                          SpaceSaving)
+from gdt.partial import PartialReader, write_partial
+from gdt.spill import (SORT_SIZE, write_run, read_run, merge_items,
+                       merge_runs, sort_items)
+from gdt.threads import ThreadedWriter, read_ahead
+from gdt.timestamps import (COARSEN, GRANULARITIES, format_bucket,
+                            format_timestamp, minute_of)
+
+
+# Rough number of bytes a value kept by an aggregator takes up, along with
+# its share of the dicts & sets it's in.
+ENTRY_SIZE = 128
+
+# Rows aggregated between checks of the memory limit.
+CHECK_INTERVAL = 10000
+
+# What `top --words` counts.
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+class AggregatorException(Exception):
+    pass
+
+
+def get_key(item):
+    return item[0][0]
+
+
+def get_field(item):
+    return item[0][1]
 
 
 class Aggregator(object):
 
+    # The subcommand, used to name the aggregator in partial output.
+    name = None
     field_names = []
 
     def aggregate(self, row):
         raise NotImplemented('Subclasses should implement')
 
+    def aggregate_batch(self, batch):
+        # Subclasses can override this with a grouped reduction.
+        for row in batch.rows:
+            self.aggregate(row)
+
     def get_field_names(self):
         return self.field_names
 
+    def get_required_fields(self):
+        # Fields of the rows this looks at, `None` if it could look at any.
+        return None
+
     def get_data(self):
         raise NotImplemented('To be implemented by subclass.')
 
+    def get_config(self):
+        # The keyword arguments to set up the same aggregator with.
+        raise NotImplemented('To be implemented by subclass.')
+
+    def get_size(self):
+        # Roughly how many bytes of memory the aggregated data takes up.
+        raise NotImplemented('To be implemented by subclass.')
+
+    def spill(self):
+        """
+        Returns the aggregated data as `(key, value)` items, sorted by key,
+        and starts afresh. The first part of every key is the timestamp.
+        """
+        raise NotImplemented('To be implemented by subclass.')
+
+    def get_merged_data(self, items):
+        """
+        Does what `get_data()` does for the sorted items of any number of
+        `spill()`s merged together.
+        """
+        raise NotImplemented('To be implemented by subclass.')
+
+    def combine_items(self, items):
+        """
+        Combines the values of equal keys in sorted, merged items so every
+        key appears once.
+        """
+        raise NotImplemented('To be implemented by subclass.')
+
 
 class UniquesAggregator(Aggregator):
 
-    def __init__(self, fields):
+    name = 'aggregate'
+
+    def __init__(self, fields, approximate=False, precision=None):
         super(UniquesAggregator, self).__init__()
         self.fields = fields
-        self.data = defaultdict(lambda: defaultdict(set))
+        self.approximate = approximate
+        self.precision = (DEFAULT_PRECISION if precision is None
+                          else precision)
+        # Fail early on a precision sketches don't support.
+        self.make_uniques()
+        self.data = self.make_data()
+
+    def make_data(self):
+        return defaultdict(lambda: defaultdict(self.make_uniques))
+
+    def get_config(self):
+        return {
+            'fields': self.fields,
+            'approximate': self.approximate,
+            'precision': self.precision,
+        }
+
+    def make_uniques(self):
+        # NOTE: HyperLogLog sketches count roughly but take the same amount
+        #       of memory however many unique values there are.
+        if self.approximate:
+            return HyperLogLog(self.precision)
+        return set()
+
+    def merge_uniques(self, uniques, other):
+        if self.approximate:
+            return uniques.merge(other)
+        uniques.update(other)
+        return uniques
+
+    def merge(self, other):
+        """
+        Adds the unique values another aggregator saw to this one's.
+        """
+        for timestamp, fields in other.data.items():
+            d = self.data[timestamp]
+            for field, uniques in fields.items():
+                self.merge_uniques(d[field], uniques)
+        return self
+
+    def rollup(self, get_timestamp):
+        """
+        Returns a new aggregator with the buckets of this one merged into
+        the buckets `get_timestamp` maps their timestamps to, like days to
+        weeks.
+        """
+        aggregator = UniquesAggregator(
+            self.fields, self.approximate, self.precision)
+        for timestamp, fields in self.data.items():
+            d = aggregator.data[get_timestamp(timestamp)]
+            for field, uniques in fields.items():
+                aggregator.merge_uniques(d[field], uniques)
+        return aggregator
 
     def get_field_names(self):
         return ['timestamp'] + self.fields
 
+    def get_required_fields(self):
+        return ['timestamp'] + self.fields
+
     def aggregate(self, row):
         d = self.data[row['timestamp']]
         for field in self.fields:
-            d[field].update([row[field]])
+            d[field].add(row[field])
         return d
 
+    def aggregate_batch(self, batch):
+        timestamps = batch.column('timestamp')
+        for field in self.fields:
+            # Each distinct pair is only added once.
+            for timestamp, value in set(izip(timestamps,
+                                             batch.column(field))):
+                self.data[timestamp][field].add(value)
+
     def get_data(self):
         for timestamp in sorted(self.data.keys()):
             d = {
@@ -45,23 +184,95 @@ class UniquesAggregator(Aggregator):
 
             yield d
 
+    def get_size(self):
+        if self.approximate:
+            sketch_size = 2 ** self.precision + ENTRY_SIZE
+            return sketch_size * sum(
+                len(fields) for fields in self.data.itervalues())
+        return ENTRY_SIZE * sum(
+            len(uniques) for fields in self.data.itervalues()
+            for uniques in fields.itervalues())
+
+    def spill(self):
+        data, self.data = self.data, self.make_data()
+        return self.iter_items(data)
+
+    def iter_items(self, data):
+        # Sketches are spilled whole, exact values one by one so that
+        # merging doesn't need all of a bucket's values in memory.
+        for timestamp in sorted(data.keys()):
+            fields = data[timestamp]
+            for field in sorted(fields.keys()):
+                if self.approximate:
+                    yield (timestamp, field), fields[field]
+                else:
+                    for value in sorted(fields[field]):
+                        yield (timestamp, field, value), None
+
+    def get_merged_data(self, items):
+        for timestamp, timestamp_items in groupby(items, get_key):
+            d = {
+                'timestamp': timestamp,
+            }
+            for field, field_items in groupby(timestamp_items, get_field):
+                if self.approximate:
+                    sketches = [sketch for _, sketch in field_items]
+                    d[field] = len(reduce(
+                        lambda merged, sketch: merged.merge(sketch),
+                        sketches[1:], sketches[0]))
+                else:
+                    d[field] = sum(1 for _ in groupby(
+                        key for key, _ in field_items))
+
+            yield d
+
+    def combine_items(self, items):
+        for key, key_items in groupby(items, lambda item: item[0]):
+            if self.approximate:
+                sketches = [sketch for _, sketch in key_items]
+                yield key, reduce(
+                    lambda merged, sketch: merged.merge(sketch),
+                    sketches[1:], sketches[0])
+            else:
+                yield key, None
+
 
 class SimpleAggregator(Aggregator):
 
+    name = 'count'
+
     def __init__(self, fields):
         super(Aggregator, self).__init__()
         self.fields = fields
-        self.data = defaultdict(lambda: defaultdict(int))
+        self.data = self.make_data()
+
+    def make_data(self):
+        return defaultdict(lambda: defaultdict(int))
+
+    def get_config(self):
+        return {
+            'fields': self.fields,
+        }
 
     def get_field_names(self):
         return ['timestamp'] + self.fields
 
+    def get_required_fields(self):
+        return ['timestamp'] + self.fields
+
     def aggregate(self, row):
         d = self.data[row['timestamp']]
         for field in self.fields:
             d[field] += 1
         return d
 
+    def aggregate_batch(self, batch):
+        timestamps, _, counts = batch.group_codes('timestamp')
+        for timestamp, count in zip(timestamps, counts.tolist()):
+            d = self.data[timestamp]
+            for field in self.fields:
+                d[field] += count
+
     def get_data(self):
         for timestamp in sorted(self.data.keys()):
             d = {
@@ -72,27 +283,661 @@ class SimpleAggregator(Aggregator):
 
             yield d
 
+    def get_size(self):
+        return ENTRY_SIZE * len(self.data) * len(self.fields)
+
+    def spill(self):
+        data, self.data = self.data, self.make_data()
+        return (((timestamp, field), data[timestamp][field])
+                for timestamp in sorted(data.keys())
+                for field in sorted(data[timestamp].keys()))
+
+    def get_merged_data(self, items):
+        for timestamp, timestamp_items in groupby(items, get_key):
+            d = {
+                'timestamp': timestamp,
+            }
+            for field, field_items in groupby(timestamp_items, get_field):
+                d[field] = sum(count for _, count in field_items)
+
+            yield d
+
+    def combine_items(self, items):
+        for key, key_items in groupby(items, lambda item: item[0]):
+            yield key, sum(count for _, count in key_items)
+
+
+
+
+class Metric(object):
+    """
+    A value calculated over the rows of a pivot group. States are updated
+    with each row's value of `field` and can be merged with the state of
+    the same metric over other rows.
+    """
+
+    kind = None
+
+    def __init__(self, field=None):
+        self.field = field
+
+    @property
+    def name(self):
+        if self.field is None:
+            return self.kind
+        return '%s_%s' % (self.kind, self.field)
+
+    @property
+    def expression(self):
+        # What `make_metric()` parses.
+        if self.field is None:
+            return self.kind
+        return '%s:%s' % (self.kind, self.field)
+
+    def initial(self):
+        return None
+
+    def update(self, state, value):
+        raise NotImplemented('Subclasses should implement')
+
+    def merge(self, state, other):
+        raise NotImplemented('Subclasses should implement')
+
+    def result(self, state):
+        return state
+
+
+class CountMetric(Metric):
+
+    kind = 'count'
+
+    def initial(self):
+        return 0
+
+    def update(self, state, value):
+        return state + 1
+
+    def merge(self, state, other):
+        return state + other
+
+
+class DistinctMetric(Metric):
+
+    kind = 'distinct'
+
+    def initial(self):
+        return set()
+
+    def update(self, state, value):
+        state.add(value)
+        return state
+
+    def merge(self, state, other):
+        state.update(other)
+        return state
+
+    def result(self, state):
+        return len(state)
+
+
+class MinMetric(Metric):
+
+    kind = 'min'
+
+    def update(self, state, value):
+        if value is None or value == '':
+            return state
+        return value if state is None else min(state, value)
+
+    def merge(self, state, other):
+        return self.update(state, other)
+
+
+class MaxMetric(MinMetric):
+
+    kind = 'max'
+
+    def update(self, state, value):
+        if value is None or value == '':
+            return state
+        return value if state is None else max(state, value)
+
 
+class FirstMetric(Metric):
+
+    kind = 'first'
+
+    def update(self, state, value):
+        return value if state is None else state
+
+    def merge(self, state, other):
+        return self.update(state, other)
+
+
+class LastMetric(Metric):
+
+    kind = 'last'
+
+    def update(self, state, value):
+        return state if value is None else value
+
+    def merge(self, state, other):
+        return self.update(state, other)
+
+
+METRICS = dict((metric_class.kind, metric_class) for metric_class in [
+    CountMetric, DistinctMetric, MinMetric, MaxMetric, FirstMetric,
+    LastMetric])
+
+
+def make_metric(expression):
+    """
+    Parses metrics like `count`, `distinct:from_addr` or `min:timestamp`.
+    """
+    kind, _, field = expression.partition(':')
+    if kind not in METRICS:
+        raise AggregatorException('Unknown metric %r.' % (kind,))
+    if kind == 'count':
+        if field:
+            raise AggregatorException('`count` takes no field.')
+        return CountMetric()
+    if not field:
+        raise AggregatorException('%r needs a field.' % (kind,))
+    return METRICS[kind](field)
+
+
+def encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class PivotAggregator(Aggregator):
+    """
+    Calculates several metrics for every combination of values of the
+    `group_by` fields in a single pass. Timestamps are grouped by
+    `date_format` if one is given.
+    """
+
+    name = 'pivot'
+
+    def __init__(self, group_by, metrics, date_format=None):
+        super(PivotAggregator, self).__init__()
+        if not metrics:
+            raise AggregatorException('At least one metric is required.')
+        self.group_by = group_by
+        self.metrics = [make_metric(metric) if isinstance(metric, basestring)
+                        else metric for metric in metrics]
+        self.date_format = date_format
+        self.data = {}
+
+    def get_field_names(self):
+        return self.group_by + [metric.name for metric in self.metrics]
+
+    def get_required_fields(self):
+        return self.group_by + [metric.field for metric in self.metrics
+                                if metric.field is not None]
+
+    def get_config(self):
+        return {
+            'group_by': self.group_by,
+            'metrics': [metric.expression for metric in self.metrics],
+            'date_format': self.date_format,
+        }
+
+    def get_group(self, row):
+        group = []
+        for field in self.group_by:
+            value = row.get(field)
+            if field == 'timestamp' and self.date_format and value:
+                value = format_timestamp(value, self.date_format)
+            group.append(value)
+        return tuple(group)
+
+    def aggregate(self, row):
+        group = self.get_group(row)
+        try:
+            states = self.data[group]
+        except KeyError:
+            states = self.data[group] = [
+                metric.initial() for metric in self.metrics]
+        for index, metric in enumerate(self.metrics):
+            states[index] = metric.update(
+                states[index], None if metric.field is None
+                else row.get(metric.field))
+        return states
+
+    def get_row(self, group, states):
+        d = dict(zip(self.group_by, map(encode, group)))
+        for metric, state in zip(self.metrics, states):
+            d[metric.name] = encode(metric.result(state))
+        return d
+
+    def get_data(self):
+        for group in sorted(self.data.keys()):
+            yield self.get_row(group, self.data[group])
+
+    def get_size(self):
+        return ENTRY_SIZE * sum(
+            len(self.metrics) + sum(
+                len(state) for state in states if isinstance(state, set))
+            for states in self.data.itervalues())
+
+    def spill(self):
+        data, self.data = self.data, {}
+        return ((group, data[group]) for group in sorted(data.keys()))
+
+    def combine_items(self, items):
+        for group, group_items in groupby(items, lambda item: item[0]):
+            merged = None
+            for _, states in group_items:
+                if merged is None:
+                    merged = states
+                    continue
+                merged = [metric.merge(state, other) for metric, state, other
+                          in zip(self.metrics, merged, states)]
+            yield group, merged
+
+    def get_merged_data(self, items):
+        for group, states in self.combine_items(items):
+            yield self.get_row(group, states)
+
+
+class TopAggregator(Aggregator):
+    """
+    Finds the `k` most frequent values of `field` per `date_format` bucket
+    of the timestamp, or over all the rows without one, with Space-Saving
+    summaries of `capacity` counters. Counts are exact while there are no
+    more distinct values than counters and otherwise over by at most the
+    `error` written with them, which is at most the bucket's rows divided
+    by `capacity`.
+    """
+
+    name = 'top'
+
+    def __init__(self, field, k=10, capacity=None, date_format=None,
+                 words=False):
+        super(TopAggregator, self).__init__()
+        self.capacity = DEFAULT_COUNTERS if capacity is None else capacity
+        if k < 1:
+            raise AggregatorException('At least one value is required.')
+        if self.capacity < k:
+            raise AggregatorException(
+                'The capacity must be at least the number of values.')
+        self.field = field
+        self.k = k
+        self.date_format = date_format
+        # Count the words of the field, lower cased, instead of its values.
+        self.words = words
+        self.data = {}
+
+    def get_config(self):
+        return {
+            'field': self.field,
+            'k': self.k,
+            'capacity': self.capacity,
+            'date_format': self.date_format,
+            'words': self.words,
+        }
+
+    def get_field_names(self):
+        field_names = [self.field, 'count', 'error']
+        if self.date_format:
+            return ['timestamp'] + field_names
+        return field_names
+
+    def get_required_fields(self):
+        if self.date_format:
+            return ['timestamp', self.field]
+        return [self.field]
+
+    def get_summary(self, bucket):
+        try:
+            return self.data[bucket]
+        except KeyError:
+            summary = self.data[bucket] = SpaceSaving(self.capacity)
+            return summary
+
+    def get_bucket(self, row):
+        if not self.date_format:
+            return None
+        return format_timestamp(row['timestamp'], self.date_format)
+
+    def get_values(self, value):
+        if not self.words:
+            return [value]
+        # NOTE: words are split & lowercased as unicode so accented letters
+        #       are part of words, then kept as UTF-8 like the values read
+        #       back from a spill.
+        if isinstance(value, str):
+            value = value.decode('utf-8', 'replace')
+        return [encode(word) for word in WORD.findall((value or u'').lower())]
+
+    def aggregate(self, row):
+        summary = self.get_summary(self.get_bucket(row))
+        for value in self.get_values(row.get(self.field)):
+            summary.add(value)
+        return summary
+
+    def aggregate_batch(self, batch):
+        # Values are counted per batch first so each is only added to its
+        # summary once.
+        counts = defaultdict(int)
+        for row in batch.rows:
+            bucket = self.get_bucket(row)
+            for value in self.get_values(row.get(self.field)):
+                counts[(bucket, value)] += 1
+        for (bucket, value), count in counts.iteritems():
+            self.get_summary(bucket).add(value, count)
+
+    def get_rows(self, bucket, summary):
+        for value, count, error in summary.top(self.k):
+            d = {
+                self.field: encode(value),
+                'count': count,
+                'error': error,
+            }
+            if self.date_format:
+                d['timestamp'] = bucket
+            yield d
+
+    def get_data(self):
+        for bucket in sorted(self.data.keys()):
+            for d in self.get_rows(bucket, self.data[bucket]):
+                yield d
+
+    def get_size(self):
+        return ENTRY_SIZE * sum(
+            len(summary) for summary in self.data.itervalues())
+
+    def spill(self):
+        data, self.data = self.data, {}
+        return (((bucket,), data[bucket]) for bucket in sorted(data.keys()))
+
+    def combine_items(self, items):
+        for key, key_items in groupby(items, lambda item: item[0]):
+            summaries = [summary for _, summary in key_items]
+            yield key, reduce(
+                lambda merged, summary: merged.merge(summary),
+                summaries[1:], summaries[0])
+
+    def get_merged_data(self, items):
+        for (bucket,), summary in self.combine_items(items):
+            for d in self.get_rows(bucket, summary):
+                yield d
+
+
+class RollupAggregator(Aggregator):
+    """
+    Runs the `aggregator` subcommand's aggregator, set up with `config`,
+    over raw timestamps bucketed by the finest of `granularities` with
+    integer arithmetic instead of `strftime`. The buckets of each coarser
+    granularity are merged from those of the one before it when done, so
+    every granularity comes from a single pass over the rows.
+    """
+
+    name = 'rollup'
+    # Items of a bucket sorted in memory at a time when merging them into
+    # coarser buckets, pipelines with a memory limit lower it.
+    sort_size = SORT_SIZE
+
+    def __init__(self, aggregator, config, granularities=None):
+        super(RollupAggregator, self).__init__()
+        granularities = granularities or GRANULARITIES
+        for granularity in granularities:
+            if granularity not in GRANULARITIES:
+                raise AggregatorException(
+                    'Unknown granularity %r.' % (granularity,))
+        if aggregator not in ['aggregate', 'count']:
+            raise AggregatorException(
+                'Only `aggregate` & `count` can be rolled up.')
+        self.aggregator_name = aggregator
+        self.config = config
+        self.aggregator = AGGREGATORS[aggregator](**config)
+        # Every granularity from the finest asked for on.
+        self.granularities = GRANULARITIES[
+            min(map(GRANULARITIES.index, granularities)):]
+        self.output_granularities = set(granularities)
+        # What turns minutes into buckets of the finest granularity.
+        self.coarsen_minute = [
+            COARSEN[granularity] for granularity in GRANULARITIES[
+                1:GRANULARITIES.index(self.granularities[0]) + 1]]
+        self.fields = self.aggregator.get_required_fields()
+
+    def get_config(self):
+        return {
+            'aggregator': self.aggregator_name,
+            'config': self.config,
+            'granularities': [
+                granularity for granularity in self.granularities
+                if granularity in self.output_granularities],
+        }
+
+    def get_field_names(self):
+        return ['granularity'] + self.aggregator.get_field_names()
+
+    def get_required_fields(self):
+        return self.fields
+
+    def get_bucket(self, value):
+        bucket = minute_of(value)
+        for coarsen in self.coarsen_minute:
+            bucket = coarsen(bucket)
+        return bucket
+
+    def aggregate(self, row):
+        bucket_row = dict((field, row.get(field)) for field in self.fields)
+        bucket_row['timestamp'] = self.get_bucket(row['timestamp'])
+        return self.aggregator.aggregate(bucket_row)
+
+    def get_size(self):
+        return self.aggregator.get_size()
+
+    def spill(self):
+        return self.aggregator.spill()
+
+    def combine_items(self, items):
+        return self.aggregator.combine_items(items)
+
+    def coarsen(self, items, granularity):
+        """
+        Merges sorted items into the buckets of `granularity`. The buckets
+        stay in order, so only one bucket's items at a time are sorted by
+        the rest of their keys.
+        """
+        coarsen = COARSEN[granularity]
+        for _, bucket_items in groupby(
+                (((coarsen(key[0]),) + key[1:], value)
+                 for key, value in items), get_key):
+            for item in self.aggregator.combine_items(
+                    sort_items(bucket_items, self.sort_size)):
+                yield item
+
+    def get_merged_data(self, items):
+        items = self.aggregator.combine_items(items)
+        last = len(self.granularities) - 1
+        for index, granularity in enumerate(self.granularities):
+            if index:
+                items = self.coarsen(read_run(run), granularity)
+            if index < last:
+                # Kept on disk to be coarsened into the next granularity
+                # once they've been written out.
+                run = write_run(items)
+                items = read_run(run, close=False)
+            if granularity in self.output_granularities:
+                for d in self.aggregator.get_merged_data(items):
+                    d['granularity'] = granularity
+                    d['timestamp'] = format_bucket(
+                        granularity, d['timestamp'])
+                    yield d
+            if index < last:
+                run.seek(0)
+
+    def get_data(self):
+        return self.get_merged_data(self.aggregator.spill())
+
+
+AGGREGATORS = dict(
+    (aggregator_class.name, aggregator_class) for aggregator_class in [
+        UniquesAggregator, SimpleAggregator, PivotAggregator, TopAggregator,
+        RollupAggregator])
 
 
 class AggregatorPipeline(object):
 
-    # NOTE: this always outputs CSV
+    # NOTE: this outputs CSV (or binary rows to another `gdt`), or partial
+    #       output for `gdt merge`.
 
     input_codec = CSVMessageCodec
+    check_interval = CHECK_INTERVAL
+    writer_class = None
+    threaded = False
 
-    def __init__(self, aggregator, codec_class=None):
+    def __init__(self, aggregator, codec_class=None, batch_size=None,
+                 memory_limit=None, partial=False, checkpoint_path=None,
+                 resume=False):
         self.aggregator = aggregator
         self.codec_class = (self.input_codec if codec_class is None
                             else codec_class)
+        self.batch_size = batch_size
+        # In bytes, once the aggregated data is bigger than this it's
+        # written to a sorted run on disk. Runs are merged at the end.
+        self.memory_limit = memory_limit
+        # Write the aggregated state instead of the results so the output
+        # of several runs can be combined with `gdt merge`.
+        self.partial = partial
+        # Save the aggregated state & how far into the input it got so a
+        # later run can `resume` with only the rows added since.
+        self.checkpoint_path = checkpoint_path
+        self.resume = resume
+        if memory_limit is not None and hasattr(aggregator, 'sort_size'):
+            aggregator.sort_size = max(1, memory_limit // ENTRY_SIZE)
+
+    def get_output_field_names(self):
+        return self.aggregator.get_field_names()
+
+    def get_required_fields(self):
+        return self.aggregator.get_required_fields()
+
+    def spill(self, runs):
+        if (self.memory_limit is not None and
+                self.aggregator.get_size() > self.memory_limit):
+            runs.append(write_run(self.aggregator.spill()))
+
+    def aggregate_rows(self, rows):
+        """
+        Aggregates `rows` and returns the runs that were spilled to disk.
+        """
+        runs = []
+        if self.batch_size:
+            for batch in get_batches(rows, self.batch_size):
+                self.aggregator.aggregate_batch(batch)
+                self.spill(runs)
+        else:
+            for index, row in enumerate(rows, 1):
+                self.aggregator.aggregate(row)
+                if index % self.check_interval == 0:
+                    self.spill(runs)
+        return runs
+
+    def process_rows(self, rows):
+        runs = self.aggregate_rows(rows)
+        if not runs:
+            return self.aggregator.get_data()
+        runs.append(write_run(self.aggregator.spill()))
+        return self.aggregator.get_merged_data(merge_runs(runs))
+
+    def get_items(self, rows):
+        runs = self.aggregate_rows(rows)
+        runs.append(write_run(self.aggregator.spill()))
+        return merge_runs(runs)
+
+    def write_partial(self, rows, stdout):
+        write_partial(stdout, self.aggregator.name,
+                      self.aggregator.get_config(), self.get_items(rows))
+
+    def write_results(self, results, stdout):
+        output = make_writer(stdout, self.aggregator.get_field_names(),
+                             self.writer_class)
+        if self.threaded:
+            output = ThreadedWriter(output)
+        for result in results:
+            output.writerow(result)
+        output.flush()
+
+    def process_checkpoint(self, stdin, stdout, stages=()):
+        """
+        Aggregates the input added since the checkpoint, `stages` are run
+        on the rows first, and saves the combined state before writing the
+        results for all of it.
+        """
+        checkpoint = Checkpoint(self.checkpoint_path, self.aggregator,
+                                self.codec_class, resume=self.resume)
+        input_codec = self.codec_class(
+            checkpoint.open_input(stdin), stdout, write_header=False)
+        input_codec.select_fields(get_input_fields(list(stages) + [self]))
+        rows = checkpoint.skip_rows(input_codec.readrows())
+        if self.threaded:
+            rows = read_ahead(rows)
+        for stage in stages:
+            rows = stage.process_rows(rows)
+        items = checkpoint.save(self.get_items(rows))
+        if self.partial:
+            write_partial(stdout, self.aggregator.name,
+                          self.aggregator.get_config(), items)
+            return
+        self.write_results(self.aggregator.get_merged_data(items), stdout)
 
     def process(self, stdin=sys.stdin, stdout=sys.stdout):
+        if self.checkpoint_path is not None:
+            self.process_checkpoint(stdin, stdout)
+            return
         input_codec = self.codec_class(stdin, stdout, write_header=False)
-        field_names = self.aggregator.get_field_names()
-        output = csv.DictWriter(stdout, fieldnames=field_names)
-        output.writerow(dict(zip(field_names, field_names)))
-        for row in input_codec.readrows():
-            self.aggregator.aggregate(row)
+        input_codec.select_fields(self.get_required_fields())
+        rows = read_rows(input_codec, self.batch_size)
+        if self.threaded:
+            rows = read_ahead(rows)
+        if self.partial:
+            self.write_partial(rows, stdout)
+            return
+        self.write_results(self.process_rows(rows), stdout)
 
-        for result in self.aggregator.get_data():
-            output.writerow(result)
+
+class MergePipeline(object):
+    """
+    Combines the partial output of any number of aggregator runs into the
+    results of a single run over all of their input.
+    """
+
+    writer_class = None
+
+    def __init__(self, paths, partial=False):
+        if not paths:
+            raise AggregatorException('At least one partial file is needed.')
+        self.paths = paths
+        self.partial = partial
+
+    def process(self, stdin=sys.stdin, stdout=sys.stdout):
+        files = [open(path, 'rb') for path in self.paths]
+        try:
+            readers = [PartialReader(fp) for fp in files]
+            name, config = readers[0].name, readers[0].config
+            for reader in readers[1:]:
+                if (reader.name, reader.config) != (name, config):
+                    raise AggregatorException(
+                        'Only output of the same aggregator can be merged.')
+            aggregator = AGGREGATORS[name](**config)
+            items = merge_items([reader.readitems() for reader in readers])
+
+            if self.partial:
+                write_partial(stdout, name, config,
+                              aggregator.combine_items(items))
+                return
+            output = make_writer(stdout, aggregator.get_field_names(),
+                                 self.writer_class)
+            for result in aggregator.get_merged_data(items):
+                output.writerow(result)
+            output.flush()
+        finally:
+            for fp in files:
+                fp.close()
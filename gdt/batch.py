@@ -0,0 +1,227 @@
+import re
+from itertools import islice
+from operator import itemgetter
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+from gdt.codec import Row
+from gdt.timestamps import parse_timestamp, to_epoch
+
+
+# Newline terminated timestamps in the format Vumi writes them, which
+# NumPy parses the same way `parse_timestamp()` does.
+VUMI_TIMESTAMPS = re.compile(
+    r'(?:\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}:\d{2}(?:\.\d{1,6})?)?\n)*\Z')
+
+
+class BatchException(Exception):
+    pass
+
+
+class Batches(object):
+    """
+    Rows read a batch at a time. Iterating over it yields the rows, batch
+    pipelines take the `batches` as they are.
+    """
+
+    def __init__(self, batches):
+        self.batches = batches
+
+    def __iter__(self):
+        for batch in self.batches:
+            for row in batch.rows:
+                yield row
+
+
+def read_batches(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield ColumnBatch(batch)
+
+
+def get_batches(rows, batch_size):
+    """
+    Returns the batches of `rows`, as they were read if they're `Batches`.
+    """
+    if isinstance(rows, Batches):
+        return rows.batches
+    return read_batches(rows, batch_size)
+
+
+def read_rows(codec, batch_size=None):
+    """
+    Returns the rows `codec` reads, as `Batches` of up to `batch_size` rows
+    if one is given. Codecs can read batches themselves, or lists of values
+    like CSV that columns are taken straight from, instead of rows.
+    """
+    if not batch_size:
+        return codec.readrows()
+    if hasattr(codec, 'readbatches'):
+        return Batches(codec.readbatches(batch_size))
+    if not hasattr(codec, 'readvalues'):
+        return Batches(read_batches(codec.readrows(), batch_size))
+    return Batches(
+        ColumnBatch.from_values(codec.index, values)
+        for values in codec.readvalues(batch_size))
+
+
+class ColumnBatch(object):
+    """
+    A batch of rows along with NumPy columns for the fields that are
+    looked at. Columns are only built when asked for; string columns are
+    stored as categorical codes, timestamps as int64 microseconds since
+    the epoch. Batches read as lists of values only make rows of the
+    values that are selected.
+    """
+
+    def __init__(self, rows=None):
+        if numpy is None:
+            raise BatchException('The batch engine requires NumPy.')
+        self._rows = rows
+        self.index = None
+        self.values = None
+        self.columns = {}
+        self.categoricals = {}
+        self._timestamps = None
+        self._weeks = None
+
+    @classmethod
+    def from_values(cls, index, values):
+        """
+        A batch of rows with `values` in the positions of `index`, the
+        way CSV rows are read.
+        """
+        batch = cls()
+        batch.index = index
+        batch.values = values
+        return batch
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            index = self.index
+            self._rows = [Row(index, values) for values in self.values]
+        return self._rows
+
+    def __len__(self):
+        if self._rows is None:
+            return len(self.values)
+        return len(self._rows)
+
+    def column(self, field):
+        """
+        Returns a list of the values of `field`, `None` for rows without it.
+        """
+        try:
+            return self.columns[field]
+        except KeyError:
+            pass
+        if self._rows is not None:
+            column = [row.get(field) for row in self._rows]
+        elif field in self.index:
+            column = map(itemgetter(self.index[field]), self.values)
+        else:
+            column = [None] * len(self.values)
+        self.columns[field] = column
+        return column
+
+    def categorical(self, field):
+        """
+        Returns a `(codes, categories)` tuple for the values of `field`
+        where `categories` lists the distinct values in order of their code.
+        """
+        try:
+            return self.categoricals[field]
+        except KeyError:
+            pass
+        lookup = {}
+        # NOTE: `len(lookup)` is taken before `setdefault()` adds the value,
+        #       so new values get the next code.
+        setdefault = lookup.setdefault
+        codes = numpy.array(
+            [setdefault(value, len(lookup)) for value in self.column(field)],
+            dtype=numpy.int32)
+        categories = [None] * len(lookup)
+        for value, code in lookup.iteritems():
+            categories[code] = value
+        self.categoricals[field] = (codes, categories)
+        return codes, categories
+
+    def where(self, field, predicate):
+        """
+        Returns a mask of the rows for which `predicate` is true for the
+        value of `field`. The predicate is called once per distinct value.
+        """
+        codes, categories = self.categorical(field)
+        table = numpy.array(
+            [bool(predicate(value)) for value in categories], dtype=bool)
+        return table.take(codes)
+
+    def apply(self, function):
+        """
+        Returns a mask from calling `function` on each row.
+        """
+        return numpy.fromiter(
+            (bool(function(row)) for row in self.rows), dtype=bool,
+            count=len(self))
+
+    def timestamps(self):
+        if self._timestamps is None:
+            column = self.column('timestamp')
+            try:
+                vumi = VUMI_TIMESTAMPS.match('\n'.join(column) + '\n')
+            except TypeError:
+                vumi = None
+            if vumi is not None:
+                # NOTE: NumPy parses the whole column in C, much faster
+                #       than `parse_timestamp()` can one value at a time.
+                self._timestamps = numpy.array(
+                    column, dtype='datetime64[us]').astype(numpy.int64)
+            else:
+                self._timestamps = numpy.fromiter(
+                    (to_epoch(parse_timestamp(value)) for value in column),
+                    dtype=numpy.int64, count=len(column))
+        return self._timestamps
+
+    def weeks(self):
+        """
+        Returns `(years, weeks)` arrays where weeks are numbered the way
+        `strftime('%W')` does.
+        """
+        if self._weeks is None:
+            timestamps = self.timestamps().astype('datetime64[us]')
+            days = timestamps.astype('datetime64[D]').astype(numpy.int64)
+            years = timestamps.astype('datetime64[Y]')
+            year_days = days - years.astype('datetime64[D]').astype(
+                numpy.int64)
+            # 1970-01-01 was a Thursday, make Monday 0.
+            weekdays = (days + 3) % 7
+            self._weeks = (years.astype(numpy.int64) + 1970,
+                           (year_days + 7 - weekdays) // 7)
+        return self._weeks
+
+    def group_codes(self, field):
+        """
+        Returns `(keys, inverse, counts)` where `keys` are the distinct
+        values of `field`, `inverse` the index into `keys` for every row and
+        `counts` the number of rows per key.
+        """
+        # Every category is some row's value, so the codes already are
+        # indexes into them.
+        codes, categories = self.categorical(field)
+        return categories, codes.astype(numpy.intp), numpy.bincount(
+            codes, minlength=len(categories))
+
+    def select(self, mask):
+        indexes = numpy.flatnonzero(mask).tolist()
+        if self._rows is None:
+            index, values = self.index, self.values
+            return [Row(index, values[i]) for i in indexes]
+        rows = self._rows
+        return [rows[i] for i in indexes]
@@ -0,0 +1,214 @@
+import csv
+import marshal
+import os
+import stat
+import struct
+
+from gdt.codec import CSVWriter, JSONMessageCodec, Row, union_fields
+
+
+# Starts every binary stream. Text exports never contain a NUL byte.
+MAGIC = '\x00gdt\x01'
+
+# A one byte frame type & the length of what follows.
+FRAME = struct.Struct('<cI')
+
+# The fields the rows were read with, `None` for JSON rows.
+HEADER = 'H'
+# The fields of the rows in the frames that follow.
+SCHEMA = 'S'
+# A batch of rows, a list of values per row in the order of the schema.
+ROWS = 'R'
+
+# Rows written per frame.
+BATCH_SIZE = 1000
+
+
+class BinaryException(Exception):
+    pass
+
+
+def is_gdt_pipe(stdout):
+    """
+    Whether `stdout` is a pipe another `gdt` process reads from. This
+    looks for the process in `/proc` so it's only ever a best guess,
+    anything that goes wrong means it isn't.
+    """
+    try:
+        fd = stdout.fileno()
+        if not stat.S_ISFIFO(os.fstat(fd).st_mode):
+            return False
+        pipe = os.readlink('/proc/self/fd/%d' % (fd,))
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                if os.readlink('/proc/%s/fd/0' % (pid,)) != pipe:
+                    continue
+                with open('/proc/%s/cmdline' % (pid,), 'rb') as fp:
+                    args = fp.read().split('\x00')
+            except (IOError, OSError):
+                continue
+            # Either `gdt ...` or `python .../gdt ...`.
+            return any(os.path.basename(arg) == 'gdt' for arg in args[:2])
+    except (AttributeError, IOError, OSError, ValueError):
+        pass
+    return False
+
+
+def is_binary(stdin):
+    return stdin.peek(len(MAGIC)) == MAGIC
+
+
+def is_binary_file(path):
+    with open(path, 'rb') as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+class BinaryWriter(object):
+    """
+    Writes rows as length prefixed frames of marshalled values for another
+    `gdt` to read, instead of encoding them as CSV or JSON. The fields of
+    the rows are only written when they change.
+    """
+
+    def __init__(self, stdout, field_names=None):
+        self.stdout = stdout
+        self.schema = None
+        # The field-index map of the CSV rows that were last written, rows
+        # that share it can be written without looking at their fields.
+        self.index = None
+        self.batch = []
+        self.stdout.write(MAGIC)
+        self.write_frame(HEADER, {'fields': field_names})
+
+    def write_frame(self, kind, value):
+        data = marshal.dumps(value)
+        self.stdout.write(FRAME.pack(kind, len(data)))
+        self.stdout.write(data)
+
+    def set_schema(self, schema, index=None):
+        self.flush()
+        self.schema = schema
+        self.index = index
+        self.write_frame(SCHEMA, schema)
+
+    def writerow(self, row):
+        if (isinstance(row, Row) and row.extra is None and
+                row.index is self.index):
+            self.batch.append(row.values)
+        else:
+            keys = row.keys()
+            if keys != self.schema:
+                self.set_schema(keys, row.index if (
+                    isinstance(row, Row) and row.extra is None) else None)
+            self.batch.append([row[key] for key in keys])
+        if len(self.batch) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.write_frame(ROWS, self.batch)
+            self.batch = []
+
+
+class BinaryMessageCodec(object):
+    """
+    Reads what a `BinaryWriter` wrote. Rows are written in the format they
+    were originally read in, CSV if they had fields & JSON if not.
+    """
+
+    name = 'binary'
+    has_header = False
+    quoted_newlines = False
+
+    def __init__(self, stdin, stdout, write_header=True):
+        self.stdin = stdin
+        self.stdout = stdout
+        self.fieldnames = self.read_header()
+        self.added_field_names = []
+        # The field-index map of rows that have the fields of the header.
+        self.index = None
+        self.writer = None
+        if write_header:
+            self.write_header()
+
+    def read(self, size):
+        data = self.stdin.read(size)
+        if len(data) != size:
+            raise BinaryException('Truncated binary input.')
+        return data
+
+    def read_frame(self):
+        while True:
+            data = self.stdin.read(FRAME.size)
+            if not data:
+                return None, None
+            if len(data) != FRAME.size:
+                raise BinaryException('Truncated binary input.')
+            # NOTE: the magic is as long as a frame's prefix, another stream
+            #       can follow this one the way `cat` concatenates them.
+            if data == MAGIC:
+                continue
+            kind, size = FRAME.unpack(data)
+            return kind, marshal.loads(self.read(size))
+
+    def read_header(self):
+        if self.stdin.read(len(MAGIC)) != MAGIC:
+            raise BinaryException('The input is not binary gdt output.')
+        kind, header = self.read_frame()
+        if kind != HEADER:
+            raise BinaryException('The binary input has no header.')
+        return header['fields']
+
+    def get_field_names(self):
+        return self.fieldnames
+
+    def add_field_names(self, field_names):
+        self.added_field_names = [
+            field for field in field_names
+            if field not in (self.fieldnames or [])]
+
+    def select_fields(self, fields):
+        # Every value of a row is unmarshalled regardless.
+        pass
+
+    def write_header(self):
+        if self.fieldnames is None:
+            self.writer = JSONMessageCodec(None, self.stdout)
+        else:
+            self.writer = CSVWriter(self.stdout, union_fields(
+                [self.fieldnames, self.added_field_names]))
+            self.csv_writer = csv.writer(self.stdout)
+
+    def readrows(self):
+        index = {}
+        while True:
+            kind, value = self.read_frame()
+            if kind is None:
+                return
+            if kind == ROWS:
+                for values in value:
+                    yield Row(index, values)
+            elif kind == SCHEMA:
+                index = dict(
+                    (field, position) for position, field in enumerate(value))
+                if value == self.fieldnames:
+                    self.index = index
+
+    def writerow(self, message):
+        if self.writer is None:
+            self.write_header()
+        if self.fieldnames is None:
+            self.writer.writerow(dict(message.items()))
+        elif (isinstance(message, Row) and message.index is self.index and
+                message.extra is None):
+            # Rows with the fields of the header can be written as they are.
+            self.csv_writer.writerow(message.values + [
+                '' for _ in self.added_field_names])
+        else:
+            self.writer.writerow(message)
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
@@ -0,0 +1,145 @@
+import os
+from itertools import islice
+
+from gdt.index import get_checksum, iter_records
+from gdt.partial import PartialReader, write_partial
+from gdt.spill import merge_items
+
+
+class CheckpointException(Exception):
+    pass
+
+
+def is_file(stdin):
+    # Files opened by path can be read from an offset, anything else (a
+    # pipe, STDIN) is a stream of rows.
+    name = getattr(stdin, 'name', None)
+    return (isinstance(name, basestring) and os.path.isfile(name) and
+            hasattr(stdin, 'seek'))
+
+
+class Checkpoint(object):
+    """
+    The state of an aggregator saved along with how far into its input it
+    got. For files that's the offset of the end of the last complete
+    record read, for streams the number of rows read.
+
+    Resuming from a checkpoint only reads what comes after that, if a file
+    was rewritten rather than appended to it's read from the start.
+    """
+
+    def __init__(self, path, aggregator, codec_class, resume=False):
+        self.path = path
+        self.aggregator = aggregator
+        self.codec_class = codec_class
+        self.mark = None
+        self.offset = 0
+        self.rows = 0
+        self.input_path = None
+        self.checksum = None
+        if resume and os.path.isfile(path):
+            self.load()
+
+    def load(self):
+        fp = open(self.path, 'rb')
+        try:
+            reader = PartialReader(fp)
+        except Exception:
+            fp.close()
+            raise
+        fp.close()
+        if (reader.name != self.aggregator.name or
+                reader.config != self.aggregator.get_config()):
+            raise CheckpointException(
+                '%r is a checkpoint of a different aggregator.' % (
+                    self.path,))
+        self.mark = reader.mark
+
+    def get_saved_items(self):
+        if self.mark is None:
+            return []
+        fp = open(self.path, 'rb')
+        reader = PartialReader(fp)
+        return self.read_items(fp, reader)
+
+    def read_items(self, fp, reader):
+        try:
+            for item in reader.readitems():
+                yield item
+        finally:
+            fp.close()
+
+    def open_input(self, stdin):
+        """
+        Returns what the codec should read: everything in a file after the
+        checkpoint (plus the header) or the stream as is.
+        """
+        if not is_file(stdin):
+            if self.mark is not None and 'rows' not in self.mark:
+                # Saved from a file, a stream can't carry on from there.
+                self.mark = None
+            return stdin
+
+        self.input_path = stdin.name
+        start = 0
+        if self.mark is not None:
+            stdin.seek(0, os.SEEK_END)
+            size = stdin.tell()
+            offset = self.mark.get('offset')
+            if (offset is None or offset > size or
+                    get_checksum(stdin, offset) != self.mark['checksum']):
+                self.mark = None
+            else:
+                start = offset
+        return self.read_records(stdin, start)
+
+    def read_records(self, fp, start):
+        quoted_newlines = self.codec_class.quoted_newlines
+        if start and self.codec_class.has_header:
+            for _, header in iter_records(fp, 0, quoted_newlines):
+                yield header
+                break
+        self.offset = start
+        for offset, record in iter_records(fp, start, quoted_newlines):
+            self.offset = offset + len(record)
+            yield record
+        self.checksum = get_checksum(fp, self.offset)
+
+    def skip_rows(self, rows):
+        """
+        Skips the rows of a stream that were read before and counts them.
+        """
+        if self.input_path is not None:
+            return rows
+        if self.mark is not None:
+            self.rows = self.mark['rows']
+            rows = islice(rows, self.rows, None)
+        return self.count_rows(rows)
+
+    def count_rows(self, rows):
+        for row in rows:
+            self.rows += 1
+            yield row
+
+    def save(self, items):
+        """
+        Writes the saved state merged with the new `items` to the
+        checkpoint and returns the merged items read back from it.
+        """
+        if self.input_path is not None:
+            mark = {'offset': self.offset, 'checksum': self.checksum}
+        else:
+            mark = {'rows': self.rows}
+        temp_path = self.path + '.tmp'
+        fp = open(temp_path, 'wb')
+        try:
+            write_partial(
+                fp, self.aggregator.name, self.aggregator.get_config(),
+                self.aggregator.combine_items(
+                    merge_items([self.get_saved_items(), items])),
+                mark=mark)
+        finally:
+            fp.close()
+        os.rename(temp_path, self.path)
+        self.mark = mark
+        return self.get_saved_items()
@@ -1,14 +1,37 @@
 import argparse
+import shlex
+import sys
 import dateutil.parser
 from functools import partial
 
 from gdt import codec
+from gdt.batch import numpy
 from gdt.filters import (FilterPipeline, MSISDNFilter, TimestampFilter,
                          DirectionalFilter, SessionEventFilter, ContactFilter,
                          RegexFilter, WeekFilter)
 from gdt.extractors import ExtractorPipeline, FieldExtractor
 from gdt.aggregators import (AggregatorPipeline, UniquesAggregator,
-                             SimpleAggregator)
+                             SimpleAggregator, PivotAggregator,
+                             TopAggregator, RollupAggregator, MergePipeline,
+                             AggregatorException)
+from gdt.pipeline import ChainedPipeline, PipelineException
+from gdt.parallel import ParallelPipeline, ParallelException
+from gdt.columnar import (ConvertPipeline, ColumnarStore,
+                          ColumnarMessageCodec, STORE_BATCH_SIZE,
+                          is_columnar)
+from gdt.index import IndexPipeline, open_indexed
+from gdt.inputs import InputReader, expand_paths, is_compressed, read_inputs
+from gdt.binary import (BinaryMessageCodec, BinaryWriter, is_binary,
+                        is_binary_file, is_gdt_pipe)
+from gdt.sessions import (SessionAggregator, DEFAULT_TIMEOUT,
+                          DEFAULT_DATE_FORMAT, DEFAULT_CAPACITY)
+from gdt.stats import Stats
+from gdt.timestamps import GRANULARITIES
+
+
+# Options that apply to a whole `gdt` invocation rather than a subcommand.
+GLOBAL_ARGS = ['codec_class', 'input_path', 'jobs', 'batch_size', 'threaded',
+               'stats', 'stats_path']
 
 
 def make_pipeline(filter_class, kwargs, codec_class):
@@ -21,13 +44,67 @@ def make_extractor(extractor_class, kwargs, codec_class):
 
 
 def make_aggregator(aggregator_class, kwargs, codec_class):
-    return AggregatorPipeline(aggregator_class(**kwargs),
+    memory_limit = kwargs.pop('memory_limit')
+    if memory_limit is not None:
+        memory_limit = memory_limit * 1024 * 1024
+    partial = kwargs.pop('partial')
+    checkpoint_path = kwargs.pop('checkpoint_path')
+    resume = kwargs.pop('resume')
+    if resume and checkpoint_path is None:
+        raise AggregatorException('`--resume` requires a `--checkpoint`.')
+    rollup = kwargs.pop('rollup', None)
+    if rollup is not None:
+        aggregator = RollupAggregator(aggregator_class.name, kwargs, rollup)
+    else:
+        aggregator = aggregator_class(**kwargs)
+    return AggregatorPipeline(aggregator,
+                              codec_class=codec_class,
+                              memory_limit=memory_limit, partial=partial,
+                              checkpoint_path=checkpoint_path, resume=resume)
+
+
+def make_sessionizer(kwargs, codec_class):
+    return AggregatorPipeline(SessionAggregator(**kwargs),
                               codec_class=codec_class)
 
 
-def dispatch(args):
+def make_merger(kwargs, codec_class):
+    return MergePipeline(**kwargs)
+
+
+def make_converter(kwargs, codec_class):
+    return ConvertPipeline(codec_class=codec_class, **kwargs)
+
+
+def make_index(kwargs, codec_class):
+    return IndexPipeline(codec_class=codec_class, **kwargs)
+
+
+def make_chain(kwargs, codec_class):
+    parser = get_parser()
+    chain = ChainedPipeline(codec_class=codec_class)
+    for stage in kwargs['stages']:
+        stage_args = vars(parser.parse_args(shlex.split(stage)))
+        # These only apply to the input & output of the whole chain.
+        for name in GLOBAL_ARGS:
+            stage_args.pop(name)
+        if stage_args['subcommand_name'] == 'run':
+            raise PipelineException('`run` stages cannot be nested.')
+        if stage_args['subcommand_name'] == 'merge':
+            raise PipelineException('`merge` cannot be a `run` stage.')
+        chain.add(build_pipeline(stage_args, codec_class))
+    for stage in chain.stages[:-1]:
+        if getattr(stage, 'partial', False):
+            raise PipelineException(
+                'Only the last stage can write `--partial` output.')
+        if getattr(stage, 'checkpoint_path', None) is not None:
+            raise PipelineException(
+                'Only the last stage can save a `--checkpoint`.')
+    return chain
+
+
+def build_pipeline(args, codec_class):
     subcommand_name = args.pop('subcommand_name')
-    codec_class = args.pop('codec_class')
 
     dispatch_map = {
         'msisdn': partial(make_pipeline, MSISDNFilter),
@@ -40,27 +117,232 @@ def dispatch(args):
         'extract': partial(make_extractor, FieldExtractor),
         'aggregate': partial(make_aggregator, UniquesAggregator),
         'count': partial(make_aggregator, SimpleAggregator),
+        'pivot': partial(make_aggregator, PivotAggregator),
+        'top': partial(make_aggregator, TopAggregator),
+        'sessions': make_sessionizer,
+        'merge': make_merger,
+        'run': make_chain,
+        'convert': make_converter,
+        'index': make_index,
     }
 
-    pipeline = dispatch_map[subcommand_name](args, codec_class)
-    pipeline.process()
+    return dispatch_map[subcommand_name](args, codec_class)
+
+
+def set_batch_size(pipeline, batch_size):
+    for stage in getattr(pipeline, 'stages', [pipeline]):
+        stage.batch_size = batch_size
+
+
+def set_codec_class(pipeline, codec_class):
+    pipeline.codec_class = codec_class
+    for stage in getattr(pipeline, 'stages', []):
+        stage.codec_class = codec_class
+
+
+def set_writer_class(pipeline, writer_class):
+    pipeline.writer_class = writer_class
+    for stage in getattr(pipeline, 'stages', []):
+        stage.writer_class = writer_class
+
+
+def set_threaded(pipeline):
+    pipeline.threaded = True
+    for stage in getattr(pipeline, 'stages', []):
+        stage.threaded = True
+
+
+def reads_input(pipeline):
+    # These read the files they're given instead.
+    return not isinstance(pipeline, (MergePipeline, IndexPipeline))
+
+
+def get_time_windows(pipeline):
+    if hasattr(pipeline, 'get_time_windows'):
+        return pipeline.get_time_windows()
+    return None
+
+
+def is_checkpointed(pipeline):
+    last = getattr(pipeline, 'stages', [pipeline])[-1]
+    return getattr(last, 'checkpoint_path', None) is not None
+
+
+def dispatch(args):
+    codec_class = args.pop('codec_class')
+    input_path = args.pop('input_path')
+    jobs = args.pop('jobs')
+    batch_size = args.pop('batch_size')
+    threaded = args.pop('threaded')
+    stats = (Stats() if args.pop('stats') or args['stats_path'] is not None
+             else None)
+    stats_path = args.pop('stats_path')
+    # `--codec binary` asks for binary output, binary input is detected.
+    binary_output = codec_class is BinaryMessageCodec
+    if binary_output:
+        codec_class = codec.CSVMessageCodec
+    pipeline = build_pipeline(args, codec_class)
+    if batch_size:
+        set_batch_size(pipeline, batch_size)
+    if threaded:
+        set_threaded(pipeline)
+    if binary_output or (jobs == 1 and is_gdt_pipe(sys.stdout)):
+        if jobs > 1:
+            raise ParallelException(
+                '`--jobs` is not supported for binary output.')
+        set_writer_class(pipeline, BinaryWriter)
+    if stats is not None:
+        if jobs > 1:
+            raise ParallelException(
+                '`--stats` is not supported with `--jobs`.')
+        stats.instrument(pipeline)
+
+    process(pipeline, input_path, jobs)
+
+    if stats is not None:
+        write_stats(stats, stats_path)
+
+
+def write_stats(stats, stats_path):
+    if stats_path is None:
+        stats.write_report(sys.stderr)
+    elif stats_path == '-':
+        stats.write_json(sys.stderr)
+    else:
+        with open(stats_path, 'wb') as fp:
+            stats.write_json(fp)
+
+
+def process(pipeline, input_path, jobs):
+    if input_path is not None and is_columnar(input_path):
+        if jobs > 1:
+            raise ParallelException(
+                '`--jobs` is not supported for columnar exports.')
+        store = ColumnarStore(input_path)
+        windows = get_time_windows(pipeline)
+        if windows is not None:
+            store.restrict(windows)
+        pipeline.codec_class = ColumnarMessageCodec
+        # Stores are filtered a column at a time, which needs batches.
+        stages = getattr(pipeline, 'stages', [pipeline])
+        if numpy is not None and not any(
+                getattr(stage, 'batch_size', None) for stage in stages):
+            set_batch_size(pipeline, STORE_BATCH_SIZE)
+        pipeline.process(stdin=store)
+        return
+
+    paths = None if input_path is None else expand_paths(input_path)
+    # A single uncompressed text file can be read from any offset, for
+    # parallel jobs, indexes & checkpoints.
+    seekable = (paths is not None and len(paths) == 1 and
+                not is_compressed(paths[0]) and
+                not is_binary_file(paths[0]))
+    if jobs > 1:
+        if not seekable:
+            raise ParallelException(
+                '`--jobs` requires a single uncompressed `--input` file.')
+        ParallelPipeline(pipeline, jobs).process(paths[0])
+    elif seekable:
+        # Checkpoints record offsets into the file itself, not an index.
+        stdin = (None if is_checkpointed(pipeline)
+                 else open_indexed(paths[0], pipeline))
+        if stdin is not None:
+            pipeline.process(stdin=stdin)
+        else:
+            with open(paths[0], 'rb') as stdin:
+                pipeline.process(stdin=stdin)
+    elif paths is not None and len(paths) > 1:
+        pipeline.process(stdin=read_inputs(paths, pipeline.codec_class))
+    else:
+        stdin = (InputReader.open_stdin() if paths is None
+                 else InputReader.open(paths[0]))
+        if reads_input(pipeline) and is_binary(stdin):
+            set_codec_class(pipeline, BinaryMessageCodec)
+        pipeline.process(stdin=stdin)
 
 
 def get_codec(codec_name):
     return {
         'csv': codec.CSVMessageCodec,
         'json': codec.JSONMessageCodec,
+        'binary': BinaryMessageCodec,
     }.get(codec_name)
 
 
+def add_aggregator_arguments(parser):
+    parser.add_argument(
+        '-M', '--memory-limit', help="""Roughly how many MB aggregated data
+        can take up before it's written to temporary files, which are
+        merged at the end.""",
+        dest='memory_limit', type=int, default=None)
+    parser.add_argument(
+        '--checkpoint', help="""Save the aggregated state & how far into
+        the input it got to this file.""",
+        dest='checkpoint_path', default=None)
+    parser.add_argument(
+        '--resume', help="""Carry on from the `--checkpoint`, only
+        aggregating rows appended to the `--input` file (or STDIN rows past
+        the ones already read) since it was saved.""",
+        dest='resume', action='store_true', default=False)
+    add_partial_argument(parser)
+
+
+def add_rollup_argument(parser):
+    parser.add_argument(
+        '-R', '--rollup', help="""Bucket raw timestamps by minute, hour, day
+        and ISO week (or just the ones given) in one pass, instead of
+        grouping rows by their timestamp as is. Coarser buckets are merged
+        from finer ones.""",
+        dest='rollup', nargs='*', choices=GRANULARITIES, default=None,
+        metavar='GRANULARITY')
+
+
+def add_partial_argument(parser):
+    parser.add_argument(
+        '--partial', help="""Write the aggregated state instead of the
+        results, to combine with other partial output using `gdt merge`.""",
+        dest='partial', action='store_true', default=False)
+
+
 def get_parser():
 
     parser = argparse.ArgumentParser(description="""Vumi Go Data Tools for CSV and JSON
         formatted data from STDIN. Use `--codec` to specify. Designed to pipe output from one 
         subcommand to another. Use `gdt subcommand --help` for more info.""")
     parser.add_argument(
-        '-c', '--codec', help='Which codec to use.', required=False,
+        '-c', '--codec', help="""Which codec to use: csv, json or binary.
+        Binary output is for another `gdt` to read and is used by default
+        when piping to one, binary input is always detected.""",
+        required=False,
         dest='codec_class', type=get_codec, default=codec.CSVMessageCodec)
+    parser.add_argument(
+        '-i', '--input', help="""Read from this file instead of STDIN. A
+        glob (e.g. "exports/*.csv.gz") reads every file that matches in
+        turn. gzip, bz2 & xz compressed input is decompressed.""",
+        required=False, dest='input_path', default=None)
+    parser.add_argument(
+        '-j', '--jobs', help=('Number of processes to filter an `--input` '
+                              'file with. Output order is preserved.'),
+        required=False, dest='jobs', type=int, default=1)
+    parser.add_argument(
+        '-b', '--batch-size', help=('Filter & aggregate rows in batches of '
+                                    'this size with the NumPy engine, '
+                                    'around 1000 is fastest.'),
+        required=False, dest='batch_size', type=int, default=None)
+    parser.add_argument(
+        '-T', '--threaded', help="""Read & decode, process and encode &
+        write rows in threads of their own, so that waiting on slow input
+        or output overlaps with the rest.""",
+        dest='threaded', action='store_true', default=False)
+    parser.add_argument(
+        '--stats', help="""Write the rows read & written, how selective
+        each filter is, the time spent in the codec, each stage & filter and
+        the peak memory use to STDERR when done.""",
+        dest='stats', action='store_true', default=False)
+    parser.add_argument(
+        '--stats-json', help="""Write the `--stats` as JSON to this file
+        instead, `-` for STDERR.""",
+        dest='stats_path', required=False)
 
     subparsers = parser.add_subparsers(help='use `command --help`.')
 
@@ -126,6 +408,23 @@ def get_parser():
         '-a', '--address', required=False, dest='addresses', nargs='+', 
         help="""Addresses should be space seperated. Or from a file using 
         `@filename.txt`, where addresses are one per line in file""")
+    contact_parser.add_argument(
+        '-f', '--file', required=False, dest='addresses_path',
+        help="""A file with one address per line. It's read a line at a
+        time so it's better suited to large contact groups than `@`.""")
+    contact_parser.add_argument(
+        '-t', '--addr-type', help='Which address type to filter on.',
+        dest='addr_type', choices=['to_addr', 'from_addr'],
+        default='from_addr', required=False)
+    contact_parser.add_argument(
+        '--country-code', required=False, dest='country_code',
+        help="""Country calling code (e.g. 27) for addresses in the
+        local `0` format.""")
+    contact_parser.add_argument(
+        '-e', '--error-rate', required=False, dest='error_rate', type=float,
+        help="""Keep the addresses in a Bloom filter instead of a set, using
+        far less memory but letting through about this fraction of other
+        addresses (e.g. 0.001).""")
     contact_parser.set_defaults(subcommand_name='contacts')
 
     regex_parser = subparsers.add_parser(
@@ -133,8 +432,16 @@ def get_parser():
     regex_parser.add_argument(
         '-f', '--field', required=True, dest='field')
     regex_parser.add_argument(
-        '-p', '--pattern', required=True, dest='pattern', help="""By default
+        '-p', '--pattern', required=False, dest='pattern', help="""By default
         a pattern will be case-sensitive. Use `-i` to ignore case.""")
+    regex_parser.add_argument(
+        '-P', '--patterns-file', required=False, dest='patterns_path',
+        help="""A file with one pattern per line. Rows that match any of
+        them are kept.""")
+    regex_parser.add_argument(
+        '-m', '--match-field', required=False, dest='match_field',
+        help="""Add a field with the first pattern that matched to every
+        row.""")
     regex_parser.add_argument(
         '-i', '--ignore-case', required=False, dest='ignore_case',
         action='store_const', const=True, default=False)
@@ -156,6 +463,18 @@ def get_parser():
     aggregator_parser.add_argument(
         '-f', '--field', help='The field(s) to extract. Enter space seperated list.',
         dest='fields', required=True, nargs='+')
+    aggregator_parser.add_argument(
+        '-a', '--approximate', help="""Count unique values with HyperLogLog
+        sketches that use a fixed amount of memory per timestamp instead of
+        keeping every value.""",
+        dest='approximate', action='store_true', default=False)
+    aggregator_parser.add_argument(
+        '-p', '--precision', help="""Sketches use 2 ** PRECISION bytes and
+        are off by about 1.04 / sqrt(2 ** PRECISION), from 4 to 16. Defaults
+        to 12 (4KB, 1.6%%).""",
+        dest='precision', type=int, default=None)
+    add_rollup_argument(aggregator_parser)
+    add_aggregator_arguments(aggregator_parser)
     aggregator_parser.set_defaults(subcommand_name='aggregate')
 
     count_parser = subparsers.add_parser(
@@ -163,6 +482,119 @@ def get_parser():
     count_parser.add_argument(
         '-f', '--field', help='The field(s) to extract. Enter space seperated list.',
         dest='fields', required=True, nargs='+')
+    add_rollup_argument(count_parser)
+    add_aggregator_arguments(count_parser)
     count_parser.set_defaults(subcommand_name='count')
 
+    pivot_parser = subparsers.add_parser(
+        'pivot', help='Calculate several metrics per group in one pass')
+    pivot_parser.add_argument(
+        '-g', '--group-by', help="""The field(s) to group rows by. Enter
+        space seperated list.""",
+        dest='group_by', required=True, nargs='+')
+    pivot_parser.add_argument(
+        '-m', '--metric', help="""The metric(s) to calculate per group:
+        `count`, `distinct:FIELD`, `min:FIELD`, `max:FIELD`, `first:FIELD`
+        or `last:FIELD`. Enter space seperated list.""",
+        dest='metrics', required=True, nargs='+')
+    pivot_parser.add_argument(
+        '-df', '--date-format', help="""`strftime` formatting to apply to
+        the timestamp when grouping by it.""",
+        dest='date_format', required=False)
+    add_aggregator_arguments(pivot_parser)
+    pivot_parser.set_defaults(subcommand_name='pivot')
+
+    top_parser = subparsers.add_parser(
+        'top', help='Find the most frequent values of a field.')
+    top_parser.add_argument(
+        '-f', '--field', help='The field to count the values of.',
+        dest='field', required=True)
+    top_parser.add_argument(
+        '-k', '--top', help='Number of values to write per bucket.',
+        dest='k', type=int, default=10)
+    top_parser.add_argument(
+        '--capacity', help="""Values to keep a count of per bucket, counts
+        are over by at most the bucket's rows divided by this. Defaults to
+        1000.""",
+        dest='capacity', type=int, default=None)
+    top_parser.add_argument(
+        '-df', '--date-format', help="""`strftime` formatting to bucket the
+        rows by, all of them are counted together without one.""",
+        dest='date_format', required=False)
+    top_parser.add_argument(
+        '-w', '--words', help="""Count the words of the field, lower
+        cased, instead of its values (e.g. keywords in `content`).""",
+        dest='words', action='store_true', default=False)
+    add_aggregator_arguments(top_parser)
+    top_parser.set_defaults(subcommand_name='top')
+
+    sessions_parser = subparsers.add_parser(
+        'sessions', help='Count sessions & returning visitors per subscriber.')
+    sessions_parser.add_argument(
+        '-t', '--timeout', help="""Seconds without a message after which a
+        session is over, if it wasn't closed. Defaults to 300.""",
+        dest='timeout', type=float, default=DEFAULT_TIMEOUT)
+    sessions_parser.add_argument(
+        '-df', '--date-format', help="""`strftime` formatting to bucket
+        sessions by their start with. Defaults to `%%Y-%%m-%%d`, buckets
+        need to sort in time order.""",
+        dest='date_format', default=DEFAULT_DATE_FORMAT)
+    sessions_parser.add_argument(
+        '--cohorts', help="""Write the visitors of every bucket by the
+        bucket they first visited in instead.""",
+        dest='cohorts', action='store_true', default=False)
+    sessions_parser.add_argument(
+        '-e', '--error-rate', help="""Remember past visitors in a Bloom
+        filter & count visitors with HyperLogLog sketches instead of keeping
+        every address, so about this fraction of new visitors are taken for
+        returning ones (e.g. 0.001).""",
+        dest='error_rate', type=float, required=False)
+    sessions_parser.add_argument(
+        '--capacity', help="""Number of subscribers to size the Bloom
+        filter for with `--error-rate`. Defaults to 1000000.""",
+        dest='capacity', type=int, default=DEFAULT_CAPACITY)
+    sessions_parser.set_defaults(subcommand_name='sessions')
+
+    merge_parser = subparsers.add_parser(
+        'merge', help='Combine partial aggregator output.')
+    merge_parser.add_argument(
+        'paths', help="""Files written by `aggregate`, `count`, `pivot` or
+        `top` (with or without `--rollup`) with `--partial`, all by the same
+        subcommand & options.""",
+        nargs='+')
+    add_partial_argument(merge_parser)
+    merge_parser.set_defaults(subcommand_name='merge')
+
+    run_parser = subparsers.add_parser(
+        'run', help='Chain subcommands in a single process.')
+    run_parser.add_argument(
+        'stages', nargs='+', help="""Quoted subcommands to run in order,
+        e.g. "direction -d inbound" "extract -f to_addr -df %%Y". Rows are
+        passed from one stage to the next in memory instead of via pipes,
+        adjacent filters are run most selective first.""")
+    run_parser.set_defaults(subcommand_name='run')
+
+    convert_parser = subparsers.add_parser(
+        'convert', help='Convert to a columnar export for repeated queries.')
+    convert_parser.add_argument(
+        '-o', '--output', help="""Directory to write the columnar export to.
+        Pass it to `--input` to query it.""",
+        dest='output_path', required=True)
+    convert_parser.set_defaults(subcommand_name='convert')
+
+    index_parser = subparsers.add_parser(
+        'index', help='Index an export file by timestamp & address.')
+    index_parser.add_argument(
+        'path', help="""The export file to index. The index is written next
+        to it and is kept up to date as `daterange` & `weekrange` use it
+        with `--input`.""")
+    index_parser.add_argument(
+        '-b', '--block-size', help='Number of records per index entry.',
+        dest='block_size', type=int, required=False)
+    index_parser.add_argument(
+        '--addresses', help="""Also index the `to_addr` & `from_addr` of
+        every record for `msisdn` & `contacts` to use with `--input`.""",
+        dest='addresses', action='store_true', default=False)
+    index_parser.set_defaults(subcommand_name='index')
+
     return parser
@@ -1,35 +1,343 @@
 import csv
 import json
+from itertools import islice
+
+
+# The first of these that's installed reads & writes JSON rows.
+JSON_BACKENDS = ['ujson', 'simplejson', 'json']
+
+# Rows the JSON codec buffers before writing them out.
+WRITE_BATCH_SIZE = 1000
+
+
+def get_json_backend(names=JSON_BACKENDS):
+    for name in names:
+        try:
+            return __import__(name)
+        except ImportError:
+            pass
+    return json
+
+
+def unique(fields):
+    seen = set()
+    for field in fields:
+        if field not in seen:
+            seen.add(field)
+            yield field
+
+
+def union_fields(field_lists):
+    """
+    All the fields in `field_lists`, `None` (any field) if any of them
+    are `None`.
+    """
+    fields = []
+    for field_list in field_lists:
+        if field_list is None:
+            return None
+        fields.extend(field for field in field_list if field not in fields)
+    return fields
+
+
+def get_input_fields(stages):
+    """
+    The fields of the input rows that a list of pipeline stages look at.
+    Only stages up to the first one that changes the shape of the rows see
+    them, if none do the rows are written out whole.
+    """
+    field_lists = []
+    for stage in stages:
+        field_lists.append(stage.get_required_fields())
+        if stage.get_output_field_names() is not None:
+            return union_fields(field_lists)
+    return None
+
+
+def make_codec(codec_class, stdin, stdout, write_header=True,
+               added_field_names=None):
+    """
+    Sets up a codec that also writes the fields filters add to rows.
+    """
+    if not added_field_names:
+        return codec_class(stdin, stdout, write_header=write_header)
+    codec = codec_class(stdin, stdout, write_header=False)
+    codec.add_field_names(added_field_names)
+    if write_header:
+        codec.write_header()
+    return codec
+
+
+def get_writer(codec, stdout, writer_class=None, added_field_names=None):
+    """
+    What rows read with `codec` are written with: the codec itself or, if
+    a `writer_class` is given, one of those for the fields the codec read
+    plus the `added_field_names`.
+    """
+    if writer_class is None:
+        return codec
+    field_names = codec.get_field_names()
+    if field_names is not None:
+        field_names = union_fields([field_names, added_field_names or []])
+    return writer_class(stdout, field_names)
+
+
+def make_writer(stdout, field_names, writer_class=None):
+    """
+    A writer for the rows of pipelines that change their shape, CSV
+    unless another `writer_class` is given.
+    """
+    return (CSVWriter if writer_class is None else writer_class)(
+        stdout, field_names)
+
+
+class CSVWriter(object):
+
+    def __init__(self, stdout, field_names):
+        self.writer = csv.DictWriter(stdout, fieldnames=field_names)
+        # writer.writeheader() only available in py27
+        self.writer.writerow(dict(zip(field_names, field_names)))
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+
+    def flush(self):
+        pass
+
+
+class Row(object):
+    """
+    A CSV row. Fields are looked up through a field-index map that every
+    row of a file shares instead of a dict per row. Fields that aren't in
+    the file, like the ones filters add, are kept separately.
+    """
+
+    __slots__ = ['index', 'values', 'extra']
+
+    def __init__(self, index, values):
+        self.index = index
+        self.values = values
+        self.extra = None
+
+    def __getitem__(self, key):
+        position = self.index.get(key)
+        if position is not None:
+            return self.values[position]
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        position = self.index.get(key)
+        if position is not None:
+            self.values[position] = value
+            return
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __contains__(self, key):
+        return key in self.index or (
+            self.extra is not None and key in self.extra)
+
+    def get(self, key, default=None):
+        position = self.index.get(key)
+        if position is not None:
+            return self.values[position]
+        if self.extra is None:
+            return default
+        return self.extra.get(key, default)
+
+    def keys(self):
+        keys = sorted(self.index, key=self.index.get)
+        if self.extra is not None:
+            keys.extend(key for key in self.extra if key not in self.index)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __eq__(self, other):
+        if not hasattr(other, 'items'):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Row(%r)' % (dict(self.items()),)
 
 
 class CSVMessageCodec(object):
 
+    # The first record names the fields and values can contain newlines
+    # when quoted.
+    name = 'csv'
+    has_header = True
+    quoted_newlines = True
+
     def __init__(self, stdin, stdout, write_header=True):
-        self.reader = csv.DictReader(stdin)
-        self.writer = csv.DictWriter(
-            stdout, fieldnames=self.reader.fieldnames)
+        self.stdout = stdout
+        self.reader = csv.reader(stdin)
+        self.fieldnames = next(self.reader, None)
+        # Rows of the file are written as they were read, with the values
+        # of any fields filters added after them.
+        self.index = dict(
+            (field, position)
+            for position, field in enumerate(self.fieldnames or []))
+        self.positions = None
+        self.added_field_names = []
+        self.csv_writer = csv.writer(stdout)
+        self.writer = csv.DictWriter(stdout, fieldnames=self.fieldnames)
         if write_header:
-            # writer.writeheader() only available in py27
-            self.writer.writerow(
-                dict(zip(self.reader.fieldnames, self.reader.fieldnames)))
+            self.write_header()
+
+    def get_field_names(self):
+        return self.fieldnames
+
+    def add_field_names(self, field_names):
+        # Fields that filters add to the rows they let through.
+        fieldnames = list(self.writer.fieldnames or [])
+        fieldnames.extend(
+            field for field in field_names if field not in fieldnames)
+        self.writer = csv.DictWriter(self.stdout, fieldnames=fieldnames)
+        self.added_field_names = [
+            field for field in fieldnames if field not in self.index]
+
+    def select_fields(self, fields):
+        """
+        Only decode `fields` into the rows that are read, for pipelines
+        that don't write rows out as they are. `None` selects every field.
+        """
+        if fields is None:
+            self.positions = None
+            return
+        fields = [field for field in unique(fields)
+                  if field in self.index]
+        self.positions = [self.index[field] for field in fields]
+        self.selected_index = dict(
+            (field, position) for position, field in enumerate(fields))
+
+    def write_header(self):
+        # writer.writeheader() only available in py27
+        self.writer.writerow(
+            dict(zip(self.writer.fieldnames, self.writer.fieldnames)))
 
     def readrows(self):
-        return self.reader
+        if self.fieldnames is None:
+            return
+        width = len(self.fieldnames)
+        positions = self.positions
+        for values in self.reader:
+            # Like `csv.DictReader`, skip blank lines and leave fields a
+            # short row doesn't have empty.
+            if not values:
+                continue
+            if len(values) < width:
+                values.extend([None] * (width - len(values)))
+            if positions is None:
+                yield Row(self.index, values)
+            else:
+                yield Row(self.selected_index,
+                          [values[position] for position in positions])
+
+    def readvalues(self, batch_size):
+        """
+        Yields the values of up to `batch_size` rows at a time, in the
+        positions of `index`, for the batch engine to take columns from.
+        """
+        if self.fieldnames is None:
+            return
+        width = len(self.fieldnames)
+        while True:
+            batch = list(islice(self.reader, batch_size))
+            if not batch:
+                return
+            if min(map(len, batch)) < width:
+                batch = [values + [None] * (width - len(values))
+                         for values in batch if values]
+            yield batch
 
     def writerow(self, message):
+        if isinstance(message, Row) and message.index is self.index:
+            values = message.values
+            if self.added_field_names:
+                values = values + [message.get(field, '')
+                                   for field in self.added_field_names]
+            self.csv_writer.writerow(values)
+            return
         self.writer.writerow(message)
 
+    def flush(self):
+        pass
+
 
 class JSONMessageCodec(object):
 
+    name = 'json'
+    has_header = False
+    quoted_newlines = False
+
+    backend = get_json_backend()
+    write_batch_size = WRITE_BATCH_SIZE
+
     def __init__(self, stdin, stdout, write_header=True):
         self.stdin = stdin
         self.stdout = stdout
+        self.buffer = []
+
+    def get_field_names(self):
+        # JSON rows don't all need to have the same fields.
+        return None
+
+    def add_field_names(self, field_names):
+        pass
+
+    def write_header(self):
+        pass
+
+    def select_fields(self, fields):
+        # Every field of a JSON row is decoded regardless.
+        pass
+
+    def loads(self, line):
+        return self.backend.loads(line)
+
+    def dumps(self, message):
+        if self.backend.__name__ == 'ujson':
+            # Unlike the others ujson escapes `/` by default.
+            return self.backend.dumps(message, escape_forward_slashes=False)
+        return self.backend.dumps(message)
 
     def readrows(self):
+        # NOTE: lines are decoded one at a time, joining a batch of them
+        #       into one JSON array isn't any faster with the standard
+        #       library & keeps all of the batch's rows alive at once.
+        loads = self.loads
         for line in self.stdin:
-            yield json.loads(line)
+            yield loads(line)
 
     def writerow(self, message):
-        row = json.dumps(message)
-        self.stdout.write('%s\n' % (row.encode('utf-8'),))
+        row = self.dumps(message)
+        self.buffer.append(row.encode('utf-8'))
+        if len(self.buffer) >= self.write_batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes out the rows that are buffered, pipelines call this once
+        they're done writing rows.
+        """
+        if self.buffer:
+            self.stdout.write('%s\n' % ('\n'.join(self.buffer),))
+            self.buffer = []
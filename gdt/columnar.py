@@ -0,0 +1,681 @@
+import csv
+import json
+import os
+import struct
+import sys
+from itertools import izip, repeat
+
+from gdt.batch import ColumnBatch, numpy
+from gdt.codec import CSVMessageCodec, Row, unique
+from gdt.index import merge_ranges, open_mmap, to_epoch_window
+from gdt.timestamps import parse_timestamp, to_epoch
+
+
+MANIFEST = 'manifest.json'
+VERSION = 1
+
+# Fields with few distinct values are dictionary encoded, everything else
+# is stored as variable length text.
+DICTIONARY_FIELDS = set([
+    'from_addr', 'to_addr', 'session_event', 'direction', 'transport_type',
+    'transport_name', 'provider', 'delivery_status', 'endpoint',
+    'network_handover_status', 'network_handover_reason', 'message_type',
+    'message_version', 'group',
+])
+
+# Marks a missing timestamp in the epoch column.
+NO_TIMESTAMP = -2 ** 63
+
+FLUSH_SIZE = 64 * 1024
+
+# Rows read from a store at a time when no batch size is given.
+STORE_BATCH_SIZE = 10000
+
+
+class ColumnarException(Exception):
+    pass
+
+
+def is_columnar(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def as_array(data, dtype):
+    # Empty column files are mapped as an empty string.
+    if not data:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.frombuffer(data, dtype=dtype)
+
+
+class FixedColumnWriter(object):
+
+    def __init__(self, path, fmt):
+        self.fp = open(path, 'wb')
+        self.fmt = fmt
+        self.buffer = []
+
+    def append(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.fp.write(struct.pack(
+            '<%d%s' % (len(self.buffer), self.fmt), *self.buffer))
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.fp.close()
+
+
+class TextColumnWriter(object):
+
+    def __init__(self, path):
+        self.data = open(path + '.data', 'wb')
+        self.offsets = FixedColumnWriter(path + '.offsets', 'q')
+        self.position = 0
+        self.offsets.append(self.position)
+
+    def append(self, value):
+        self.data.write(value)
+        self.position += len(value)
+        self.offsets.append(self.position)
+
+    def close(self):
+        self.data.close()
+        self.offsets.close()
+
+
+class DictionaryColumnWriter(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.codes = FixedColumnWriter(path + '.codes', 'I')
+        self.lookup = {}
+        self.values = []
+
+    def append(self, value):
+        try:
+            code = self.lookup[value]
+        except KeyError:
+            code = self.lookup[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def close(self):
+        self.codes.close()
+        values = TextColumnWriter(self.path + '.values')
+        for value in self.values:
+            values.append(value)
+        values.close()
+
+
+class TextColumn(object):
+
+    def __init__(self, path):
+        self.data = open_mmap(path + '.data')
+        self.offsets = open_mmap(path + '.offsets')
+
+    def __getitem__(self, index):
+        start, end = struct.unpack_from('<2q', self.offsets, index * 8)
+        return self.data[start:end]
+
+    def read(self, start, end):
+        """
+        Returns the values of the rows from `start` to `end`.
+        """
+        offsets = as_array(self.offsets, '<i8')[start:end + 1].tolist()
+        data = self.data
+        return [data[offset:next_offset]
+                for offset, next_offset in izip(offsets, offsets[1:])]
+
+    def take(self, indexes):
+        """
+        Returns the values of the rows at `indexes`, an array.
+        """
+        offsets = as_array(self.offsets, '<i8')
+        data = self.data
+        return [data[offset:next_offset] for offset, next_offset in izip(
+            offsets.take(indexes).tolist(),
+            offsets.take(indexes + 1).tolist())]
+
+
+class DictionaryColumn(object):
+
+    def __init__(self, path):
+        self.codes = open_mmap(path + '.codes')
+        values = TextColumn(path + '.values')
+        self.values = [values[index]
+                       for index in range(len(values.offsets) // 8 - 1)]
+        self.value_array = None
+
+    def __getitem__(self, index):
+        return self.values[struct.unpack_from('<I', self.codes, index * 4)[0]]
+
+    def read_codes(self, start, end):
+        return as_array(self.codes, '<u4')[start:end]
+
+    def read(self, start, end):
+        return self.lookup(self.read_codes(start, end))
+
+    def take(self, indexes):
+        return self.lookup(as_array(self.codes, '<u4').take(indexes))
+
+    def lookup(self, codes):
+        if self.value_array is None:
+            self.value_array = numpy.empty(len(self.values), dtype=object)
+            self.value_array[:] = self.values
+        return self.value_array.take(codes).tolist()
+
+
+class FixedColumn(object):
+
+    def __init__(self, path, fmt):
+        self.data = open_mmap(path)
+        self.fmt = '<' + fmt
+        self.size = struct.calcsize(self.fmt)
+
+    def __getitem__(self, index):
+        return struct.unpack_from(self.fmt, self.data, index * self.size)[0]
+
+
+class ColumnarWriter(object):
+    """
+    Writes rows to a directory with a file (or two) per column. Values
+    are stored as raw strings for CSV exports and JSON encoded for JSON
+    exports, an empty string marks a field that a JSON row didn't have.
+    """
+
+    def __init__(self, path, codec_name, fields=None):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.codec_name = codec_name
+        self.fields = []
+        self.columns = {}
+        self.rows = 0
+        self.sorted = True
+        self.last_epoch = NO_TIMESTAMP
+        self.epochs = FixedColumnWriter(
+            os.path.join(path, 'timestamp.epoch'), 'q')
+        # When the fields are known upfront (CSV) anything else is ignored,
+        # otherwise (JSON) columns are added as new fields show up.
+        self.fixed_fields = fields is not None
+        for field in (fields or []):
+            self.add_field(field)
+
+    def add_field(self, field):
+        path = os.path.join(self.path, 'column-%d' % (len(self.fields),))
+        if field in DICTIONARY_FIELDS:
+            column = DictionaryColumnWriter(path)
+        else:
+            column = TextColumnWriter(path)
+        # Rows written before this field showed up didn't have it.
+        for _ in range(self.rows):
+            column.append('')
+        self.fields.append(field)
+        self.columns[field] = column
+        return column
+
+    def encode(self, value):
+        if self.codec_name == 'json':
+            return json.dumps(value)
+        if value is None:
+            return ''
+        return value
+
+    def write(self, row):
+        if not self.fixed_fields:
+            for field in row:
+                if field not in self.columns:
+                    self.add_field(field)
+        for field in self.fields:
+            self.columns[field].append(
+                self.encode(row[field]) if field in row else '')
+
+        try:
+            epoch = to_epoch(parse_timestamp(row['timestamp']))
+        except (KeyError, TypeError, ValueError):
+            epoch = NO_TIMESTAMP
+        if epoch < self.last_epoch:
+            self.sorted = False
+        self.last_epoch = max(epoch, self.last_epoch)
+        self.epochs.append(epoch)
+        self.rows += 1
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+        self.epochs.close()
+
+        manifest = {
+            'version': VERSION,
+            'codec': self.codec_name,
+            'rows': self.rows,
+            'sorted': self.sorted,
+            'fields': self.fields,
+            'columns': dict(
+                (field, {
+                    'path': 'column-%d' % (index,),
+                    'kind': ('dictionary' if field in DICTIONARY_FIELDS
+                             else 'text'),
+                }) for index, field in enumerate(self.fields)),
+        }
+        fp = open(os.path.join(self.path, MANIFEST), 'wb')
+        try:
+            json.dump(manifest, fp, indent=2)
+        finally:
+            fp.close()
+
+
+class ColumnarStore(object):
+    """
+    Reads a directory written by `ColumnarWriter`. Column files are memory
+    mapped when they're first used so only the columns a query looks at
+    are ever read from disk.
+    """
+
+    def __init__(self, path):
+        if not is_columnar(path):
+            raise ColumnarException('%r is not a columnar export.' % (path,))
+        self.path = path
+        fp = open(os.path.join(path, MANIFEST), 'rb')
+        try:
+            manifest = json.load(fp)
+        finally:
+            fp.close()
+        if manifest['version'] != VERSION:
+            raise ColumnarException(
+                'Unsupported columnar export version %r.' % (
+                    manifest['version'],))
+        self.codec_name = manifest['codec']
+        self.rows = manifest['rows']
+        self.sorted = manifest['sorted']
+        # CSV field names are written back out the way they were read in.
+        decode = ((lambda field: field.encode('utf-8'))
+                  if self.codec_name == 'csv' else (lambda field: field))
+        self.fields = [decode(field) for field in manifest['fields']]
+        self.field_set = set(self.fields)
+        # Rows of CSV stores are made with their values in this order, like
+        # the rows of the export were read.
+        self.index = dict(
+            (field, position) for position, field in enumerate(self.fields))
+        self.column_info = dict(
+            (decode(field), info)
+            for field, info in manifest['columns'].items())
+        self.columns = {}
+        self._epochs = None
+        self.row_ranges = None
+
+    def __len__(self):
+        return self.rows
+
+    def find_rows(self, epoch):
+        # The first row at or after `epoch`, only valid for sorted stores.
+        epochs = self.epochs()
+        low, high = 0, self.rows
+        while low < high:
+            middle = (low + high) // 2
+            if epochs[middle] < epoch:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def restrict(self, windows):
+        """
+        Only read the rows in the given time windows. Without a sort order
+        to search through every row is still read.
+        """
+        if not self.sorted:
+            return
+        ranges = []
+        for window in windows:
+            start, end = to_epoch_window(window)
+            ranges.append((self.find_rows(start), self.find_rows(end)))
+        self.row_ranges = merge_ranges(ranges)
+
+    def column(self, field):
+        try:
+            return self.columns[field]
+        except KeyError:
+            pass
+        info = self.column_info[field]
+        path = os.path.join(self.path, info['path'])
+        if info['kind'] == 'dictionary':
+            column = DictionaryColumn(path)
+        else:
+            column = TextColumn(path)
+        self.columns[field] = column
+        return column
+
+    def epochs(self):
+        if self._epochs is None:
+            self._epochs = FixedColumn(
+                os.path.join(self.path, 'timestamp.epoch'), 'q')
+        return self._epochs
+
+    def get_value(self, field, index):
+        if field not in self.field_set:
+            raise KeyError(field)
+        value = self.column(field)[index]
+        if self.codec_name == 'json':
+            if not value:
+                raise KeyError(field)
+            return json.loads(value)
+        return value
+
+    def has_value(self, field, index):
+        if field not in self.field_set:
+            return False
+        return self.codec_name != 'json' or bool(self.column(field)[index])
+
+    def decode(self, values):
+        if self.codec_name == 'json':
+            # A missing field is `None` for batches, like `row.get()`.
+            return [json.loads(value) if value else None for value in values]
+        return values
+
+    def read_column(self, field, start, end):
+        return self.decode(self.column(field).read(start, end))
+
+    def read_categorical(self, field, start, end):
+        """
+        Returns `(codes, categories)` for the values of a dictionary encoded
+        `field` in the rows from `start` to `end`, `None` for other fields.
+        """
+        column = self.column(field)
+        if not isinstance(column, DictionaryColumn):
+            return None
+        distinct, codes = numpy.unique(
+            column.read_codes(start, end), return_inverse=True)
+        return (codes.astype(numpy.int32),
+                self.decode(column.lookup(distinct)))
+
+    def read_epochs(self, start, end):
+        return as_array(self.epochs().data, '<i8')[start:end]
+
+    def take_rows(self, indexes):
+        """
+        Returns rows with all of the values of the rows at `indexes`, an
+        array, for CSV stores.
+        """
+        columns = [self.column(field).take(indexes) for field in self.fields]
+        index = self.index
+        return [Row(index, list(values)) for values in izip(*columns)]
+
+    def encode_rows(self, indexes):
+        """
+        Returns the rows at `indexes`, an array, JSON encoded from the
+        values as they're stored, for JSON stores.
+        """
+        fields = self.fields
+        columns = [self.column(field).take(indexes) for field in fields]
+        keys = dict((field, json.dumps(field)) for field in fields)
+        lines = []
+        for values in izip(*columns):
+            # NOTE: a dict of the row's values is made first so the fields
+            #       are in the order `json.dumps()` writes the row's items.
+            row = dict(
+                (field, value) for field, value in izip(fields, values)
+                if value)
+            lines.append('{%s}' % (', '.join(
+                '%s: %s' % (keys[field], value)
+                for field, value in row.iteritems()),))
+        return lines
+
+    def get_row_ranges(self):
+        if self.row_ranges is None:
+            return [(0, self.rows)]
+        return self.row_ranges
+
+    def readrows(self):
+        for start, end in self.get_row_ranges():
+            for index in xrange(start, end):
+                yield ColumnarRow(self, index)
+
+    def read_fields(self, fields, batch_size=STORE_BATCH_SIZE):
+        """
+        Yields rows with only the values of `fields`, read for a batch of
+        rows at a time, for CSV stores.
+        """
+        fields = [field for field in unique(fields) if field in self.field_set]
+        index = dict(
+            (field, position) for position, field in enumerate(fields))
+        for start, end in self.get_row_ranges():
+            for batch_start in xrange(start, end, batch_size):
+                batch_end = min(batch_start + batch_size, end)
+                columns = [self.column(field).read(batch_start, batch_end)
+                           for field in fields]
+                for values in (izip(*columns) if columns else
+                               repeat((), batch_end - batch_start)):
+                    yield Row(index, list(values))
+
+    def read_batches(self, batch_size):
+        for start, end in self.get_row_ranges():
+            for batch_start in xrange(start, end, batch_size):
+                yield ColumnarBatch(
+                    self, batch_start, min(batch_start + batch_size, end))
+
+
+class ColumnarRow(object):
+    """
+    A row of a `ColumnarStore` that only reads the values that are asked
+    for. Values that are set on it are kept separately. Rows of JSON stores
+    that are read in batches carry their `encoded` JSON along.
+    """
+
+    __slots__ = ['store', 'index', 'updates', 'encoded']
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.updates = None
+        self.encoded = None
+
+    def __getitem__(self, key):
+        if self.updates is not None and key in self.updates:
+            return self.updates[key]
+        return self.store.get_value(key, self.index)
+
+    def __setitem__(self, key, value):
+        if self.updates is None:
+            self.updates = {}
+        self.updates[key] = value
+
+    def __contains__(self, key):
+        return ((self.updates is not None and key in self.updates) or
+                self.store.has_value(key, self.index))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [field for field in self.store.fields
+                if self.store.has_value(field, self.index)]
+        if self.updates is not None:
+            keys.extend(key for key in self.updates if key not in keys)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+
+class ColumnarBatch(ColumnBatch):
+    """
+    The rows from `start` to `end` of a `ColumnarStore`. Columns are read
+    for all of the rows at once & filtered as arrays, dictionary encoded
+    ones are already categorical and timestamps are read from the epoch
+    column. Only the rows that are selected are read in full.
+    """
+
+    def __init__(self, store, start, end):
+        super(ColumnarBatch, self).__init__()
+        self.store = store
+        self.start = start
+        self.end = end
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = [ColumnarRow(self.store, index)
+                          for index in xrange(self.start, self.end)]
+        return self._rows
+
+    def __len__(self):
+        return self.end - self.start
+
+    def column(self, field):
+        try:
+            return self.columns[field]
+        except KeyError:
+            pass
+        if field in self.store.field_set:
+            column = self.store.read_column(field, self.start, self.end)
+        else:
+            column = [None] * len(self)
+        self.columns[field] = column
+        return column
+
+    def categorical(self, field):
+        if (field not in self.categoricals and
+                field in self.store.field_set):
+            categorical = self.store.read_categorical(
+                field, self.start, self.end)
+            if categorical is not None:
+                self.categoricals[field] = categorical
+        return super(ColumnarBatch, self).categorical(field)
+
+    def timestamps(self):
+        if self._timestamps is None:
+            epochs = self.store.read_epochs(self.start, self.end)
+            # Rows without a timestamp raise the way they do unbatched.
+            if (epochs == NO_TIMESTAMP).any():
+                return super(ColumnarBatch, self).timestamps()
+            self._timestamps = epochs
+        return self._timestamps
+
+    def select(self, mask):
+        indexes = numpy.flatnonzero(mask)
+        # Rows that filters looked at as rows are kept, they could have set
+        # fields on them.
+        if self._rows is not None:
+            rows = self._rows
+            return [rows[index] for index in indexes.tolist()]
+        indexes += self.start
+        if self.store.codec_name == 'csv':
+            return self.store.take_rows(indexes)
+        rows = []
+        for index, encoded in izip(indexes.tolist(),
+                                   self.store.encode_rows(indexes)):
+            row = ColumnarRow(self.store, index)
+            row.encoded = encoded
+            rows.append(row)
+        return rows
+
+
+class ColumnarMessageCodec(object):
+    """
+    Reads rows from a `ColumnarStore` and writes them out in the format of
+    the export it was converted from.
+    """
+
+    name = 'columnar'
+    has_header = False
+    quoted_newlines = False
+
+    def __init__(self, stdin, stdout, write_header=True):
+        self.store = stdin
+        self.stdout = stdout
+        self.index = self.store.index
+        self.added_field_names = []
+        self.fields = None
+        if self.store.codec_name == 'csv':
+            self.csv_writer = csv.writer(stdout)
+            self.writer = csv.DictWriter(stdout, fieldnames=self.store.fields)
+            if write_header:
+                self.write_header()
+
+    def get_field_names(self):
+        if self.store.codec_name == 'csv':
+            return self.store.fields
+        return None
+
+    def add_field_names(self, field_names):
+        if self.store.codec_name == 'csv':
+            fieldnames = list(self.writer.fieldnames)
+            fieldnames.extend(
+                field for field in field_names if field not in fieldnames)
+            self.writer = csv.DictWriter(self.stdout, fieldnames=fieldnames)
+            self.added_field_names = [
+                field for field in fieldnames if field not in self.index]
+
+    def select_fields(self, fields):
+        # Columns are only read when rows ask for them, unless CSV rows are
+        # read with just these fields.
+        self.fields = fields
+
+    def write_header(self):
+        if self.store.codec_name == 'csv':
+            self.writer.writerow(
+                dict(zip(self.writer.fieldnames, self.writer.fieldnames)))
+
+    def readrows(self):
+        if (self.fields is None or self.store.codec_name != 'csv' or
+                numpy is None):
+            return self.store.readrows()
+        return self.store.read_fields(self.fields)
+
+    def readbatches(self, batch_size):
+        return self.store.read_batches(batch_size)
+
+    def writerow(self, message):
+        if self.store.codec_name == 'csv':
+            # Rows read in batches are written by position, like the CSV
+            # codec writes the rows it read.
+            if isinstance(message, Row) and message.index is self.index:
+                values = message.values
+                if self.added_field_names:
+                    values = values + [message.get(field, '')
+                                       for field in self.added_field_names]
+                self.csv_writer.writerow(values)
+                return
+            self.writer.writerow(message)
+        elif (isinstance(message, ColumnarRow) and message.updates is None and
+                message.encoded is not None):
+            self.stdout.write('%s\n' % (message.encoded,))
+        else:
+            row = json.dumps(dict(message.items()))
+            self.stdout.write('%s\n' % (row.encode('utf-8'),))
+
+    def flush(self):
+        pass
+
+
+class ConvertPipeline(object):
+
+    default_codec = CSVMessageCodec
+
+    def __init__(self, output_path, codec_class=None):
+        self.output_path = output_path
+        self.codec_class = (self.default_codec if codec_class is None
+                            else codec_class)
+
+    def process(self, stdin=sys.stdin, stdout=sys.stdout):
+        codec = self.codec_class(stdin, stdout, write_header=False)
+        writer = ColumnarWriter(
+            self.output_path, self.codec_class.name,
+            fields=codec.get_field_names())
+        for row in codec.readrows():
+            writer.write(row)
+        writer.close()
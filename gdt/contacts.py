@@ -0,0 +1,104 @@
+import re
+
+from gdt.sketches import BloomFilter, hash_value
+
+
+PUNCTUATION = re.compile(r'[\s\-\.\(\)]')
+DIGITS = re.compile(r'^\+?\d+$')
+
+
+class ContactException(Exception):
+    pass
+
+
+def normalize_msisdn(address, country_code=None):
+    """
+    Puts phone numbers in international `+` format so `+27 82 123 4567`,
+    `0027821234567` and (given a `country_code` of `27`) `0821234567` are
+    all `+27821234567`. Anything that isn't a phone number is returned
+    as is.
+    """
+    if not address:
+        return address
+    if isinstance(address, unicode):
+        address = address.encode('utf-8')
+    msisdn = PUNCTUATION.sub('', address)
+    if not DIGITS.match(msisdn):
+        return address
+    if msisdn.startswith('00'):
+        return '+' + msisdn[2:]
+    if msisdn.startswith('+') or not country_code:
+        return msisdn
+    if msisdn.startswith(country_code):
+        return '+' + msisdn
+    if msisdn.startswith('0'):
+        return '+' + country_code + msisdn[1:]
+    return msisdn
+
+
+def address_key(address, country_code=None):
+    return hash_value(normalize_msisdn(address, country_code))
+
+
+def read_addresses(path):
+    fp = open(path, 'rb')
+    try:
+        for line in fp:
+            address = line.strip()
+            if address:
+                yield address
+    finally:
+        fp.close()
+
+
+def count_addresses(path):
+    return sum(1 for _ in read_addresses(path))
+
+
+class ContactSet(object):
+    """
+    A set of normalized contact addresses. Only a 64 bit hash of every
+    address is kept, either in a set or, when an `error_rate` is given, in
+    a Bloom filter that uses a couple of bytes per address but lets
+    through about `error_rate` of the addresses that aren't in it.
+    """
+
+    def __init__(self, capacity=0, country_code=None, error_rate=None):
+        self.country_code = country_code
+        self.error_rate = error_rate
+        if error_rate is None:
+            self.keys = set()
+        else:
+            self.keys = BloomFilter(capacity, error_rate)
+
+    @classmethod
+    def load(cls, addresses=None, addresses_path=None, country_code=None,
+             error_rate=None):
+        """
+        Builds a set from a list of addresses and / or a file with one
+        address per line. The file is read a line at a time, twice if it
+        needs counting to size a Bloom filter.
+        """
+        addresses = addresses or []
+        capacity = len(addresses)
+        if addresses_path is not None and error_rate is not None:
+            capacity += count_addresses(addresses_path)
+        contacts = cls(capacity, country_code, error_rate)
+        for address in addresses:
+            contacts.add(address)
+        if addresses_path is not None:
+            for address in read_addresses(addresses_path):
+                contacts.add(address)
+        return contacts
+
+    @property
+    def exact(self):
+        return self.error_rate is None
+
+    def add(self, address):
+        self.keys.add(address_key(address, self.country_code))
+
+    def __contains__(self, address):
+        if not address:
+            return False
+        return address_key(address, self.country_code) in self.keys
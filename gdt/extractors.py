@@ -1,11 +1,10 @@
-import csv
 import sys
 
 from collections import defaultdict
 
-import dateutil.parser
-
-from gdt.codec import CSVMessageCodec
+from gdt.codec import CSVMessageCodec, make_writer, union_fields
+from gdt.threads import overlap
+from gdt.timestamps import format_timestamp
 
 
 class ExtractorException(Exception):
@@ -29,6 +28,11 @@ class Extractor(object):
     def get_field_names(self):
         return self.field_names
 
+    def get_required_fields(self):
+        # Fields of the input rows this looks at, `None` if it could look
+        # at any. Chained extractors work on what this extracts.
+        return None
+
     def get_chained_field_names(self):
         return reduce(
             lambda acc, extractor: acc + extractor.get_field_names(),
@@ -51,10 +55,12 @@ class FieldExtractor(Extractor):
     def get_field_names(self):
         return ['timestamp'] + self.fields
 
+    def get_required_fields(self):
+        return ['timestamp'] + self.fields
+
     def extract(self, row):
         if self.date_format is not None:
-            date = dateutil.parser.parse(row['timestamp'])
-            date_str = date.strftime(self.date_format)
+            date_str = format_timestamp(row['timestamp'], self.date_format)
         else:
             date_str = row['timestamp']
 
@@ -70,9 +76,11 @@ class FieldExtractor(Extractor):
 
 class ExtractorPipeline(object):
 
-    # NOTE: this always outputs CSV
+    # NOTE: this outputs CSV, or binary rows to another `gdt`
 
     input_codec = CSVMessageCodec
+    writer_class = None
+    threaded = False
 
     def __init__(self, extractors=None, codec_class=None):
         self.extractors = ([] if extractors is None else extractors)
@@ -90,11 +98,24 @@ class ExtractorPipeline(object):
             lambda acc, extractor: acc + extractor.get_chained_field_names(),
             self.extractors, [])
 
-    def process(self, stdin=sys.stdin, stdout=sys.stdout):
-        input_codec = self.codec_class(stdin, stdout)
-        field_names = self.get_extractor_field_names()
-        output = csv.DictWriter(stdout, fieldnames=field_names)
-        output.writerow(dict(zip(field_names, field_names)))
-        for row in input_codec.readrows():
+    def get_output_field_names(self):
+        return self.get_extractor_field_names()
+
+    def get_required_fields(self):
+        return union_fields(
+            extractor.get_required_fields() for extractor in self.extractors)
+
+    def process_rows(self, rows):
+        for row in rows:
             for extractor in self.extractors:
-                output.writerow(extractor.process(row))
+                yield extractor.process(row)
+
+    def process(self, stdin=sys.stdin, stdout=sys.stdout):
+        input_codec = self.codec_class(stdin, stdout, write_header=False)
+        input_codec.select_fields(self.get_required_fields())
+        output = make_writer(stdout, self.get_extractor_field_names(),
+                             self.writer_class)
+        rows, output = overlap(input_codec.readrows(), output, self.threaded)
+        for row in self.process_rows(rows):
+            output.writerow(row)
+        output.flush()
@@ -1,48 +1,224 @@
+import copy
 import re
 import sys
+import time
 from datetime import date, timedelta, datetime
+from itertools import islice
 
-import dateutil.parser
+from gdt.batch import get_batches, numpy, read_rows
+from gdt.codec import (CSVMessageCodec, make_codec, get_writer,
+                       union_fields)
+from gdt.contacts import ContactSet, address_key
+from gdt.index import intersect_windows
+from gdt.patterns import PatternSet, PatternException, read_patterns
+from gdt.threads import overlap
+from gdt.timestamps import parse_timestamp, week_of, to_epoch
 
-from gdt.codec import CSVMessageCodec
+
+# Rows used to measure how filters do before they're reordered.
+WARMUP_SIZE = 1000
 
 
 class FilterException(Exception):
     pass
 
 
+def compile_predicate(chains):
+    """
+    Compiles OR'ed chains of AND'ed `apply` functions into a single
+    expression so rows don't go through a Python loop per filter.
+    """
+    if not chains:
+        return lambda row: False
+    namespace = {}
+    terms = []
+    for i, chain in enumerate(chains):
+        factors = []
+        for j, apply in enumerate(chain):
+            name = 'apply_%d_%d' % (i, j)
+            namespace[name] = apply
+            factors.append('%s(row)' % (name,))
+        terms.append('(%s)' % (' and '.join(factors),))
+    return eval('lambda row: %s' % (' or '.join(terms),), namespace)
+
+
+def measure_filter(filter_, rows):
+    """
+    Returns the time `filter_` takes per row and whether it matched each
+    one. A filter that raises an exception counts as a match, it's left
+    to the rows' actual evaluation to raise it.
+    """
+    # NOTE: measuring shouldn't count towards the `--stats` of a filter.
+    apply = getattr(filter_.apply, 'unwrapped', filter_.apply)
+    matches = []
+    start = time.time()
+    for row in rows:
+        try:
+            matches.append(bool(apply(row)))
+        except Exception:
+            matches.append(True)
+    return (time.time() - start) / len(rows), matches
+
+
+def constrained_order(items, key, can_raise):
+    """
+    Returns the indexes of `items` sorted by `key`, except that nothing is
+    moved ahead of an item that `can_raise`. Such an item then still sees
+    every row it would have in the order given, so it raises for the same
+    rows. Moving it ahead of others only makes it see more rows, which the
+    pipeline catches & falls back on the order given for.
+    """
+    order = []
+    remaining = sorted(range(len(items)), key=key)
+    while remaining:
+        barrier = min([index for index in remaining
+                       if can_raise(items[index])] or [len(items)])
+        for index in remaining:
+            if index <= barrier:
+                break
+        order.append(index)
+        remaining.remove(index)
+    return order
+
+
+def order_chains(chains, rows):
+    """
+    Reorders OR'ed chains of AND'ed filters by how they did on a sample of
+    `rows`. Filters in a chain are ordered by cost over how often they
+    reject a row, chains by expected cost over how often they match.
+    Nothing is moved ahead of a filter, or chain with a filter, that can
+    raise an exception.
+    """
+    size = float(len(rows))
+    ranked = []
+    for chain in chains:
+        measured = [measure_filter(filter_, rows) for filter_ in chain]
+
+        def rank(index):
+            cost, matches = measured[index]
+            rejected = 1 - sum(matches) / size
+            return cost / rejected if rejected else float('inf')
+
+        order = constrained_order(
+            chain, rank, lambda filter_: filter_.can_raise)
+        alive = [True] * len(rows)
+        cost = 0.0
+        for index in order:
+            filter_cost, matches = measured[index]
+            cost += filter_cost * sum(alive) / size
+            alive = [a and m for a, m in zip(alive, matches)]
+        matched = sum(alive) / size
+        ranked.append((cost / matched if matched else float('inf'),
+                       [chain[index] for index in order]))
+    order = constrained_order(
+        ranked, lambda index: ranked[index][0],
+        lambda item: any(filter_.can_raise for filter_ in item[1]))
+    return [ranked[index][1] for index in order]
+
+
 class Filter(object):
 
+    # Whether `apply` can raise an exception for a malformed row, filters
+    # that only compare `row.get()` values can't & are free to reorder.
+    can_raise = True
+
     def __init__(self):
         self._chain = []
 
     def apply(self, row):
         raise NotImplemented('Subclasses should implement')
 
+    def apply_batch(self, batch):
+        # Subclasses can override this with a vectorized version.
+        return batch.apply(self.apply)
+
+    def get_time_windows(self):
+        # A list of `(start, end)` datetimes outside of which this filter
+        # never matches, `None` if it can match at any time.
+        return None
+
+    def get_chain_time_windows(self):
+        return reduce(
+            lambda windows, filter_: intersect_windows(
+                windows, filter_.get_time_windows()),
+            self._chain, self.get_time_windows())
+
+    def get_addresses(self):
+        # A `(field, keys)` tuple of the `address_key` of the only addresses
+        # this filter matches in that field, `None` if it can match any.
+        return None
+
+    def get_chain_addresses(self):
+        # Filters in a chain all have to match so any one of them with
+        # addresses is enough to narrow things down.
+        for filter_ in self.get_chain():
+            addresses = filter_.get_addresses()
+            if addresses is not None:
+                return addresses
+        return None
+
+    def get_added_field_names(self):
+        # Fields this filter sets on the rows it matches.
+        return []
+
+    def get_fields(self):
+        # Fields this filter looks at, `None` if it could look at any.
+        return None
+
+    def get_chain_fields(self):
+        return union_fields(
+            filter_.get_fields() for filter_ in self.get_chain())
+
+    def get_chain_added_field_names(self):
+        return reduce(
+            lambda field_names, filter_: (
+                field_names + filter_.get_added_field_names()),
+            self._chain, self.get_added_field_names())
+
     def chain(self, filter):
         self._chain.append(filter)
         return self
 
+    def get_chain(self):
+        return [self] + self._chain
+
     def process(self, row):
+        for filter_ in self.get_chain():
+            if not filter_.apply(row):
+                return False
+        return True
+
+    def process_batch(self, batch):
         return reduce(
-            lambda accumulator, filter_: (
-                (accumulator and filter_.apply(row))
-                if accumulator else accumulator),
-            self._chain, self.apply(row))
+            lambda mask, filter_: mask & filter_.apply_batch(batch),
+            self._chain, self.apply_batch(batch))
 
 
 class DirectionalFilter(Filter):
 
+    can_raise = False
+
     def __init__(self, direction):
         super(DirectionalFilter, self).__init__()
         self.direction = direction
 
+    def get_fields(self):
+        return ['direction']
+
     def apply(self, row):
         return row.get('direction') == self.direction
 
+    def apply_batch(self, batch):
+        return batch.where('direction', lambda value: value == self.direction)
+
 
 class IsAReplyFilter(Filter):
 
+    can_raise = False
+
+    def get_fields(self):
+        return ['in_reply_to']
+
     def apply(self, row):
         return row.get('in_reply_to')
 
@@ -55,6 +231,8 @@ class IsNotAReplyFilter(IsAReplyFilter):
 
 class MSISDNFilter(Filter):
 
+    can_raise = False
+
     def __init__(self, addr_type, msisdn):
         super(MSISDNFilter, self).__init__()
         if addr_type not in ['to_addr', 'from_addr']:
@@ -62,9 +240,18 @@ class MSISDNFilter(Filter):
         self.addr_type = addr_type
         self.msisdn = msisdn
 
+    def get_fields(self):
+        return [self.addr_type]
+
     def apply(self, row):
         return row.get(self.addr_type) == self.msisdn
 
+    def get_addresses(self):
+        return (self.addr_type, [address_key(self.msisdn)])
+
+    def apply_batch(self, batch):
+        return batch.where(self.addr_type, lambda value: value == self.msisdn)
+
 
 class TimestampFilter(Filter):
 
@@ -76,12 +263,25 @@ class TimestampFilter(Filter):
             raise FilterException(
                 'End timestamp must come after start timestamp.')
 
+    def get_fields(self):
+        return ['timestamp']
+
     def apply(self, row):
-        vumitimestamp = dateutil.parser.parse(row['timestamp'])
+        vumitimestamp = parse_timestamp(row['timestamp'])
         if self.end is not None:
             return self.start <= vumitimestamp < self.end
         return self.start <= vumitimestamp
 
+    def get_time_windows(self):
+        return [(self.start, self.end)]
+
+    def apply_batch(self, batch):
+        timestamps = batch.timestamps()
+        mask = timestamps >= to_epoch(self.start)
+        if self.end is not None:
+            mask &= timestamps < to_epoch(self.end)
+        return mask
+
 
 class WeekFilter(Filter):
 
@@ -90,56 +290,159 @@ class WeekFilter(Filter):
         self.year = year
         self.weeks = weeks
     
+    def get_fields(self):
+        return ['timestamp']
+
     def apply(self, row):
-        vumitimestamp = dateutil.parser.parse(row['timestamp'])
-        if int(vumitimestamp.strftime('%Y')) == self.year and int(vumitimestamp.strftime('%W')) in self.weeks:
+        year, week = week_of(row['timestamp'])
+        if year == self.year and week in self.weeks:
             return True
-           
+
+    def get_time_windows(self):
+        if self.year is None or self.weeks is None:
+            return None
+        new_year = datetime(self.year, 1, 1)
+        next_new_year = datetime(self.year + 1, 1, 1)
+        # Week 0 runs up to the first Monday of the year.
+        first_monday = new_year + timedelta(days=(7 - new_year.weekday()) % 7)
+        windows = []
+        for week in self.weeks:
+            if week == 0:
+                start, end = new_year, first_monday
+            else:
+                start = first_monday + timedelta(weeks=week - 1)
+                end = min(start + timedelta(weeks=1), next_new_year)
+            if start < end:
+                windows.append((start, end))
+        return windows
+
+    def apply_batch(self, batch):
+        years, weeks = batch.weeks()
+        return (years == self.year) & numpy.in1d(weeks, self.weeks)
 
 
 class SessionEventFilter(Filter):
 
+    can_raise = False
+
     def __init__(self, event_type):
         super(SessionEventFilter, self).__init__()
         self.event_type = event_type
 
+    def get_fields(self):
+        return ['session_event']
+
     def apply(self, row):
         # Have to str() here because CSV string's the `None` values.
         return str(row.get('session_event')) == str(self.event_type)
 
+    def apply_batch(self, batch):
+        return batch.where(
+            'session_event',
+            lambda value: str(value) == str(self.event_type))
+
 
 class ContactFilter(Filter):
 
-    def __init__(self, addresses):
+    can_raise = False
+
+    def __init__(self, addresses=None, addresses_path=None,
+                 addr_type='from_addr', country_code=None, error_rate=None):
         super(ContactFilter, self).__init__()
-        self.addresses = addresses
+        if addr_type not in ['to_addr', 'from_addr']:
+            raise FilterException
+        if addresses is None and addresses_path is None:
+            raise FilterException('Contact addresses are required.')
+        self.addr_type = addr_type
+        self.contacts = ContactSet.load(
+            addresses, addresses_path, country_code=country_code,
+            error_rate=error_rate)
+
+    def get_fields(self):
+        return [self.addr_type]
 
     def apply(self, row):
-        return row['from_addr'] in self.addresses
+        return row.get(self.addr_type) in self.contacts
+
+    def apply_batch(self, batch):
+        return batch.where(self.addr_type, self.contacts.__contains__)
+
+    def get_addresses(self):
+        # NOTE: the address index doesn't know about country codes and a
+        #       Bloom filter can't list what's in it.
+        if self.contacts.country_code or not self.contacts.exact:
+            return None
+        return (self.addr_type, self.contacts.keys)
 
 
 class RegexFilter(Filter):
-    def __init__(self, field, pattern, ignore_case):
+    def __init__(self, field, pattern=None, ignore_case=False,
+                 patterns_path=None, match_field=None):
         super(RegexFilter, self).__init__()
         self.field = field
-        if ignore_case:
-            self.pattern = re.compile(pattern, re.IGNORECASE)
+        self.match_field = match_field
+        patterns = [] if pattern is None else [pattern]
+        if patterns_path is not None:
+            patterns.extend(read_patterns(patterns_path))
+        if not patterns:
+            raise FilterException('At least one pattern is required.')
+
+        if len(patterns) == 1 and match_field is None:
+            self.patterns = None
+            if ignore_case:
+                self.pattern = re.compile(patterns[0], re.IGNORECASE)
+            else:
+                self.pattern = re.compile(patterns[0])
         else:
-            self.pattern = re.compile(pattern)
+            try:
+                self.patterns = PatternSet(patterns, ignore_case)
+            except PatternException, e:
+                raise FilterException(str(e))
+
+    def get_added_field_names(self):
+        return [] if self.match_field is None else [self.match_field]
+
+    def get_fields(self):
+        return [self.field]
 
     def apply(self, row):
         if self.field in row and row[self.field]:
-            return self.pattern.match(row[self.field])
+            if self.patterns is None:
+                return self.pattern.match(row[self.field])
+            matched = self.patterns.match(row[self.field])
+            if matched is None:
+                return False
+            if self.match_field is not None:
+                row[self.match_field] = matched
+            return True
+
+    def apply_batch(self, batch):
+        # Matches are only set on rows one at a time.
+        if self.match_field is not None:
+            return batch.apply(self.apply)
+        return batch.where(self.field, self.match_value)
+
+    def match_value(self, value):
+        if not value:
+            return False
+        if self.patterns is None:
+            return self.pattern.match(value)
+        return self.patterns.match(value) is not None
 
 
 class FilterPipeline(object):
 
     default_codec = CSVMessageCodec
+    warmup_size = WARMUP_SIZE
+    writer_class = None
+    # Read, process & write rows in threads of their own.
+    threaded = False
 
-    def __init__(self, filters=None, codec_class=None):
+    def __init__(self, filters=None, codec_class=None, batch_size=None):
         self.filters = ([] if filters is None else filters)
         self.codec_class = (self.default_codec if codec_class is None
                             else codec_class)
+        self.batch_size = batch_size
 
     def add(self, filter):
         self.filters.append(filter)
@@ -147,10 +450,114 @@ class FilterPipeline(object):
     def empty(self):
         return len(self.filters) == 0
 
+    def merge(self, other):
+        """
+        Returns a pipeline that keeps the rows this one & then `other` keep
+        as a single chain, so the filters of both are ordered together, or
+        `None` if either ORs several chains.
+        """
+        if len(self.filters) != 1 or len(other.filters) != 1:
+            return None
+        chain = self.filters[0].get_chain() + other.filters[0].get_chain()
+        # NOTE: the filters are shared, only the chain is new.
+        head = copy.copy(chain[0])
+        head._chain = chain[1:]
+        merged = copy.copy(self)
+        merged.filters = [head]
+        return merged
+
+    def get_output_field_names(self):
+        # Filters pass rows through untouched.
+        return None
+
+    def get_added_field_names(self):
+        field_names = []
+        for filter_ in self.filters:
+            for field in filter_.get_chain_added_field_names():
+                if field not in field_names:
+                    field_names.append(field)
+        return field_names
+
+    def get_required_fields(self):
+        return union_fields(
+            filter_.get_chain_fields() for filter_ in self.filters)
+
+    def get_time_windows(self):
+        windows = []
+        for filter_ in self.filters:
+            filter_windows = filter_.get_chain_time_windows()
+            if filter_windows is None:
+                return None
+            windows.extend(filter_windows)
+        return windows
+
+    def get_address_lookups(self):
+        # A row is kept if any of the filters match so every one of them
+        # needs to be limited to certain addresses for a lookup to work.
+        lookups = []
+        for filter_ in self.filters:
+            addresses = filter_.get_chain_addresses()
+            if addresses is None:
+                return None
+            lookups.append(addresses)
+        return lookups
+
+    def process_rows(self, rows):
+        if self.batch_size:
+            return self.process_batches(get_batches(rows, self.batch_size))
+        return self.process_each(rows)
+
+    def process_each(self, rows):
+        # NOTE: the compiled predicates aren't kept on the pipeline as it
+        #       needs to be pickled for `--jobs`.
+        chains = [filter_.get_chain() for filter_ in self.filters]
+        predicate = compile_predicate(
+            [[filter_.apply for filter_ in chain] for chain in chains])
+        rows = iter(rows)
+
+        # Filters that set fields on rows have to run in the order given.
+        if (self.warmup_size and sum(map(len, chains)) > 1 and
+                not self.get_added_field_names()):
+            sample = list(islice(rows, self.warmup_size))
+            if sample:
+                ordered = compile_predicate(
+                    [[filter_.apply for filter_ in chain]
+                     for chain in order_chains(chains, sample)])
+            for row in sample:
+                if predicate(row):
+                    yield row
+            for row in rows:
+                try:
+                    keep = ordered(row)
+                except Exception:
+                    # A filter that can raise was moved ahead of others,
+                    # only raise if the filters in the order given do.
+                    keep = predicate(row)
+                if keep:
+                    yield row
+            return
+
+        for row in rows:
+            if predicate(row):
+                yield row
+
+    def process_batches(self, batches):
+        for batch in batches:
+            mask = reduce(
+                lambda mask, filter_: mask | filter_.process_batch(batch),
+                self.filters, numpy.zeros(len(batch), dtype=bool))
+            for row in batch.select(mask):
+                yield row
+
     def process(self, stdin=sys.stdin, stdout=sys.stdout):
-        codec = self.codec_class(stdin, stdout)
-        for row in codec.readrows():
-            for filter_ in self.filters:
-                if filter_.process(row):
-                    codec.writerow(row)
-                    break
+        added_field_names = self.get_added_field_names()
+        codec = make_codec(self.codec_class, stdin, stdout,
+                           write_header=self.writer_class is None,
+                           added_field_names=added_field_names)
+        output = get_writer(codec, stdout, self.writer_class,
+                            added_field_names)
+        rows, output = overlap(read_rows(codec, self.batch_size), output,
+                               self.threaded)
+        for row in self.process_rows(rows):
+            output.writerow(row)
+        output.flush()
@@ -0,0 +1,562 @@
+import csv
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from bisect import bisect_left
+
+from gdt.contacts import address_key
+from gdt.timestamps import parse_timestamp, to_epoch
+
+
+VERSION = 1
+# Version 2 hashes normalized addresses.
+ADDRESS_VERSION = 2
+
+# A block with a timestamp that can't be parsed is always read so the
+# filters get to see (and complain about) it.
+MIN_EPOCH = -2 ** 63
+MAX_EPOCH = 2 ** 63 - 1
+
+CHECKSUM_SIZE = 4096
+
+ADDRESS_FIELDS = ['to_addr', 'from_addr']
+# An address index entry is a hash of the address and a record offset.
+ENTRY = struct.Struct('<QQ')
+ENTRY_BLOCK = 4096
+SORT_SIZE = 1000000
+
+
+def iter_records(fp, start, quoted_newlines=True):
+    """
+    Yields `(offset, record)` for every complete record from `start`
+    onwards. A trailing record without a newline is still being written
+    and isn't returned.
+    """
+    fp.seek(start)
+    offset = start
+    lines = []
+    in_quotes = False
+    for line in iter(fp.readline, ''):
+        lines.append(line)
+        if quoted_newlines and line.count('"') % 2 == 1:
+            in_quotes = not in_quotes
+        if not in_quotes and line.endswith('\n'):
+            record = ''.join(lines)
+            yield offset, record
+            offset += len(record)
+            lines = []
+
+
+def open_mmap(path):
+    fp = open(path, 'rb')
+    try:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return ''
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        fp.close()
+
+
+def get_size(path):
+    return os.path.getsize(path)
+
+
+def get_checksum(fp, size):
+    fp.seek(max(size - CHECKSUM_SIZE, 0))
+    return hashlib.md5(fp.read(min(size, CHECKSUM_SIZE))).hexdigest()
+
+
+def get_record_values(record, fields):
+    if fields is None:
+        return json.loads(record)
+    return dict(zip(fields, csv.reader([record]).next()))
+
+
+def read_ranges(fp, header, ranges):
+    """
+    Yields the lines of `header` followed by the lines in each of the
+    `(start, end)` byte ranges of `fp`.
+    """
+    try:
+        if header:
+            yield header
+        for start, end in ranges:
+            fp.seek(start)
+            position = start
+            while position < end:
+                line = fp.readline(end - position)
+                if not line:
+                    break
+                position += len(line)
+                yield line
+    finally:
+        fp.close()
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def to_epoch_window(window):
+    start, end = window
+    return (MIN_EPOCH if start is None else to_epoch(start),
+            MAX_EPOCH if end is None else to_epoch(end))
+
+
+def intersect_windows(windows, other_windows):
+    """
+    Intersects two lists of `(start, end)` windows, either end can be
+    `None` for an open ended window. `None` means any time at all.
+    """
+    if windows is None:
+        return other_windows
+    if other_windows is None:
+        return windows
+    result = []
+    for start, end in windows:
+        for other_start, other_end in other_windows:
+            new_start = max(start, other_start) if (
+                start is not None and other_start is not None) else (
+                start if start is not None else other_start)
+            new_end = min(end, other_end) if (
+                end is not None and other_end is not None) else (
+                end if end is not None else other_end)
+            if new_start is None or new_end is None or new_start < new_end:
+                result.append((new_start, new_end))
+    return result
+
+
+def get_index_path(path):
+    return '%s.tsidx' % (path,)
+
+
+class TimestampIndex(object):
+    """
+    A sparse sidecar index of an export file that stores the byte range
+    and the earliest & latest timestamp of every `block_size` records.
+    Queries for a time window only read the blocks that can contain it.
+    When the file is sorted by time finding those blocks is a binary
+    search.
+    """
+
+    block_size = 1000
+
+    def __init__(self, path, codec_class, block_size=None):
+        self.path = path
+        self.codec_class = codec_class
+        if block_size is not None:
+            self.block_size = block_size
+        self.index_path = get_index_path(path)
+        self.header = ''
+        self.size = 0
+        self.checksum = None
+        self.sorted = True
+        self.blocks = []
+        self._latest = None
+
+    @classmethod
+    def exists(cls, path):
+        return os.path.isfile(get_index_path(path))
+
+    def load(self):
+        fp = open(self.index_path, 'rb')
+        try:
+            data = json.load(fp)
+        finally:
+            fp.close()
+        if (data['version'] != VERSION or
+                data['codec'] != self.codec_class.name):
+            return False
+        self.header = data['header'].encode('latin-1')
+        self.size = data['size']
+        self.checksum = data['checksum']
+        self.sorted = data['sorted']
+        self.block_size = data['block_size']
+        self.blocks = [tuple(block) for block in data['blocks']]
+        self._latest = None
+        return True
+
+    def save(self):
+        fp = open(self.index_path, 'wb')
+        try:
+            json.dump({
+                'version': VERSION,
+                'codec': self.codec_class.name,
+                # latin-1 maps every byte to a code point & back.
+                'header': self.header.decode('latin-1'),
+                'size': self.size,
+                'checksum': self.checksum,
+                'sorted': self.sorted,
+                'block_size': self.block_size,
+                'blocks': self.blocks,
+            }, fp)
+        finally:
+            fp.close()
+
+    def update(self):
+        """
+        Brings the index up to date with the file. Records appended since
+        the index was last updated are added to it, if anything else
+        changed the index is rebuilt.
+        """
+        fp = open(self.path, 'rb')
+        try:
+            if self.exists(self.path) and self.load():
+                fp.seek(0, os.SEEK_END)
+                size = fp.tell()
+                if (size < self.size or
+                        self.checksum != get_checksum(fp, self.size)):
+                    self.build(fp)
+                elif size > self.size:
+                    self.extend(fp)
+                else:
+                    return self
+            else:
+                self.build(fp)
+        finally:
+            fp.close()
+        self.save()
+        return self
+
+    def build(self, fp):
+        self.header = ''
+        self.size = 0
+        self.sorted = True
+        self.blocks = []
+        if self.codec_class.has_header:
+            for offset, record in iter_records(
+                    fp, 0, self.codec_class.quoted_newlines):
+                self.header = record
+                break
+        self.size = len(self.header)
+        self.extend(fp)
+
+    def extend(self, fp):
+        quoted_newlines = self.codec_class.quoted_newlines
+        fields = (csv.reader([self.header]).next()
+                  if self.codec_class.has_header else None)
+        last_epoch = self.blocks[-1][3] if self.blocks else MIN_EPOCH
+        block = None
+        count = 0
+        for offset, record in iter_records(fp, self.size, quoted_newlines):
+            try:
+                epoch = to_epoch(parse_timestamp(
+                    get_record_values(record, fields)['timestamp']))
+                earliest, latest = epoch, epoch
+            except Exception:
+                earliest, latest = MIN_EPOCH, MAX_EPOCH
+                self.sorted = False
+
+            if earliest < last_epoch:
+                self.sorted = False
+            last_epoch = max(latest, last_epoch)
+
+            if block is None:
+                block = [offset, offset, earliest, latest]
+            block[1] = offset + len(record)
+            block[2] = min(block[2], earliest)
+            block[3] = max(block[3], latest)
+            count += 1
+            if count == self.block_size:
+                self.blocks.append(tuple(block))
+                block, count = None, 0
+
+        if block is not None:
+            self.blocks.append(tuple(block))
+        if self.blocks:
+            self.size = self.blocks[-1][1]
+        self.checksum = get_checksum(fp, self.size)
+        self._latest = None
+
+    def get_latest(self):
+        # In a sorted file these only ever go up.
+        if self._latest is None:
+            self._latest = [block[3] for block in self.blocks]
+        return self._latest
+
+    def get_ranges(self, windows):
+        """
+        Returns the byte ranges that contain every record in the given
+        time windows. Records appended since the index was last updated
+        are always included.
+        """
+        ranges = []
+        for window in windows:
+            start, end = to_epoch_window(window)
+            if self.sorted:
+                first = bisect_left(self.get_latest(), start)
+                for block in self.blocks[first:]:
+                    if block[2] >= end:
+                        break
+                    ranges.append(block[:2])
+            else:
+                ranges.extend(
+                    block[:2] for block in self.blocks
+                    if block[2] < end and block[3] >= start)
+
+        size = get_size(self.path)
+        if size > self.size:
+            ranges.append((self.size, size))
+        return merge_ranges(ranges)
+
+    def open(self, windows):
+        fp = open(self.path, 'rb')
+        return read_ranges(fp, self.header, self.get_ranges(windows))
+
+
+def iter_entries(fp):
+    fp.seek(0)
+    while True:
+        data = fp.read(ENTRY.size * ENTRY_BLOCK)
+        if not data:
+            return
+        for offset in xrange(0, len(data), ENTRY.size):
+            yield ENTRY.unpack_from(data, offset)
+
+
+def write_entries(fp, entries):
+    buffer = []
+    for entry in entries:
+        buffer.append(ENTRY.pack(*entry))
+        if len(buffer) >= ENTRY_BLOCK:
+            fp.write(''.join(buffer))
+            buffer = []
+    fp.write(''.join(buffer))
+
+
+def read_records(fp, header, offsets, tail, quoted_newlines=True):
+    """
+    Yields the lines of `header`, the records starting at each of the
+    `offsets` and the lines from `tail` to the end of `fp`.
+    """
+    try:
+        if header:
+            yield header
+        for offset in offsets:
+            for _, record in iter_records(fp, offset, quoted_newlines):
+                yield record
+                break
+        fp.seek(tail)
+        for line in fp:
+            yield line
+    finally:
+        fp.close()
+
+
+class AddressIndex(object):
+    """
+    A sidecar index of the records every `to_addr` & `from_addr` appears
+    in. Each address field has a file of fixed size entries of the hash of
+    a normalized address (see `gdt.contacts.address_key`) and the offset
+    of a record, sorted by hash, so looking up an address is a binary
+    search. The filters still check every record
+    that is read, a hash collision just means reading an extra record.
+    """
+
+    def __init__(self, path, codec_class):
+        self.path = path
+        self.codec_class = codec_class
+        self.index_path = '%s.addridx' % (path,)
+        self.header = ''
+        self.size = 0
+        self.checksum = None
+
+    @classmethod
+    def exists(cls, path):
+        return os.path.isfile('%s.addridx' % (path,))
+
+    def get_entries_path(self, field):
+        return '%s.%s' % (self.index_path, field)
+
+    def load(self):
+        fp = open(self.index_path, 'rb')
+        try:
+            data = json.load(fp)
+        finally:
+            fp.close()
+        if (data['version'] != ADDRESS_VERSION or
+                data['codec'] != self.codec_class.name):
+            return False
+        self.header = data['header'].encode('latin-1')
+        self.size = data['size']
+        self.checksum = data['checksum']
+        return True
+
+    def save(self):
+        fp = open(self.index_path, 'wb')
+        try:
+            json.dump({
+                'version': ADDRESS_VERSION,
+                'codec': self.codec_class.name,
+                'header': self.header.decode('latin-1'),
+                'size': self.size,
+                'checksum': self.checksum,
+                'fields': ADDRESS_FIELDS,
+            }, fp)
+        finally:
+            fp.close()
+
+    def update(self):
+        """
+        Brings the index up to date with the file, the same way
+        `TimestampIndex.update()` does.
+        """
+        fp = open(self.path, 'rb')
+        try:
+            if self.exists(self.path) and self.load():
+                fp.seek(0, os.SEEK_END)
+                size = fp.tell()
+                if (size < self.size or
+                        self.checksum != get_checksum(fp, self.size)):
+                    self.build(fp)
+                elif size > self.size:
+                    self.extend(fp)
+                else:
+                    return self
+            else:
+                self.build(fp)
+        finally:
+            fp.close()
+        self.save()
+        return self
+
+    def build(self, fp):
+        self.header = ''
+        if self.codec_class.has_header:
+            for offset, record in iter_records(
+                    fp, 0, self.codec_class.quoted_newlines):
+                self.header = record
+                break
+        self.size = len(self.header)
+        for field in ADDRESS_FIELDS:
+            open(self.get_entries_path(field), 'wb').close()
+        self.extend(fp)
+
+    def extend(self, fp):
+        """
+        Indexes the records after `self.size`. Entries are sorted in runs
+        of `SORT_SIZE` that are merged with the existing entries at the end
+        so memory use doesn't depend on the size of the export.
+        """
+        fields = (csv.reader([self.header]).next()
+                  if self.codec_class.has_header else None)
+        entries = dict((field, []) for field in ADDRESS_FIELDS)
+        runs = dict((field, []) for field in ADDRESS_FIELDS)
+
+        def flush():
+            for field in ADDRESS_FIELDS:
+                run = tempfile.TemporaryFile()
+                write_entries(run, sorted(entries[field]))
+                runs[field].append(run)
+                entries[field] = []
+
+        count = 0
+        for offset, record in iter_records(
+                fp, self.size, self.codec_class.quoted_newlines):
+            values = get_record_values(record, fields)
+            for field in ADDRESS_FIELDS:
+                address = values.get(field)
+                if address:
+                    entries[field].append((address_key(address), offset))
+            count += 1
+            if count % SORT_SIZE == 0:
+                flush()
+            self.size = offset + len(record)
+        flush()
+
+        for field in ADDRESS_FIELDS:
+            path = self.get_entries_path(field)
+            existing = open(path, 'rb')
+            output = open(path + '.tmp', 'wb')
+            try:
+                write_entries(output, heapq.merge(*[
+                    iter_entries(run) for run in [existing] + runs[field]]))
+            finally:
+                output.close()
+                existing.close()
+                for run in runs[field]:
+                    run.close()
+            os.rename(path + '.tmp', path)
+        self.checksum = get_checksum(fp, self.size)
+
+    def find_offsets(self, field, keys):
+        entries = open_mmap(self.get_entries_path(field))
+        count = len(entries) // ENTRY.size
+        offsets = set()
+        for key in keys:
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                if ENTRY.unpack_from(entries, middle * ENTRY.size)[0] < key:
+                    low = middle + 1
+                else:
+                    high = middle
+            while low < count:
+                hash_, offset = ENTRY.unpack_from(entries, low * ENTRY.size)
+                if hash_ != key:
+                    break
+                offsets.add(offset)
+                low += 1
+        return offsets
+
+    def open(self, lookups):
+        """
+        Reads the records that have any of the address keys in a list of
+        `(field, keys)` lookups, in the order they're in the file.
+        Records appended since the index was last updated are always read.
+        """
+        offsets = set()
+        for field, keys in lookups:
+            offsets.update(self.find_offsets(field, keys))
+        return read_records(
+            open(self.path, 'rb'), self.header, sorted(offsets), self.size,
+            self.codec_class.quoted_newlines)
+
+
+def open_indexed(path, pipeline):
+    """
+    Returns the lines of `path` that `pipeline` could match using the
+    sidecar indexes that exist for it, `None` if there's no index to use.
+    """
+    if hasattr(pipeline, 'get_address_lookups'):
+        lookups = pipeline.get_address_lookups()
+        if lookups is not None and AddressIndex.exists(path):
+            index = AddressIndex(path, pipeline.codec_class)
+            return index.update().open(lookups)
+
+    if hasattr(pipeline, 'get_time_windows'):
+        windows = pipeline.get_time_windows()
+        if windows is not None and TimestampIndex.exists(path):
+            index = TimestampIndex(path, pipeline.codec_class)
+            return index.update().open(windows)
+
+    return None
+
+
+class IndexPipeline(object):
+    """
+    Builds or updates the sidecar indexes of an export file.
+    """
+
+    def __init__(self, path, codec_class, block_size=None, addresses=False):
+        self.path = path
+        self.codec_class = codec_class
+        self.block_size = block_size
+        self.addresses = addresses
+
+    def process(self, stdin=sys.stdin, stdout=sys.stdout):
+        TimestampIndex(
+            self.path, self.codec_class, block_size=self.block_size).update()
+        if self.addresses:
+            AddressIndex(self.path, self.codec_class).update()
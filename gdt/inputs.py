@@ -0,0 +1,290 @@
+import bz2
+import glob
+import os
+import sys
+import threading
+import zlib
+from Queue import Queue
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+# Bytes read from the input at a time.
+BUFFER_SIZE = 1024 * 1024
+
+# Decompressed buffers the background thread can get ahead of the parser.
+QUEUE_SIZE = 8
+
+MAGIC = [
+    ('gzip', '\x1f\x8b'),
+    ('bz2', 'BZh'),
+    ('xz', '\xfd7zXZ\x00'),
+]
+MAGIC_SIZE = max(len(magic) for _, magic in MAGIC)
+
+
+class InputException(Exception):
+    pass
+
+
+def detect_compression(data):
+    for compression, magic in MAGIC:
+        if data.startswith(magic):
+            return compression
+    return None
+
+
+def is_compressed(path):
+    fp = open(path, 'rb')
+    try:
+        return detect_compression(fp.read(MAGIC_SIZE)) is not None
+    finally:
+        fp.close()
+
+
+def expand_paths(pattern):
+    """
+    The files a path or glob like `exports/*.csv.gz` refers to, in order.
+    """
+    if os.path.exists(pattern):
+        return [pattern]
+    paths = sorted(path for path in glob.glob(pattern)
+                   if os.path.isfile(path))
+    if not paths:
+        raise InputException('No files match %r.' % (pattern,))
+    return paths
+
+
+class Decompressor(object):
+    """
+    Decompresses a stream a buffer at a time. Files made by concatenating
+    compressed files (like `cat a.gz b.gz`) have several streams, each one
+    is decompressed in turn.
+    """
+
+    def __init__(self, compression):
+        if compression == 'xz' and lzma is None:
+            raise InputException(
+                'Reading xz compressed input requires backports.lzma.')
+        self.compression = compression
+        self.decompressor = self.make_decompressor()
+
+    def make_decompressor(self):
+        if self.compression == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.compression == 'bz2':
+            return bz2.BZ2Decompressor()
+        return lzma.LZMADecompressor()
+
+    def decompress(self, data):
+        chunks = []
+        while data:
+            try:
+                chunks.append(self.decompressor.decompress(data))
+            except EOFError:
+                # The last bz2 stream ended right at the end of a buffer.
+                self.decompressor = self.make_decompressor()
+                continue
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = self.make_decompressor()
+        return ''.join(chunks)
+
+    def flush(self):
+        if self.compression == 'gzip':
+            return self.decompressor.flush()
+        return ''
+
+
+class InputReader(object):
+    """
+    Reads lines from a file or pipe. A background thread reads it in large
+    buffers, decompressing them if it's gzip, bz2 or xz compressed, so that
+    reading & decompressing overlaps with parsing the lines.
+    """
+
+    def __init__(self, read, name=None, fp=None):
+        self.read_raw = read
+        self.name = name
+        # Closed by the background thread once it's done reading.
+        self.fp = fp
+        self.queue = Queue(QUEUE_SIZE)
+        self.closed = False
+        # Data that `peek()` or `read()` got from the thread & how much of
+        # it has been read.
+        self.pending = ''
+        self.position = 0
+        self.buffers = self.iter_buffers()
+        self.lines = iter(self)
+        # Started when the first line is read, subcommands that don't read
+        # their input never start it.
+        self.thread = None
+
+    @classmethod
+    def open(cls, path):
+        fp = open(path, 'rb')
+        return cls(fp.read, path, fp)
+
+    @classmethod
+    def open_stdin(cls, stdin=sys.stdin):
+        # Unlike `file.read()`, `os.read()` returns what a pipe has so far
+        # instead of waiting for the whole buffer.
+        fd = stdin.fileno()
+        return cls(lambda size: os.read(fd, size), stdin.name)
+
+    def read_head(self):
+        data = self.read_raw(BUFFER_SIZE)
+        while data and len(data) < MAGIC_SIZE:
+            more = self.read_raw(BUFFER_SIZE)
+            if not more:
+                break
+            data += more
+        return data
+
+    def fill(self):
+        try:
+            data = self.read_head()
+            compression = detect_compression(data)
+            decompressor = (None if compression is None
+                            else Decompressor(compression))
+            while data and not self.closed:
+                if decompressor is not None:
+                    data = decompressor.decompress(data)
+                if data:
+                    self.queue.put(data)
+                data = self.read_raw(BUFFER_SIZE)
+            if decompressor is not None:
+                self.queue.put(decompressor.flush())
+            self.queue.put(None)
+        except Exception:
+            self.queue.put(sys.exc_info())
+        finally:
+            if self.fp is not None:
+                self.fp.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def iter_buffers(self):
+        if self.thread is None:
+            self.start()
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            if isinstance(data, tuple):
+                raise data[0], data[1], data[2]
+            yield data
+
+    def fill_pending(self, size):
+        # Drops what was already read from the pending data first.
+        self.pending = self.pending[self.position:]
+        self.position = 0
+        while size < 0 or len(self.pending) < size:
+            data = next(self.buffers, None)
+            if data is None:
+                break
+            self.pending += data
+
+    def peek(self, size):
+        """
+        Returns the next `size` bytes without reading them.
+        """
+        if len(self.pending) - self.position < size:
+            self.fill_pending(size)
+        return self.pending[self.position:self.position + size]
+
+    def read(self, size=-1):
+        if size < 0 or len(self.pending) - self.position < size:
+            self.fill_pending(size)
+        end = len(self.pending) if size < 0 else self.position + size
+        data = self.pending[self.position:end]
+        self.position = min(end, len(self.pending))
+        return data
+
+    def iter_pending(self):
+        # What `peek()` or `read()` left over, then the rest of the buffers.
+        if self.position < len(self.pending):
+            yield self.pending[self.position:]
+        self.pending, self.position = '', 0
+        for data in self.buffers:
+            yield data
+
+    def __iter__(self):
+        pending = ''
+        for data in self.iter_pending():
+            lines = (pending + data).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if pending:
+            yield pending
+
+    def next(self):
+        return self.lines.next()
+
+    def readline(self):
+        return next(self.lines, '')
+
+    def close(self):
+        self.closed = True
+        if self.thread is None:
+            if self.fp is not None:
+                self.fp.close()
+            return
+        # Unblock the thread if it's waiting for room in the queue.
+        while not self.queue.empty():
+            self.queue.get()
+
+
+def split_header(lines, quoted_newlines=True):
+    """
+    Returns the lines of the first record of `lines` & an iterator over
+    the rest.
+    """
+    lines = iter(lines)
+    header = []
+    in_quotes = False
+    for line in lines:
+        header.append(line)
+        if quoted_newlines and line.count('"') % 2 == 1:
+            in_quotes = not in_quotes
+        if not in_quotes:
+            break
+    return header, lines
+
+
+def read_inputs(paths, codec_class):
+    """
+    Yields the lines of all the files in `paths` one after the other. For
+    codecs with a header only the first file's is kept, the others have
+    to have the same one.
+    """
+    header = None
+    for path in paths:
+        reader = InputReader.open(path)
+        try:
+            lines = iter(reader)
+            if codec_class.has_header:
+                file_header, lines = split_header(
+                    lines, codec_class.quoted_newlines)
+                if header is None:
+                    header = file_header
+                    for line in header:
+                        yield line
+                elif file_header != header:
+                    raise InputException(
+                        '%r has different fields to %r.' % (
+                            path, paths[0]))
+            for line in lines:
+                yield line
+        finally:
+            reader.close()
@@ -0,0 +1,155 @@
+import os
+import sys
+from cStringIO import StringIO
+from multiprocessing import Pool
+
+from gdt.codec import make_codec
+
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class ParallelException(Exception):
+    pass
+
+
+def find_record_boundaries(fp, start, targets, quoted_newlines=True):
+    """
+    Returns, for each offset in the sorted list of `targets`, the offset of
+    the first record that starts at or after it. Reading starts at `start`
+    which must be the start of a record. When `quoted_newlines` is set
+    newlines inside double quotes don't end a record, so the parity of the
+    quotes seen so far is tracked all the way from `start`.
+    """
+    boundaries = []
+    targets = list(targets)
+    in_quotes = False
+    position = start
+    fp.seek(start)
+
+    # Record boundaries are always directly after a newline so the start
+    # of the file is the only one that isn't.
+    while targets and targets[0] <= start:
+        boundaries.append(start)
+        targets.pop(0)
+
+    while targets:
+        block = fp.read(BLOCK_SIZE)
+        if not block:
+            break
+        index = 0
+        block_end = position + len(block)
+        while targets and index < len(block):
+            target = max(targets[0] - position, index)
+            if target >= len(block):
+                break
+            if quoted_newlines:
+                in_quotes ^= block.count('"', index, target) % 2 == 1
+            newline = block.find('\n', target)
+            if newline == -1:
+                index = target
+                break
+            if quoted_newlines:
+                in_quotes ^= block.count('"', target, newline) % 2 == 1
+            index = newline + 1
+            if not in_quotes:
+                boundary = position + index
+                boundaries.append(boundary)
+                while targets and targets[0] <= boundary:
+                    targets.pop(0)
+        if quoted_newlines:
+            in_quotes ^= block.count('"', index) % 2 == 1
+        position = block_end
+
+    return boundaries
+
+
+def filter_chunk(args):
+    pipeline, path, header, start, end = args
+    fp = open(path, 'rb')
+    try:
+        fp.seek(start)
+        data = fp.read(end - start)
+    finally:
+        fp.close()
+
+    stdout = StringIO()
+    codec = make_codec(
+        pipeline.codec_class, StringIO(header + data), stdout,
+        write_header=False,
+        added_field_names=pipeline.get_added_field_names())
+    for row in pipeline.process_rows(codec.readrows()):
+        codec.writerow(row)
+    codec.flush()
+    return stdout.getvalue()
+
+
+class ParallelPipeline(object):
+    """
+    Runs a filter pipeline over a file using a pool of processes. The file
+    is split into chunks that start and end on record boundaries, each
+    chunk is filtered in a separate process and the results are written
+    out in the order of the input.
+    """
+
+    chunk_size = 16 * 1024 * 1024
+
+    def __init__(self, pipeline, jobs, chunk_size=None):
+        if pipeline.get_output_field_names() is not None:
+            raise ParallelException(
+                'Only filters can be run in parallel.')
+        self.pipeline = pipeline
+        self.jobs = jobs
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+
+    def get_chunks(self, fp):
+        codec_class = self.pipeline.codec_class
+        quoted_newlines = codec_class.quoted_newlines
+
+        fp.seek(0, os.SEEK_END)
+        size = fp.tell()
+        if codec_class.has_header and size:
+            [header_end] = find_record_boundaries(
+                fp, 0, [1], quoted_newlines) or [size]
+        else:
+            header_end = 0
+        fp.seek(0)
+        header = fp.read(header_end)
+
+        # Have at least a chunk per process but keep the chunks small enough
+        # to not hold too much of the file in memory at once.
+        chunk_count = max(
+            self.jobs, (size - header_end) // self.chunk_size + 1)
+        chunk_size = max((size - header_end) // chunk_count, 1)
+        targets = range(header_end + chunk_size, size, chunk_size)
+        boundaries = [header_end] + [
+            boundary for boundary in find_record_boundaries(
+                fp, header_end, targets, quoted_newlines)
+            if boundary < size] + [size]
+
+        chunks = []
+        for start, end in zip(boundaries, boundaries[1:]):
+            if start < end:
+                chunks.append((start, end))
+        return header, chunks
+
+    def process(self, path, stdout=sys.stdout):
+        fp = open(path, 'rb')
+        try:
+            header, chunks = self.get_chunks(fp)
+        finally:
+            fp.close()
+
+        # Let the codec write the header so it matches the serial output.
+        make_codec(self.pipeline.codec_class, StringIO(header), stdout,
+                   added_field_names=self.pipeline.get_added_field_names())
+
+        tasks = [(self.pipeline, path, header, start, end)
+                 for start, end in chunks]
+        pool = Pool(self.jobs)
+        try:
+            for output in pool.imap(filter_chunk, tasks):
+                stdout.write(output)
+        finally:
+            pool.terminate()
@@ -0,0 +1,109 @@
+import base64
+import json
+
+from gdt.sketches import HyperLogLog, SpaceSaving
+
+
+VERSION = 1
+
+
+class PartialException(Exception):
+    pass
+
+
+def encode_value(value):
+    """
+    Turns aggregated state into something JSON can represent. Sets,
+    sketches & dicts are tagged so `decode_value()` can tell them apart.
+    """
+    if isinstance(value, HyperLogLog):
+        return {'hll': [value.precision,
+                        base64.b64encode(str(value.registers))]}
+    if isinstance(value, SpaceSaving):
+        return {'top': [value.capacity, value.total, [
+            [encode_value(item), count, error]
+            for item, (count, error) in sorted(value.counters.items())]]}
+    if isinstance(value, (set, frozenset)):
+        return {'set': [encode_value(item) for item in sorted(value)]}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    if isinstance(value, dict):
+        return {'dict': [[encode_value(key), encode_value(item)]
+                         for key, item in sorted(value.items())]}
+    return value
+
+
+def decode_value(value):
+    # Strings are read back as UTF-8 encoded bytes, the way the CSV codec
+    # reads them.
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    if isinstance(value, dict):
+        if 'hll' in value:
+            precision, registers = value['hll']
+            sketch = HyperLogLog(precision)
+            sketch.registers = bytearray(base64.b64decode(registers))
+            return sketch
+        if 'top' in value:
+            capacity, total, counters = value['top']
+            summary = SpaceSaving(capacity)
+            summary.total = total
+            summary.set_counters(dict(
+                (decode_value(item), [count, error])
+                for item, count, error in counters))
+            return summary
+        if 'set' in value:
+            return set(decode_value(item) for item in value['set'])
+        if 'dict' in value:
+            return dict((decode_value(key), decode_value(item))
+                        for key, item in value['dict'])
+        raise PartialException('Unknown value %r.' % (value,))
+    return value
+
+
+def write_partial(stdout, name, config, items, mark=None):
+    """
+    Writes a header naming the aggregator & how it was set up followed by
+    a line per `(key, value)` item. Checkpoints also record how far into
+    the input the aggregator got as the `mark`.
+    """
+    header = {
+        'version': VERSION,
+        'aggregator': name,
+        'config': encode_value(config),
+    }
+    if mark is not None:
+        header['mark'] = encode_value(mark)
+    stdout.write('%s\n' % (json.dumps(header),))
+    for key, value in items:
+        stdout.write('%s\n' % (json.dumps(
+            [encode_value(key), encode_value(value)]),))
+
+
+class PartialReader(object):
+    """
+    Reads the output of `write_partial()`.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        try:
+            header = json.loads(fp.readline())
+            self.version = header['version']
+            self.name = decode_value(header['aggregator'])
+            self.config = decode_value(header['config'])
+            self.mark = decode_value(header.get('mark'))
+        except (ValueError, KeyError, TypeError):
+            raise PartialException(
+                '%r is not partial aggregator output.' % (
+                    getattr(fp, 'name', fp),))
+        if self.version != VERSION:
+            raise PartialException(
+                'Unsupported partial output version %r.' % (self.version,))
+
+    def readitems(self):
+        for line in self.fp:
+            key, value = json.loads(line)
+            yield tuple(decode_value(key)), decode_value(value)
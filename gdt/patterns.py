@@ -0,0 +1,147 @@
+import re
+import sre_parse
+from collections import deque
+from sre_constants import LITERAL, SUBPATTERN
+
+
+class PatternException(Exception):
+    pass
+
+
+def read_patterns(path):
+    fp = open(path, 'rb')
+    try:
+        return [line.rstrip('\r\n') for line in fp
+                if line.rstrip('\r\n')]
+    finally:
+        fp.close()
+
+
+def get_required_literal(pattern, flags=0):
+    """
+    Returns the longest run of plain ASCII characters that has to appear
+    in any string `pattern` matches, `''` if there isn't one. Lowercased
+    if the pattern ignores case.
+    """
+    parsed = sre_parse.parse(pattern, flags)
+    runs = []
+
+    def walk(items):
+        run = []
+        for op, arg in items:
+            if op == LITERAL and arg < 128:
+                run.append(chr(arg))
+                continue
+            runs.append(''.join(run))
+            run = []
+            if op == SUBPATTERN:
+                walk(arg[-1])
+        runs.append(''.join(run))
+
+    walk(parsed)
+    literal = max(runs, key=len)
+    if parsed.pattern.flags & re.IGNORECASE:
+        literal = literal.lower()
+    return literal
+
+
+class LiteralMatcher(object):
+    """
+    An Aho-Corasick automaton that finds which of a set of literal strings
+    appear in a text in a single pass over it, however many there are.
+    """
+
+    def __init__(self, literals):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+        for literal in literals:
+            self.add(literal)
+        self.build()
+
+    def add(self, literal):
+        state = 0
+        for char in literal:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(set())
+            state = next_state
+        self.output[state].add(literal)
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].iteritems():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.output[next_state] |= self.output[self.fail[next_state]]
+
+    def find(self, text):
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+
+class PatternSet(object):
+    """
+    Matches text against many regular expressions. Each pattern's longest
+    required literal is looked for with a `LiteralMatcher` first so only
+    the patterns that could match are run.
+    """
+
+    def __init__(self, patterns, ignore_case=False):
+        if not patterns:
+            raise PatternException('At least one pattern is required.')
+        flags = re.IGNORECASE if ignore_case else 0
+        self.patterns = patterns
+        try:
+            self.regexes = [re.compile(pattern, flags)
+                            for pattern in patterns]
+        except re.error, e:
+            raise PatternException('Invalid pattern: %s' % (e,))
+        literals = [get_required_literal(pattern, flags)
+                    for pattern in patterns]
+        # Scanning lowercased text finds literals of case sensitive
+        # patterns too, the regex still decides if they match.
+        self.lowercase = any(
+            regex.flags & re.IGNORECASE for regex in self.regexes)
+        if self.lowercase:
+            literals = [literal.lower() for literal in literals]
+        self.always = [index for index, literal in enumerate(literals)
+                       if not literal]
+        self.candidates = {}
+        for index, literal in enumerate(literals):
+            if literal:
+                self.candidates.setdefault(literal, []).append(index)
+        self.matcher = LiteralMatcher(self.candidates.keys())
+
+    def match(self, text):
+        """
+        Returns the first pattern (in the order they were given) that
+        matches the start of `text`, `None` if none of them do.
+        """
+        found = self.matcher.find(text.lower() if self.lowercase else text)
+        indexes = list(self.always)
+        for literal in found:
+            indexes.extend(self.candidates[literal])
+        for index in sorted(indexes):
+            if self.regexes[index].match(text):
+                return self.patterns[index]
+        return None
@@ -0,0 +1,143 @@
+import sys
+
+from gdt.batch import read_rows
+from gdt.codec import (CSVMessageCodec, make_codec, make_writer, get_writer,
+                       get_input_fields, union_fields)
+from gdt.filters import FilterPipeline
+from gdt.index import intersect_windows
+from gdt.threads import overlap, read_ahead
+
+
+class PipelineException(Exception):
+    pass
+
+
+class ChainedPipeline(object):
+    """
+    Runs several filter, extractor & aggregator pipelines in a single
+    process. Rows are handed from one stage to the next in memory so the
+    codec is only used to decode the input and encode the final output.
+    """
+
+    # NOTE: like the extractors & aggregators this outputs CSV (or binary
+    #       rows to another `gdt`) as soon as any stage changes the shape of
+    #       the rows.
+
+    default_codec = CSVMessageCodec
+    writer_class = None
+    threaded = False
+
+    def __init__(self, stages=None, codec_class=None):
+        self.stages = []
+        for stage in ([] if stages is None else stages):
+            self.add(stage)
+        self.codec_class = (self.default_codec if codec_class is None
+                            else codec_class)
+
+    def add(self, stage):
+        # Adjacent filter stages are run as one so their filters can be
+        # ordered by how selective they are, like a single stage's are.
+        if (self.stages and isinstance(self.stages[-1], FilterPipeline) and
+                isinstance(stage, FilterPipeline)):
+            merged = self.stages[-1].merge(stage)
+            if merged is not None:
+                self.stages[-1] = merged
+                return
+        self.stages.append(stage)
+
+    def empty(self):
+        return len(self.stages) == 0
+
+    def get_output_field_names(self):
+        field_names = None
+        for stage in self.stages:
+            stage_field_names = stage.get_output_field_names()
+            if stage_field_names is not None:
+                field_names = stage_field_names
+        return field_names
+
+    def get_added_field_names(self):
+        # Fields that filters after the last stage that changes the shape of
+        # the rows add to them.
+        field_names = []
+        for stage in self.stages:
+            if stage.get_output_field_names() is not None:
+                field_names = []
+            elif hasattr(stage, 'get_added_field_names'):
+                for field in stage.get_added_field_names():
+                    if field not in field_names:
+                        field_names.append(field)
+        return field_names
+
+    def get_required_fields(self):
+        return get_input_fields(self.stages)
+
+    def get_time_windows(self):
+        # Only filters before anything that changes the rows can be used
+        # to skip parts of the input.
+        windows = None
+        for stage in self.stages:
+            if not hasattr(stage, 'get_time_windows'):
+                break
+            stage_windows = stage.get_time_windows()
+            if stage_windows is not None:
+                windows = intersect_windows(windows, stage_windows)
+        return windows
+
+    def get_address_lookups(self):
+        # Any one leading filter stage can narrow down the rows read.
+        for stage in self.stages:
+            if not hasattr(stage, 'get_address_lookups'):
+                break
+            lookups = stage.get_address_lookups()
+            if lookups is not None:
+                return lookups
+        return None
+
+    def get_batch_size(self):
+        # The input is read in batches if the first stage takes them.
+        return getattr(self.stages[0], 'batch_size', None)
+
+    def process_rows(self, rows):
+        for stage in self.stages:
+            rows = stage.process_rows(rows)
+        return rows
+
+    def process(self, stdin=sys.stdin, stdout=sys.stdout):
+        if self.empty():
+            raise PipelineException('At least one stage is required.')
+
+        last = self.stages[-1]
+        if getattr(last, 'checkpoint_path', None) is not None:
+            last.process_checkpoint(stdin, stdout, stages=self.stages[:-1])
+            return
+        if getattr(last, 'partial', False):
+            codec = self.codec_class(stdin, stdout, write_header=False)
+            codec.select_fields(self.get_required_fields())
+            rows = read_rows(codec, self.get_batch_size())
+            if self.threaded:
+                rows = read_ahead(rows)
+            for stage in self.stages[:-1]:
+                rows = stage.process_rows(rows)
+            last.write_partial(rows, stdout)
+            return
+
+        field_names = self.get_output_field_names()
+        added_field_names = self.get_added_field_names()
+        if field_names is None:
+            codec = make_codec(self.codec_class, stdin, stdout,
+                               write_header=self.writer_class is None,
+                               added_field_names=added_field_names)
+            output = get_writer(codec, stdout, self.writer_class,
+                                added_field_names)
+        else:
+            codec = self.codec_class(stdin, stdout, write_header=False)
+            codec.select_fields(self.get_required_fields())
+            output = make_writer(
+                stdout, union_fields([field_names, added_field_names]),
+                self.writer_class)
+        rows, output = overlap(read_rows(codec, self.get_batch_size()),
+                               output, self.threaded)
+        for row in self.process_rows(rows):
+            output.writerow(row)
+        output.flush()
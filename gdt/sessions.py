@@ -0,0 +1,201 @@
+from collections import defaultdict, deque
+
+from gdt.aggregators import Aggregator
+from gdt.sketches import BloomFilter, HyperLogLog, hash_value
+from gdt.timestamps import format_timestamp, parse_timestamp, to_epoch
+
+
+# Seconds without a message after which a subscriber's session is over.
+DEFAULT_TIMEOUT = 300
+
+DEFAULT_DATE_FORMAT = '%Y-%m-%d'
+
+# Subscribers the Bloom filter of visitors is sized for with `error_rate`.
+DEFAULT_CAPACITY = 1000000
+
+# Session events that end a session, Vumi writes `close`.
+END_EVENTS = set(['close', 'end'])
+
+# The parts of an open session.
+START, LAST, TOUCHED, BUCKET = range(4)
+
+
+class SessionException(Exception):
+    pass
+
+
+def get_subscriber(row):
+    if row.get('direction') == 'inbound':
+        return row.get('from_addr')
+    return row.get('to_addr')
+
+
+class SessionAggregator(Aggregator):
+    """
+    Splits every subscriber's messages into sessions & counts them, how
+    long they lasted and the visitors that started them per `date_format`
+    bucket of their start. A session starts with a `new` event, or any
+    message from a subscriber without one, and ends with a `close` event
+    or after `timeout` seconds without messages.
+
+    Rows have to be in timestamp order. Only the sessions still going are
+    kept, they're ended as the timestamps move past their timeout.
+    """
+
+    name = 'sessions'
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT,
+                 date_format=DEFAULT_DATE_FORMAT, cohorts=False,
+                 error_rate=None, capacity=DEFAULT_CAPACITY):
+        super(SessionAggregator, self).__init__()
+        if timeout <= 0:
+            raise SessionException('The timeout must be positive.')
+        if cohorts and error_rate is not None:
+            raise SessionException(
+                'Cohorts need every visitor, not an error rate.')
+        self.timeout = timeout
+        self.date_format = date_format
+        self.cohorts = cohorts
+        self.error_rate = error_rate
+        self.capacity = capacity
+        # Open sessions by subscriber.
+        self.active = {}
+        # The time & subscriber of every message of an open session, oldest
+        # first. Entries of sessions that have had messages since are
+        # dropped once they come up.
+        self.idle = deque()
+        self.clock = None
+        self.data = defaultdict(lambda: defaultdict(int))
+        self.cohort_data = defaultdict(int)
+        # NOTE: with an error rate a Bloom filter remembers who visited
+        #       before & HyperLogLog sketches count the visitors of each
+        #       bucket, in a fixed amount of memory.
+        if error_rate is None:
+            # The first & latest buckets of every subscriber.
+            self.visitors = {}
+        else:
+            self.seen = BloomFilter(capacity, error_rate)
+            self.bucket_visitors = defaultdict(HyperLogLog)
+
+    def get_config(self):
+        return {
+            'timeout': self.timeout,
+            'date_format': self.date_format,
+            'cohorts': self.cohorts,
+            'error_rate': self.error_rate,
+            'capacity': self.capacity,
+        }
+
+    def get_field_names(self):
+        if self.cohorts:
+            return ['cohort', 'timestamp', 'visitors']
+        return ['timestamp', 'sessions', 'closed_sessions', 'mean_duration',
+                'visitors', 'new_visitors', 'returning_visitors']
+
+    def get_required_fields(self):
+        return ['timestamp', 'from_addr', 'to_addr', 'direction',
+                'session_event']
+
+    def expire(self, cutoff):
+        idle = self.idle
+        while idle and idle[0][0] <= cutoff:
+            touched, subscriber = idle.popleft()
+            session = self.active.get(subscriber)
+            if session is not None and session[TOUCHED] == touched:
+                self.end(subscriber, session)
+
+    def visit(self, subscriber, bucket):
+        counts = self.data[bucket]
+        if self.error_rate is not None:
+            key = hash_value(subscriber)
+            self.bucket_visitors[bucket].add_key(key)
+            if key not in self.seen:
+                self.seen.add(key)
+                counts['new_visitors'] += 1
+            return
+
+        visitor = self.visitors.get(subscriber)
+        if visitor is None:
+            visitor = self.visitors[subscriber] = [bucket, None]
+            counts['new_visitors'] += 1
+        elif visitor[1] == bucket:
+            return
+        visitor[1] = bucket
+        counts['visitors'] += 1
+        if self.cohorts:
+            self.cohort_data[(visitor[0], bucket)] += 1
+
+    def start(self, subscriber, time, timestamp):
+        bucket = format_timestamp(timestamp, self.date_format)
+        session = self.active[subscriber] = [time, time, None, bucket]
+        self.visit(subscriber, bucket)
+        return session
+
+    def end(self, subscriber, session, closed=False):
+        del self.active[subscriber]
+        counts = self.data[session[BUCKET]]
+        counts['sessions'] += 1
+        if closed:
+            counts['closed_sessions'] += 1
+        counts['duration'] += session[LAST] - session[START]
+
+    def aggregate(self, row):
+        timestamp = row['timestamp']
+        time = to_epoch(parse_timestamp(timestamp)) / 1000000.0
+        # NOTE: a row a little out of order doesn't move the clock back, so
+        #       the idle sessions are always oldest first.
+        if self.clock is None or time > self.clock:
+            self.clock = time
+            self.expire(time - self.timeout)
+
+        subscriber = get_subscriber(row)
+        event = row.get('session_event')
+        session = self.active.get(subscriber)
+        if session is not None and event == 'new':
+            self.end(subscriber, session)
+            session = None
+        if session is None:
+            session = self.start(subscriber, time, timestamp)
+        session[LAST] = max(session[LAST], time)
+        if event in END_EVENTS:
+            self.end(subscriber, session, closed=True)
+        else:
+            session[TOUCHED] = self.clock
+            self.idle.append((self.clock, subscriber))
+
+    def finish(self):
+        # Sessions still going at the end of the input are cut short.
+        for subscriber, session in self.active.items():
+            self.end(subscriber, session)
+        self.idle.clear()
+
+    def get_visitors(self, bucket, counts):
+        if self.error_rate is None:
+            return counts['visitors']
+        # The estimate can be a little under the exact new visitors.
+        return max(len(self.bucket_visitors[bucket]), counts['new_visitors'])
+
+    def get_data(self):
+        self.finish()
+        if self.cohorts:
+            for cohort, bucket in sorted(self.cohort_data.keys()):
+                yield {
+                    'cohort': cohort,
+                    'timestamp': bucket,
+                    'visitors': self.cohort_data[(cohort, bucket)],
+                }
+            return
+
+        for bucket in sorted(self.data.keys()):
+            counts = self.data[bucket]
+            visitors = self.get_visitors(bucket, counts)
+            yield {
+                'timestamp': bucket,
+                'sessions': counts['sessions'],
+                'closed_sessions': counts['closed_sessions'],
+                'mean_duration': round(
+                    counts['duration'] / counts['sessions'], 3),
+                'visitors': visitors,
+                'new_visitors': counts['new_visitors'],
+                'returning_visitors': visitors - counts['new_visitors'],
+            }
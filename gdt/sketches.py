@@ -0,0 +1,222 @@
+import hashlib
+import heapq
+import math
+import struct
+
+
+HASH = struct.Struct('<Q')
+
+# Registers of a HyperLogLog sketch, as a power of 2.
+DEFAULT_PRECISION = 12
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+# Counters of a Space-Saving summary.
+DEFAULT_COUNTERS = 1000
+
+
+class SketchException(Exception):
+    pass
+
+
+def hash_value(value):
+    """
+    A 64 bit hash of `value` that is the same across processes & runs.
+    """
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        value = '\x00' + repr(value)
+    return HASH.unpack_from(hashlib.md5(value).digest())[0]
+
+
+class BloomFilter(object):
+    """
+    A set that uses a fixed amount of memory for `capacity` keys, at the
+    cost of saying a key is in it when it isn't about `error_rate` of the
+    time. Keys are 64 bit hashes, the bit positions are derived from the
+    two halves of it.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        if not 0 < error_rate < 1:
+            raise SketchException('The error rate must be between 0 and 1.')
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(int(round(
+            float(self.size) / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def get_positions(self, key):
+        low, high = key & 0xffffffff, key >> 32
+        return [(low + i * high) % self.size for i in xrange(self.hashes)]
+
+    def add(self, key):
+        for position in self.get_positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        for position in self.get_positions(key):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class HyperLogLog(object):
+    """
+    Estimates the number of distinct values added to it using `2 **
+    precision` one byte registers, whatever that number is. The standard
+    error of the estimate is `1.04 / sqrt(2 ** precision)`, about 1.6% for
+    the default precision of 12. Sketches of the same precision can be
+    merged to count the distinct values added to either.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise SketchException(
+                'The precision must be between %s and %s.' % (
+                    MIN_PRECISION, MAX_PRECISION))
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    @property
+    def error(self):
+        return 1.04 / math.sqrt(self.size)
+
+    def add(self, value):
+        self.add_key(hash_value(value))
+
+    def add_key(self, key):
+        bits = 64 - self.precision
+        index = key >> bits
+        rank = bits - (key & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise SketchException(
+                'Only sketches of the same precision can be merged.')
+        self.registers = bytearray(
+            max(pair) for pair in zip(self.registers, other.registers))
+        return self
+
+    def copy(self):
+        sketch = HyperLogLog(self.precision)
+        sketch.registers = bytearray(self.registers)
+        return sketch
+
+    def count(self):
+        size = self.size
+        if size >= 128:
+            alpha = 0.7213 / (1 + 1.079 / size)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[size]
+        estimate = alpha * size * size / math.fsum(
+            2.0 ** -register for register in self.registers)
+        if estimate <= 2.5 * size:
+            # Linear counting is more accurate for small cardinalities.
+            zeros = self.registers.count('\x00')
+            if zeros:
+                estimate = size * math.log(float(size) / zeros)
+        return int(round(estimate))
+
+    def __len__(self):
+        return self.count()
+
+
+class SpaceSaving(object):
+    """
+    Finds the most frequent values added to it with `capacity` counters,
+    whatever the number of distinct values. Counts are never under the
+    real count and over it by at most their `error`, which is at most the
+    total added divided by `capacity`, so every value more frequent than
+    that is kept. Summaries of the same capacity can be merged.
+    """
+
+    def __init__(self, capacity=DEFAULT_COUNTERS):
+        if capacity < 1:
+            raise SketchException('The capacity must be at least 1.')
+        self.capacity = capacity
+        self.total = 0
+        # The count & error of every value kept.
+        self.counters = {}
+        # NOTE: a min heap of `(count, value)` for finding the value to
+        #       replace. Counts only go up so it's updated lazily, when a
+        #       value whose count has changed since comes up.
+        self.heap = []
+
+    def get_minimum(self):
+        # The count a new value takes over from the least frequent one.
+        if len(self.counters) < self.capacity:
+            return 0
+        heap = self.heap
+        while True:
+            count, value = heap[0]
+            current = self.counters[value][0]
+            if current == count:
+                return count
+            heapq.heapreplace(heap, (current, value))
+
+    def add(self, value, count=1):
+        self.total += count
+        counter = self.counters.get(value)
+        if counter is not None:
+            counter[0] += count
+            return
+        minimum = self.get_minimum()
+        if len(self.counters) >= self.capacity:
+            del self.counters[heapq.heappop(self.heap)[1]]
+        self.counters[value] = [minimum + count, minimum]
+        heapq.heappush(self.heap, (minimum + count, value))
+
+    def set_counters(self, counters):
+        self.counters = counters
+        self.heap = [(count, value)
+                     for value, (count, _) in counters.iteritems()]
+        heapq.heapify(self.heap)
+
+    def merge(self, other):
+        if other.capacity != self.capacity:
+            raise SketchException(
+                'Only summaries of the same capacity can be merged.')
+        # Values missing from a full summary could have been counted as
+        # often as its least frequent one.
+        minimum, other_minimum = self.get_minimum(), other.get_minimum()
+        counters = {}
+        for value in set(self.counters) | set(other.counters):
+            count, error = self.counters.get(value, (minimum, minimum))
+            other_count, other_error = other.counters.get(
+                value, (other_minimum, other_minimum))
+            counters[value] = [count + other_count, error + other_error]
+        if len(counters) > self.capacity:
+            counters = dict(heapq.nlargest(
+                self.capacity, counters.iteritems(),
+                key=lambda item: item[1][0]))
+        self.set_counters(counters)
+        self.total += other.total
+        return self
+
+    def copy(self):
+        summary = SpaceSaving(self.capacity)
+        summary.total = self.total
+        summary.set_counters(dict(
+            (value, list(counter))
+            for value, counter in self.counters.iteritems()))
+        return summary
+
+    def top(self, k):
+        """
+        Returns the `(value, count, error)` of the `k` most frequent values,
+        most frequent first.
+        """
+        return [(value, count, error) for value, (count, error) in sorted(
+            self.counters.iteritems(),
+            key=lambda item: (-item[1][0], item[0]))[:k]]
+
+    def __len__(self):
+        return len(self.counters)
@@ -0,0 +1,84 @@
+import cPickle as pickle
+import heapq
+import tempfile
+from itertools import islice
+from operator import itemgetter
+
+
+# Items pickled at a time when writing a run.
+CHUNK_SIZE = 1000
+
+# Items `sort_items()` sorts in memory at a time.
+SORT_SIZE = 100000
+
+
+def write_run(items, directory=None):
+    """
+    Writes sorted `(key, value)` items to a temporary file and returns it,
+    ready to be read with `read_run()`.
+    """
+    fp = tempfile.TemporaryFile(dir=directory)
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= CHUNK_SIZE:
+            pickle.dump(chunk, fp, pickle.HIGHEST_PROTOCOL)
+            chunk = []
+    if chunk:
+        pickle.dump(chunk, fp, pickle.HIGHEST_PROTOCOL)
+    fp.seek(0)
+    return fp
+
+
+def read_run(fp, close=True):
+    # A run that isn't closed can be read again once it's rewound.
+    try:
+        while True:
+            for item in pickle.load(fp):
+                yield item
+    except EOFError:
+        pass
+    finally:
+        if close:
+            fp.close()
+
+
+def number_items(items, index):
+    # The index of the sequence breaks ties between equal keys so values,
+    # which might not be comparable, never are.
+    for key, value in items:
+        yield key, index, value
+
+
+def merge_items(sequences):
+    """
+    Yields the `(key, value)` items of sorted `sequences` in order.
+    """
+    for key, _, value in heapq.merge(*[
+            number_items(items, index)
+            for index, items in enumerate(sequences)]):
+        yield key, value
+
+
+def merge_runs(runs):
+    """
+    Yields the `(key, value)` items of all the sorted `runs` in order.
+    """
+    return merge_items([read_run(fp) for fp in runs])
+
+
+def sort_items(items, size=SORT_SIZE):
+    """
+    Returns `(key, value)` items sorted by key. At most `size` of them are
+    sorted in memory at a time, more than that are sorted in runs written
+    to disk that are merged.
+    """
+    items = iter(items)
+    runs = []
+    while True:
+        chunk = sorted(islice(items, size), key=itemgetter(0))
+        if not runs and len(chunk) < size:
+            return iter(chunk)
+        if not chunk:
+            return merge_runs(runs)
+        runs.append(write_run(chunk))
@@ -0,0 +1,299 @@
+import json
+import resource
+import sys
+import time
+
+from gdt.batch import Batches
+from gdt.codec import CSVWriter
+
+
+class Counter(object):
+    """
+    Counts the rows read from an iterator & the time spent getting them,
+    including whatever work produces them.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.seconds = 0.0
+
+    def iterate(self, rows):
+        if isinstance(rows, Batches):
+            return Batches(self.iterate_batches(rows.batches))
+        return self.count(rows)
+
+    def iterate_batches(self, batches):
+        return self.count(batches, size=len)
+
+    def count(self, items, size=None):
+        # `size` gives the number of rows in an item, if it isn't a row.
+        items = iter(items)
+        while True:
+            start = time.time()
+            try:
+                item = next(items)
+            except StopIteration:
+                self.seconds += time.time() - start
+                return
+            self.seconds += time.time() - start
+            self.rows += 1 if size is None else size(item)
+            yield item
+
+
+class FilterStats(object):
+
+    def __init__(self, filter_):
+        self.name = filter_.__class__.__name__
+        self.rows_in = 0
+        self.rows_out = 0
+        self.seconds = 0.0
+
+    def wrap(self, apply):
+        def timed_apply(row):
+            start = time.time()
+            try:
+                match = apply(row)
+            finally:
+                self.seconds += time.time() - start
+            self.rows_in += 1
+            if match:
+                self.rows_out += 1
+            return match
+        timed_apply.unwrapped = apply
+        return timed_apply
+
+    def wrap_batch(self, apply_batch):
+        def timed_apply_batch(batch):
+            start = time.time()
+            try:
+                mask = apply_batch(batch)
+            finally:
+                self.seconds += time.time() - start
+            self.rows_in += len(batch)
+            self.rows_out += int(mask.sum())
+            return mask
+        return timed_apply_batch
+
+    def get_selectivity(self):
+        if not self.rows_in:
+            return None
+        return self.rows_out / float(self.rows_in)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'selectivity': self.get_selectivity(),
+            'seconds': self.seconds,
+        }
+
+
+class StageStats(object):
+    """
+    The rows into & out of a stage's `process_rows()` & the time spent in
+    it, without the time spent producing its input.
+    """
+
+    def __init__(self, stage):
+        self.name = stage.__class__.__name__
+        self.input = Counter()
+        self.output = Counter()
+        self.call_seconds = 0.0
+        self.filters = []
+
+    def wrap(self, process_rows):
+        def timed_process_rows(rows):
+            start = time.time()
+            output = process_rows(self.input.iterate(rows))
+            self.call_seconds += time.time() - start
+            return self.output.iterate(output)
+        return timed_process_rows
+
+    def get_seconds(self):
+        return max(0.0, self.call_seconds + self.output.seconds -
+                   self.input.seconds)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'rows_in': self.input.rows,
+            'rows_out': self.output.rows,
+            'seconds': self.get_seconds(),
+            'filters': [filter_.to_dict() for filter_ in self.filters],
+        }
+
+
+class Stats(object):
+    """
+    Instruments a pipeline to count the rows it reads & writes and time its
+    codec, stages & filters. Wrapping every row & `apply` call slows things
+    down a little, the figures are for finding where the time goes rather
+    than exact.
+    """
+
+    def __init__(self):
+        self.read = Counter()
+        self.rows_written = 0
+        self.write_seconds = 0.0
+        self.seconds = 0.0
+        self.stages = []
+        self.partial = False
+
+    def instrument(self, pipeline):
+        """
+        Wraps `pipeline.process()` to instrument the pipeline when it's
+        run, after its codec is settled, & time the whole run.
+        """
+        process = pipeline.process
+
+        def timed_process(stdin=sys.stdin, stdout=sys.stdout):
+            self.wrap_pipeline(pipeline)
+            start = time.time()
+            try:
+                process(stdin=stdin, stdout=stdout)
+            finally:
+                self.seconds += time.time() - start
+        pipeline.process = timed_process
+
+    def wrap_pipeline(self, pipeline):
+        stages = getattr(pipeline, 'stages', [pipeline])
+        self.partial = getattr(stages[-1], 'partial', False)
+        for pipeline_ in [pipeline] + [
+                stage for stage in stages if stage is not pipeline]:
+            if getattr(pipeline_, 'codec_class', None) is not None:
+                pipeline_.codec_class = self.wrap_codec_class(
+                    pipeline_.codec_class)
+            # Pipelines that change the shape of the rows write them with a
+            # `writer_class`, CSV by default. The others use the codec.
+            if hasattr(pipeline_, 'writer_class') and (
+                    pipeline_.writer_class is not None or
+                    not hasattr(pipeline_, 'get_output_field_names') or
+                    pipeline_.get_output_field_names() is not None):
+                pipeline_.writer_class = self.wrap_writer_class(
+                    pipeline_.writer_class or CSVWriter)
+        for stage in stages:
+            if not hasattr(stage, 'process_rows'):
+                continue
+            stats = StageStats(stage)
+            stage.process_rows = stats.wrap(stage.process_rows)
+            for top in getattr(stage, 'filters', []):
+                for filter_ in top.get_chain():
+                    filter_stats = FilterStats(filter_)
+                    if getattr(stage, 'batch_size', None):
+                        filter_.apply_batch = filter_stats.wrap_batch(
+                            filter_.apply_batch)
+                    else:
+                        filter_.apply = filter_stats.wrap(filter_.apply)
+                    stats.filters.append(filter_stats)
+            self.stages.append(stats)
+
+    def time_write(self, method):
+        def timed(*args):
+            start = time.time()
+            try:
+                return method(*args)
+            finally:
+                self.write_seconds += time.time() - start
+        return timed
+
+    def wrap_codec_class(self, codec_class):
+        stats = self
+
+        class StatsCodec(codec_class):
+
+            def readrows(self):
+                return stats.read.iterate(
+                    super(StatsCodec, self).readrows())
+
+            if hasattr(codec_class, 'readvalues'):
+                def readvalues(self, batch_size):
+                    return stats.read.iterate_batches(
+                        super(StatsCodec, self).readvalues(batch_size))
+
+            if hasattr(codec_class, 'readbatches'):
+                def readbatches(self, batch_size):
+                    return stats.read.iterate_batches(
+                        super(StatsCodec, self).readbatches(batch_size))
+
+            def writerow(self, row):
+                stats.rows_written += 1
+                stats.time_write(
+                    super(StatsCodec, self).writerow)(row)
+
+            def flush(self):
+                stats.time_write(super(StatsCodec, self).flush)()
+
+        StatsCodec.__name__ = codec_class.__name__
+        return StatsCodec
+
+    def wrap_writer_class(self, writer_class):
+        stats = self
+
+        class StatsWriter(writer_class):
+
+            def writerow(self, row):
+                stats.rows_written += 1
+                stats.time_write(
+                    super(StatsWriter, self).writerow)(row)
+
+            def flush(self):
+                stats.time_write(super(StatsWriter, self).flush)()
+
+        StatsWriter.__name__ = writer_class.__name__
+        return StatsWriter
+
+    def get_peak_rss(self):
+        # NOTE: `ru_maxrss` is in KB on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    def to_dict(self):
+        codec_seconds = self.read.seconds + self.write_seconds
+        stage_seconds = sum(stage.get_seconds() for stage in self.stages)
+        return {
+            'rows_read': self.read.rows,
+            # Partial output is aggregated state rather than rows.
+            'rows_written': None if self.partial else self.rows_written,
+            'seconds': self.seconds,
+            'codec': {
+                'read_seconds': self.read.seconds,
+                'write_seconds': self.write_seconds,
+            },
+            'stages': [stage.to_dict() for stage in self.stages],
+            'other_seconds': max(
+                0.0, self.seconds - codec_seconds - stage_seconds),
+            'peak_rss_mb': self.get_peak_rss(),
+        }
+
+    def write_json(self, fp):
+        json.dump(self.to_dict(), fp, indent=2, separators=(',', ': '),
+                  sort_keys=True)
+        fp.write('\n')
+
+    def write_report(self, fp):
+        data = self.to_dict()
+        total = data['seconds'] or 1.0
+
+        def line(name, seconds, detail=''):
+            fp.write('%-32s %9.3fs %5.1f%%%s\n' % (
+                name, seconds, seconds / total * 100, detail))
+
+        fp.write('%-32s %10d\n' % ('rows read', data['rows_read']))
+        fp.write('%-32s %10s\n' % (
+            'rows written', 'n/a' if data['rows_written'] is None
+            else data['rows_written']))
+        line('total', data['seconds'])
+        line('  codec read', data['codec']['read_seconds'])
+        line('  codec write', data['codec']['write_seconds'])
+        for index, stage in enumerate(data['stages'], 1):
+            line('  %d. %s' % (index, stage['name']), stage['seconds'],
+                 '  %d -> %d rows' % (stage['rows_in'], stage['rows_out']))
+            for filter_ in stage['filters']:
+                selectivity = filter_['selectivity']
+                line('    %s' % (filter_['name'],), filter_['seconds'],
+                     '  %d -> %d rows (%s)' % (
+                         filter_['rows_in'], filter_['rows_out'],
+                         'n/a' if selectivity is None
+                         else '%.1f%%' % (selectivity * 100,)))
+        line('  other', data['other_seconds'])
+        fp.write('%-32s %9.1fMB\n' % ('peak RSS', data['peak_rss_mb']))
@@ -1,6 +1,20 @@
+import os
+import json
+import shutil
+import tempfile
+from StringIO import StringIO
 from unittest import TestCase
 
-from gdt.aggregators import UniquesAggregator, SimpleAggregator
+from gdt.aggregators import (UniquesAggregator, SimpleAggregator,
+                             AggregatorPipeline, PivotAggregator,
+                             TopAggregator, RollupAggregator,
+                             AggregatorException, MergePipeline, make_metric)
+from gdt.batch import numpy
+from gdt.checkpoint import CheckpointException
+from gdt.codec import JSONMessageCodec
+from gdt.index import iter_records
+from gdt.partial import PartialException, encode_value, decode_value
+from gdt.sketches import HyperLogLog, SpaceSaving, SketchException
 
 
 class AggregatorTestCase(TestCase):
@@ -22,6 +36,36 @@ class AggregatorTestCase(TestCase):
             list(a.get_data()),
             [{'timestamp': '2014', 'foo': 1, 'bar': 2}])
 
+    def test_approximate_uniques_aggregator(self):
+        exact = UniquesAggregator(['foo'])
+        approximate = UniquesAggregator(['foo'], approximate=True,
+                                        precision=14)
+        for i in range(3000):
+            row = {'timestamp': '2014-01-%02d' % (i % 7 + 1,),
+                   'foo': str(i % 1000)}
+            exact.aggregate(row)
+            approximate.aggregate(row)
+        for expected, result in zip(exact.get_data(),
+                                    approximate.get_data()):
+            self.assertEqual(expected['timestamp'], result['timestamp'])
+            self.assertTrue(abs(expected['foo'] - result['foo']) <= 10)
+
+        # Daily buckets roll up into a weekly one.
+        for aggregator in [exact, approximate]:
+            [week] = aggregator.rollup(lambda timestamp: '2014-W1').get_data()
+            self.assertTrue(abs(week['foo'] - 1000) <= 40)
+        self.assertEqual(
+            list(exact.rollup(lambda timestamp: '2014-W1').get_data()),
+            [{'timestamp': '2014-W1', 'foo': 1000}])
+
+        other = UniquesAggregator(['foo'])
+        other.aggregate({'timestamp': '2014-01-01', 'foo': 'bar'})
+        exact.merge(other)
+        self.assertEqual(exact.get_data().next()['foo'], 430)
+
+        self.assertRaises(SketchException, UniquesAggregator, ['foo'],
+                          True, 20)
+
     def test_simple_aggregator(self):
         a = SimpleAggregator(['foo', 'bar'])
         a.aggregate({
@@ -37,3 +81,438 @@ class AggregatorTestCase(TestCase):
         self.assertEqual(
             list(a.get_data()),
             [{'timestamp': '2014', 'foo': 2, 'bar': 2}])
+
+
+class SpillingAggregatorPipelineTestCase(TestCase):
+
+    ROWS = [{'timestamp': '2014-01-%02d %02d' % (i % 28 + 1, i % 24),
+             'foo': str(i % 97), 'bar': [u'x', 'y', None][i % 3]}
+            for i in range(2000)]
+
+    def process(self, make_aggregator, **kwargs):
+        pipeline = AggregatorPipeline(make_aggregator(), **kwargs)
+        pipeline.check_interval = 100
+        return list(pipeline.process_rows(iter(self.ROWS)))
+
+    def assertSpilledEqual(self, make_aggregator):
+        expected = self.process(make_aggregator)
+        self.assertEqual(self.process(make_aggregator, memory_limit=1),
+                         expected)
+        self.assertEqual(self.process(make_aggregator, memory_limit=10000),
+                         expected)
+        if numpy is not None:
+            self.assertEqual(
+                self.process(make_aggregator, memory_limit=1,
+                             batch_size=300),
+                expected)
+
+    def test_simple_aggregator(self):
+        self.assertSpilledEqual(lambda: SimpleAggregator(['foo', 'bar']))
+
+    def test_uniques_aggregator(self):
+        self.assertSpilledEqual(lambda: UniquesAggregator(['foo', 'bar']))
+
+    def test_approximate_uniques_aggregator(self):
+        self.assertSpilledEqual(lambda: UniquesAggregator(
+            ['foo'], approximate=True, precision=6))
+
+    def test_spill(self):
+        aggregator = SimpleAggregator(['foo'])
+        aggregator.aggregate({'timestamp': 'b', 'foo': '1'})
+        aggregator.aggregate({'timestamp': 'a', 'foo': '1'})
+        self.assertEqual(list(aggregator.spill()),
+                         [(('a', 'foo'), 1), (('b', 'foo'), 1)])
+        self.assertEqual(list(aggregator.get_data()), [])
+
+
+class PivotAggregatorTestCase(TestCase):
+
+    ROWS = [
+        {'timestamp': '2014-01-01 10:00:00', 'direction': 'inbound',
+         'from_addr': '1', 'content': 'a'},
+        {'timestamp': '2014-01-01 09:00:00', 'direction': 'inbound',
+         'from_addr': '2', 'content': 'b'},
+        {'timestamp': '2014-01-01 11:00:00', 'direction': 'inbound',
+         'from_addr': '1', 'content': ''},
+        {'timestamp': '2014-01-02 10:00:00', 'direction': 'outbound',
+         'from_addr': '3', 'content': u'\xe9'},
+    ]
+
+    METRICS = ['count', 'distinct:from_addr', 'min:timestamp',
+               'max:timestamp', 'first:content', 'last:content']
+
+    def test_pivot(self):
+        a = PivotAggregator(['timestamp', 'direction'], self.METRICS,
+                            date_format='%Y-%m-%d')
+        for row in self.ROWS:
+            a.aggregate(row)
+        self.assertEqual(a.get_field_names(), [
+            'timestamp', 'direction', 'count', 'distinct_from_addr',
+            'min_timestamp', 'max_timestamp', 'first_content',
+            'last_content'])
+        self.assertEqual(list(a.get_data()), [{
+            'timestamp': '2014-01-01', 'direction': 'inbound', 'count': 3,
+            'distinct_from_addr': 2, 'min_timestamp': '2014-01-01 09:00:00',
+            'max_timestamp': '2014-01-01 11:00:00', 'first_content': 'a',
+            'last_content': '',
+        }, {
+            'timestamp': '2014-01-02', 'direction': 'outbound', 'count': 1,
+            'distinct_from_addr': 1, 'min_timestamp': '2014-01-02 10:00:00',
+            'max_timestamp': '2014-01-02 10:00:00',
+            'first_content': '\xc3\xa9', 'last_content': '\xc3\xa9',
+        }])
+
+    def test_spilled(self):
+        def process(**kwargs):
+            pipeline = AggregatorPipeline(
+                PivotAggregator(['direction'], self.METRICS), **kwargs)
+            pipeline.check_interval = 1
+            return list(pipeline.process_rows(iter(self.ROWS)))
+
+        self.assertEqual(process(memory_limit=1), process())
+
+    def test_metrics(self):
+        self.assertRaises(AggregatorException, make_metric, 'foo:bar')
+        self.assertRaises(AggregatorException, make_metric, 'count:bar')
+        self.assertRaises(AggregatorException, make_metric, 'distinct')
+        self.assertRaises(AggregatorException, PivotAggregator, ['a'], [])
+
+
+class TopAggregatorTestCase(TestCase):
+
+    ROWS = [
+        {'timestamp': '2014-01-01 10:00:00', 'from_addr': '1',
+         'content': 'Hi there'},
+        {'timestamp': '2014-01-01 11:00:00', 'from_addr': '2',
+         'content': 'hi'},
+        {'timestamp': '2014-01-01 12:00:00', 'from_addr': '1',
+         'content': None},
+        {'timestamp': '2014-01-02 10:00:00', 'from_addr': '3',
+         'content': 'There, HI'},
+    ]
+
+    def aggregate(self, **kwargs):
+        a = TopAggregator(**kwargs)
+        for row in self.ROWS:
+            a.aggregate(row)
+        return list(a.get_data())
+
+    def test_top(self):
+        self.assertEqual(self.aggregate(field='from_addr', k=2), [
+            {'from_addr': '1', 'count': 2, 'error': 0},
+            {'from_addr': '2', 'count': 1, 'error': 0},
+        ])
+        self.assertEqual(
+            self.aggregate(field='content', k=1, date_format='%Y-%m-%d',
+                           words=True), [
+                {'timestamp': '2014-01-01', 'content': 'hi', 'count': 2,
+                 'error': 0},
+                {'timestamp': '2014-01-02', 'content': 'hi', 'count': 1,
+                 'error': 0},
+            ])
+        # One counter can only hold on to the latest value.
+        self.assertEqual(
+            self.aggregate(field='from_addr', k=1, capacity=1),
+            [{'from_addr': '3', 'count': 4, 'error': 3}])
+
+    def test_unicode_words(self):
+        for content in ['Caf\xc3\xa9 na\xc3\xafve caf\xc3\xa9',
+                        u'Caf\xe9 na\xefve caf\xe9']:
+            a = TopAggregator('content', k=2, words=True)
+            a.aggregate({'timestamp': '2014-01-01 10:00:00',
+                         'content': content})
+            self.assertEqual(list(a.get_data()), [
+                {'content': 'caf\xc3\xa9', 'count': 2, 'error': 0},
+                {'content': 'na\xc3\xafve', 'count': 1, 'error': 0},
+            ])
+
+    def test_spilled(self):
+        def process(**kwargs):
+            pipeline = AggregatorPipeline(
+                TopAggregator('from_addr', k=2, date_format='%Y-%m-%d'),
+                **kwargs)
+            pipeline.check_interval = 1
+            return list(pipeline.process_rows(iter(self.ROWS)))
+
+        self.assertEqual(process(memory_limit=1), process())
+        if numpy is not None:
+            self.assertEqual(process(batch_size=2), process())
+
+    def test_invalid(self):
+        self.assertRaises(AggregatorException, TopAggregator, 'foo', k=0)
+        self.assertRaises(AggregatorException, TopAggregator, 'foo', k=10,
+                          capacity=5)
+
+
+class RollupAggregatorTestCase(TestCase):
+
+    ROWS = [
+        {'timestamp': '2014-01-05 23:59:30.5', 'from_addr': '1'},
+        {'timestamp': '2014-01-05 23:59:59', 'from_addr': '2'},
+        {'timestamp': '2014-01-06 00:00:01', 'from_addr': '1'},
+        {'timestamp': '2014-01-06 00:30:00', 'from_addr': '1'},
+    ]
+
+    def aggregate(self, aggregator, config, granularities=None):
+        a = RollupAggregator(aggregator, config, granularities)
+        for row in self.ROWS:
+            a.aggregate(row)
+        return [(d['granularity'], d['timestamp'], d['from_addr'])
+                for d in a.get_data()]
+
+    def test_count(self):
+        self.assertEqual(self.aggregate('count', {'fields': ['from_addr']}), [
+            ('minute', '2014-01-05 23:59', 2),
+            ('minute', '2014-01-06 00:00', 1),
+            ('minute', '2014-01-06 00:30', 1),
+            ('hour', '2014-01-05 23:00', 2),
+            ('hour', '2014-01-06 00:00', 2),
+            ('day', '2014-01-05', 2),
+            ('day', '2014-01-06', 2),
+            ('week', '2014-W01', 2),
+            ('week', '2014-W02', 2),
+        ])
+
+    def test_uniques(self):
+        for approximate in [False, True]:
+            self.assertEqual(self.aggregate(
+                'aggregate', {'fields': ['from_addr'],
+                              'approximate': approximate},
+                ['hour', 'week']), [
+                ('hour', '2014-01-05 23:00', 2),
+                ('hour', '2014-01-06 00:00', 1),
+                ('week', '2014-W01', 2),
+                ('week', '2014-W02', 1),
+            ])
+
+    def test_spilled(self):
+        def process(**kwargs):
+            pipeline = AggregatorPipeline(RollupAggregator(
+                'aggregate', {'fields': ['from_addr']}), **kwargs)
+            pipeline.check_interval = 1
+            return list(pipeline.process_rows(iter(self.ROWS)))
+
+        self.assertEqual(process(memory_limit=1), process())
+
+    def test_coarsen(self):
+        consumed = []
+
+        def items():
+            # Three minutes of one hour, then the next hour.
+            for minute in [0, 1, 2, 60]:
+                for field in ['b', 'a']:
+                    consumed.append(minute)
+                    yield (minute, field), 1
+
+        for sort_size in [1, 2, 100]:
+            a = RollupAggregator('count', {'fields': ['from_addr']})
+            a.sort_size = sort_size
+            del consumed[:]
+            hours = a.coarsen(items(), 'hour')
+            # Only the first hour is read to write it out.
+            self.assertEqual([hours.next(), hours.next()],
+                             [((0, 'a'), 3), ((0, 'b'), 3)])
+            self.assertTrue(60 not in consumed[:-1])
+            self.assertEqual(list(hours), [((1, 'a'), 1), ((1, 'b'), 1)])
+
+    def test_invalid(self):
+        self.assertRaises(AggregatorException, RollupAggregator, 'pivot',
+                          {'group_by': ['foo'], 'metrics': ['count']})
+        self.assertRaises(AggregatorException, RollupAggregator, 'count',
+                          {'fields': ['foo']}, ['year'])
+
+
+class PartialAggregatorTestCase(TestCase):
+
+    ROWS = [{'timestamp': '2014-01-%02d' % (i % 5 + 1,),
+             'foo': [str(i % 13), u'\xe9', None][i % 3],
+             'bar': str(i % 7)}
+            for i in range(300)]
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def process(self, aggregator, rows, **kwargs):
+        stdout = StringIO()
+        AggregatorPipeline(aggregator, **kwargs).process(
+            stdin=StringIO(''.join(json.dumps(row) + '\n' for row in rows)),
+            stdout=stdout)
+        return stdout.getvalue()
+
+    def write_partials(self, make_aggregator, shards=3, name='shard'):
+        paths = []
+        for index in range(shards):
+            path = os.path.join(self.path, '%s-%s' % (name, index))
+            fp = open(path, 'wb')
+            fp.write(self.process(
+                make_aggregator(), self.ROWS[index::shards],
+                codec_class=JSONMessageCodec, partial=True))
+            fp.close()
+            paths.append(path)
+        return paths
+
+    def merge(self, paths, partial=False):
+        stdout = StringIO()
+        MergePipeline(paths, partial=partial).process(stdout=stdout)
+        return stdout.getvalue()
+
+    def assertMergedEqual(self, make_aggregator):
+        expected = self.process(make_aggregator(), self.ROWS,
+                                codec_class=JSONMessageCodec)
+        paths = self.write_partials(make_aggregator)
+        self.assertEqual(self.merge(paths), expected)
+
+        # Partial output can be merged into partial output too.
+        path = os.path.join(self.path, 'merged')
+        fp = open(path, 'wb')
+        fp.write(self.merge(paths[:2], partial=True))
+        fp.close()
+        self.assertEqual(self.merge([path, paths[2]]), expected)
+
+    def test_simple_aggregator(self):
+        self.assertMergedEqual(lambda: SimpleAggregator(['foo', 'bar']))
+
+    def test_uniques_aggregator(self):
+        self.assertMergedEqual(lambda: UniquesAggregator(['foo', 'bar']))
+        self.assertMergedEqual(lambda: UniquesAggregator(
+            ['foo', 'bar'], approximate=True, precision=8))
+
+    def test_pivot_aggregator(self):
+        self.assertMergedEqual(lambda: PivotAggregator(
+            ['timestamp'], ['count', 'distinct:foo', 'min:foo', 'max:bar'],
+            date_format='%Y-%m'))
+
+    def test_top_aggregator(self):
+        self.assertMergedEqual(lambda: TopAggregator(
+            'foo', k=5, date_format='%Y-%m'))
+
+    def test_rollup_aggregator(self):
+        self.assertMergedEqual(lambda: RollupAggregator(
+            'count', {'fields': ['foo', 'bar']}, ['day', 'week']))
+        self.assertMergedEqual(lambda: RollupAggregator(
+            'aggregate', {'fields': ['foo'], 'approximate': True,
+                          'precision': 8}))
+
+    def test_mismatched(self):
+        paths = (
+            self.write_partials(lambda: SimpleAggregator(['foo']), 1, 'a') +
+            self.write_partials(lambda: SimpleAggregator(['bar']), 1, 'b'))
+        self.assertRaises(AggregatorException, self.merge, paths)
+        self.assertRaises(PartialException, self.merge, [__file__])
+
+    def test_partial_values(self):
+        sketch = HyperLogLog(4)
+        sketch.add('foo')
+        summary = SpaceSaving(1)
+        summary.add('\xc3\xa9')
+        summary.add(None, 2)
+        for value in [set(['a', None]), {'a': [1, {'b': '\xc3\xa9'}]}, sketch,
+                      summary]:
+            decoded = decode_value(json.loads(json.dumps(
+                encode_value(value))))
+            if value is sketch:
+                self.assertEqual(decoded.registers, sketch.registers)
+            elif value is summary:
+                self.assertEqual(decoded.top(1), [(None, 3, 1)])
+                self.assertEqual(decoded.total, 3)
+            else:
+                self.assertEqual(decoded, value)
+
+
+class CheckpointTestCase(TestCase):
+
+    EXPORT = os.path.join(os.path.dirname(__file__),
+                          'messages-export-good.csv')
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.path, 'checkpoint')
+        self.input_path = os.path.join(self.path, 'export.csv')
+        fp = open(self.EXPORT, 'rb')
+        self.records = [record for _, record in iter_records(fp, 0)]
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_aggregator(self):
+        return PivotAggregator(['direction'], ['count', 'distinct:to_addr',
+                                               'first:message_id'])
+
+    def write_input(self, records, mode='wb'):
+        fp = open(self.input_path, mode)
+        fp.write(''.join(records))
+        fp.close()
+
+    def process(self, stdin=None, **kwargs):
+        stdout = StringIO()
+        pipeline = AggregatorPipeline(
+            self.make_aggregator(), checkpoint_path=self.checkpoint_path,
+            **kwargs)
+        if stdin is None:
+            stdin = open(self.input_path, 'rb')
+        try:
+            pipeline.process(stdin=stdin, stdout=stdout)
+        finally:
+            stdin.close()
+        return stdout.getvalue()
+
+    def process_all(self, records):
+        stdout = StringIO()
+        AggregatorPipeline(self.make_aggregator()).process(
+            stdin=StringIO(''.join(records)), stdout=stdout)
+        return stdout.getvalue()
+
+    def test_resume_appended(self):
+        # The last record is half written.
+        self.write_input(self.records[:10] + [self.records[10][:20]])
+        self.assertEqual(self.process(), self.process_all(self.records[:10]))
+        self.write_input([self.records[10][20:]] + self.records[11:], 'ab')
+        self.assertEqual(self.process(resume=True),
+                         self.process_all(self.records))
+        # Nothing new, the totals stay the same.
+        self.assertEqual(self.process(resume=True),
+                         self.process_all(self.records))
+
+    def test_resume_rewritten(self):
+        self.write_input(self.records)
+        self.process()
+        self.write_input(self.records[:1] + self.records[5:])
+        self.assertEqual(self.process(resume=True),
+                         self.process_all(self.records[:1] +
+                                          self.records[5:]))
+
+    def test_without_resume(self):
+        self.write_input(self.records)
+        self.process()
+        self.assertEqual(self.process(), self.process_all(self.records))
+
+    def test_resume_stream(self):
+        self.process(StringIO(''.join(self.records[:10])))
+        self.assertEqual(
+            self.process(StringIO(''.join(self.records)), resume=True),
+            self.process_all(self.records))
+
+    def test_resume_partial(self):
+        self.write_input(self.records[:10])
+        self.process()
+        self.write_input(self.records[10:], 'ab')
+        partial_path = os.path.join(self.path, 'partial')
+        fp = open(partial_path, 'wb')
+        fp.write(self.process(resume=True, partial=True))
+        fp.close()
+        stdout = StringIO()
+        MergePipeline([partial_path]).process(stdout=stdout)
+        self.assertEqual(stdout.getvalue(), self.process_all(self.records))
+
+    def test_mismatched(self):
+        self.write_input(self.records)
+        self.process()
+        pipeline = AggregatorPipeline(
+            SimpleAggregator(['to_addr']),
+            checkpoint_path=self.checkpoint_path, resume=True)
+        self.assertRaises(CheckpointException, pipeline.process,
+                          stdin=open(self.input_path, 'rb'), stdout=StringIO())
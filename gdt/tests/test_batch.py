@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+from StringIO import StringIO
+from unittest import TestCase, skipIf
+
+import dateutil.parser
+
+from gdt.batch import numpy, Batches, ColumnBatch, read_rows
+from gdt.codec import CSVMessageCodec
+from gdt.filters import (
+    FilterPipeline, DirectionalFilter, MSISDNFilter, TimestampFilter,
+    WeekFilter, SessionEventFilter, IsAReplyFilter, RegexFilter)
+from gdt.aggregators import UniquesAggregator, SimpleAggregator
+from gdt.timestamps import parse_timestamp, to_epoch
+
+
+def make_rows(count):
+    start = datetime(2012, 12, 20, 10, 30)
+    rows = []
+    for i in range(count):
+        rows.append({
+            'timestamp': str(start + timedelta(hours=i * 7, microseconds=i)),
+            'from_addr': '+2781%07d' % (i % 5,),
+            'to_addr': '*120*%s#' % (i % 2,),
+            'direction': ['inbound', 'outbound'][i % 3 == 0],
+            'session_event': [None, 'new', 'resume', 'close'][i % 4],
+            'in_reply_to': ['', 'abc'][i % 2],
+            'content': 'message %s' % (i,),
+        })
+    return rows
+
+
+@skipIf(numpy is None, 'NumPy is not installed.')
+class ColumnBatchTestCase(TestCase):
+
+    def setUp(self):
+        self.rows = make_rows(200)
+        self.batch = ColumnBatch(self.rows)
+
+    def test_categorical(self):
+        codes, categories = self.batch.categorical('direction')
+        self.assertEqual(categories, ['outbound', 'inbound'])
+        self.assertEqual(codes[:4].tolist(), [0, 1, 1, 0])
+
+    def test_weeks(self):
+        years, weeks = self.batch.weeks()
+        for row, year, week in zip(self.rows, years, weeks):
+            timestamp = dateutil.parser.parse(row['timestamp'])
+            self.assertEqual(
+                (year, week),
+                (int(timestamp.strftime('%Y')),
+                 int(timestamp.strftime('%W'))))
+
+    def test_timestamps(self):
+        self.assertEqual(
+            self.batch.timestamps().tolist(),
+            [to_epoch(parse_timestamp(row['timestamp']))
+             for row in self.rows])
+        # Timestamps NumPy can't parse the same way are parsed one by one.
+        timestamps = ['2013-09-01 10:00:00', '1 September 2013 12:00']
+        batch = ColumnBatch([{'timestamp': value} for value in timestamps])
+        self.assertEqual(
+            batch.timestamps().tolist(),
+            [to_epoch(parse_timestamp(value)) for value in timestamps])
+
+    def test_read_rows(self):
+        sample = ('timestamp,direction,content\r\n'
+                  '2013-09-01 10:00:00,inbound,a\r\n'
+                  '\r\n'
+                  '2013-09-01 11:00:00,outbound\r\n'
+                  '2013-09-01 12:00:00,inbound,c\r\n')
+        codec = CSVMessageCodec(StringIO(sample), StringIO())
+        rows = read_rows(codec, 2)
+        self.assertTrue(isinstance(rows, Batches))
+        batches = list(rows.batches)
+        self.assertEqual([len(batch) for batch in batches], [1, 2])
+        # Columns are taken straight from the values read.
+        self.assertEqual(batches[1].column('content'), [None, 'c'])
+        self.assertEqual(batches[1].column('missing'), [None, None])
+        mask = DirectionalFilter('inbound').process_batch(batches[1])
+        [row] = batches[1].select(mask)
+        self.assertTrue(row.index is codec.index)
+        self.assertEqual(row['timestamp'], '2013-09-01 12:00:00')
+        # Iterating over the batches yields their rows.
+        self.assertEqual(
+            list(read_rows(CSVMessageCodec(StringIO(sample), StringIO()), 2)),
+            list(CSVMessageCodec(StringIO(sample), StringIO()).readrows()))
+
+    def test_group_codes(self):
+        batch = ColumnBatch([{'timestamp': 'b'}, {'timestamp': 'a'},
+                             {'timestamp': 'b'}])
+        keys, inverse, counts = batch.group_codes('timestamp')
+        self.assertEqual(keys, ['b', 'a'])
+        self.assertEqual(inverse.tolist(), [0, 1, 0])
+        self.assertEqual(counts.tolist(), [2, 1])
+
+    def test_filters(self):
+        filters = [
+            DirectionalFilter('inbound'),
+            MSISDNFilter('from_addr', '+27810000003'),
+            TimestampFilter(datetime(2013, 1, 1)),
+            TimestampFilter(datetime(2013, 1, 1), datetime(2013, 1, 3)),
+            WeekFilter(2013, [0, 2, 3]),
+            SessionEventFilter('new'),
+            SessionEventFilter(None),
+            IsAReplyFilter(),
+            RegexFilter('content', 'message 1', False),
+            DirectionalFilter('inbound').chain(SessionEventFilter('new')),
+        ]
+        for filter_ in filters:
+            self.assertEqual(
+                filter_.process_batch(self.batch).tolist(),
+                [bool(filter_.process(row)) for row in self.rows])
+
+    def test_filter_pipeline(self):
+        header = 'timestamp,direction,session_event\r\n'
+        sample = header + ''.join(
+            '%(timestamp)s,%(direction)s,%(session_event)s\r\n' % row
+            for row in self.rows)
+        filters = [
+            WeekFilter(2013, [1]),
+            DirectionalFilter('outbound').chain(SessionEventFilter('new')),
+        ]
+        stdout = StringIO()
+        FilterPipeline(filters).process(StringIO(sample), stdout)
+        batch_stdout = StringIO()
+        FilterPipeline(filters, batch_size=16).process(
+            StringIO(sample), batch_stdout)
+        self.assertEqual(batch_stdout.getvalue(), stdout.getvalue())
+        pipeline = FilterPipeline(filters, batch_size=16)
+        pipeline.threaded = True
+        threaded_stdout = StringIO()
+        pipeline.process(StringIO(sample), threaded_stdout)
+        self.assertEqual(threaded_stdout.getvalue(), stdout.getvalue())
+
+    def test_aggregators(self):
+        for aggregator_class in [UniquesAggregator, SimpleAggregator]:
+            rows = [{'timestamp': row['timestamp'][:10],
+                     'from_addr': row['from_addr'],
+                     'to_addr': row['to_addr']} for row in self.rows]
+            aggregator = aggregator_class(['from_addr', 'to_addr'])
+            for row in rows:
+                aggregator.aggregate(row)
+            batch_aggregator = aggregator_class(['from_addr', 'to_addr'])
+            batch_aggregator.aggregate_batch(ColumnBatch(rows[:50]))
+            batch_aggregator.aggregate_batch(ColumnBatch(rows[50:]))
+            self.assertEqual(list(batch_aggregator.get_data()),
+                             list(aggregator.get_data()))
@@ -0,0 +1,134 @@
+import json
+import os
+from StringIO import StringIO
+from unittest import TestCase
+
+from gdt.aggregators import AggregatorPipeline, SimpleAggregator
+from gdt.binary import (BinaryMessageCodec, BinaryWriter, BinaryException,
+                        is_gdt_pipe)
+from gdt.codec import CSVMessageCodec, JSONMessageCodec
+from gdt.extractors import ExtractorPipeline, FieldExtractor
+from gdt.filters import FilterPipeline, DirectionalFilter, RegexFilter
+from gdt.inputs import InputReader
+
+
+class BinaryTestCase(TestCase):
+
+    EXPORT = os.path.join(os.path.dirname(__file__),
+                          'messages-export-good.csv')
+
+    def setUp(self):
+        self.data = open(self.EXPORT, 'rb').read()
+
+    def process(self, pipeline, data, binary=False):
+        pipeline.writer_class = BinaryWriter if binary else None
+        stdout = StringIO()
+        pipeline.process(stdin=StringIO(data), stdout=stdout)
+        return stdout.getvalue()
+
+    def decode(self, data):
+        stdout = StringIO()
+        codec = BinaryMessageCodec(StringIO(data), stdout)
+        for row in codec.readrows():
+            codec.writerow(row)
+        codec.flush()
+        return stdout.getvalue()
+
+    def test_csv(self):
+        pipeline = FilterPipeline([DirectionalFilter('inbound')])
+        expected = self.process(pipeline, self.data)
+        binary = self.process(pipeline, self.data, binary=True)
+        self.assertNotEqual(binary, expected)
+        pipeline.codec_class = BinaryMessageCodec
+        self.assertEqual(self.process(pipeline, binary), expected)
+        # Through several hops.
+        self.assertEqual(self.process(
+            pipeline, self.process(pipeline, binary, binary=True)), expected)
+
+    def test_json(self):
+        rows = [{'direction': ['inbound', 'outbound'][i % 2],
+                 'content': u'caf\xe9 %s' % (i,), 'extra': {'a': [i]}}
+                for i in range(10)]
+        rows[3]['only'] = None
+        data = ''.join(json.dumps(row) + '\n' for row in rows)
+        pipeline = FilterPipeline([DirectionalFilter('inbound')],
+                                  codec_class=JSONMessageCodec)
+        binary = self.process(pipeline, data, binary=True)
+        pipeline.codec_class = BinaryMessageCodec
+        self.assertEqual(
+            [json.loads(line)
+             for line in self.process(pipeline, binary).splitlines()],
+            rows[::2])
+
+    def test_added_fields(self):
+        pipeline = FilterPipeline([RegexFilter(
+            'content', patterns_path=None, pattern='(?i)we think',
+            match_field='keyword')])
+        expected = self.process(pipeline, self.data)
+        binary = self.process(pipeline, self.data, binary=True)
+        pipeline = FilterPipeline([DirectionalFilter('outbound')],
+                                  codec_class=BinaryMessageCodec)
+        self.assertEqual(self.process(pipeline, binary), expected)
+
+    def test_aggregator(self):
+        pipeline = AggregatorPipeline(SimpleAggregator(['to_addr']))
+        expected = self.process(pipeline, self.data)
+        pipeline = AggregatorPipeline(SimpleAggregator(['to_addr']))
+        binary = self.process(pipeline, self.data, binary=True)
+        self.assertEqual(self.decode(binary), expected)
+
+    def test_extract_count(self):
+        # `gdt extract ... | gdt count ...` pipes binary rows.
+        extractor = ExtractorPipeline(
+            [FieldExtractor(['from_addr'], '%Y-%m-%d')])
+        expected = self.process(
+            AggregatorPipeline(SimpleAggregator(['from_addr'])),
+            self.process(extractor, self.data))
+        self.assertEqual(expected.splitlines(),
+                         ['timestamp,from_addr', '2013-09-09,19'])
+        binary = self.process(extractor, self.data, binary=True)
+        pipeline = AggregatorPipeline(SimpleAggregator(['from_addr']),
+                                      codec_class=BinaryMessageCodec)
+        self.assertEqual(self.process(pipeline, binary), expected)
+
+    def test_concatenated(self):
+        pipeline = FilterPipeline([DirectionalFilter('inbound')])
+        expected = self.process(pipeline, self.data)
+        header, rest = expected.split('\n', 1)
+        binary = self.process(pipeline, self.data, binary=True)
+        pipeline.codec_class = BinaryMessageCodec
+        self.assertEqual(self.process(pipeline, binary * 2),
+                         header + '\n' + rest * 2)
+
+    def test_invalid(self):
+        self.assertRaises(BinaryException, BinaryMessageCodec,
+                          StringIO(self.data), StringIO())
+        pipeline = FilterPipeline([DirectionalFilter('inbound')])
+        binary = self.process(pipeline, self.data, binary=True)
+        codec = BinaryMessageCodec(StringIO(binary[:-10]), StringIO())
+        self.assertRaises(BinaryException, list, codec.readrows())
+
+    def test_input_reader(self):
+        pipeline = FilterPipeline([DirectionalFilter('inbound')])
+        expected = self.process(pipeline, self.data)
+        binary = self.process(pipeline, self.data, binary=True)
+        r, w = os.pipe()
+        os.write(w, binary)
+        os.close(w)
+        stdin = InputReader(lambda size: os.read(r, size))
+        self.assertEqual(stdin.peek(3), binary[:3])
+        pipeline.codec_class = BinaryMessageCodec
+        pipeline.writer_class = None
+        stdout = StringIO()
+        pipeline.process(stdin=stdin, stdout=stdout)
+        os.close(r)
+        self.assertEqual(stdout.getvalue(), expected)
+
+    def test_is_gdt_pipe(self):
+        self.assertFalse(is_gdt_pipe(StringIO()))
+        r, w = os.pipe()
+        try:
+            self.assertFalse(is_gdt_pipe(os.fdopen(os.dup(w), 'wb')))
+        finally:
+            os.close(r)
+            os.close(w)
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from gdt.aggregators import AggregatorPipeline, SimpleAggregator
+from gdt.checkpoint import Checkpoint
+from gdt.codec import CSVMessageCodec
+
+
+class CheckpointTestCase(TestCase):
+
+    EXPORT = os.path.join(os.path.dirname(__file__),
+                          'messages-export-good.csv')
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.path, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def process(self, **kwargs):
+        stdout = StringIO()
+        with open(self.EXPORT, 'rb') as stdin:
+            AggregatorPipeline(SimpleAggregator(['direction']),
+                               **kwargs).process(stdin=stdin, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_save_unread(self):
+        # Saved after opening a file but before reading any of it.
+        checkpoint = Checkpoint(self.checkpoint_path,
+                                SimpleAggregator(['direction']),
+                                CSVMessageCodec)
+        with open(self.EXPORT, 'rb') as stdin:
+            checkpoint.open_input(stdin)
+            self.assertEqual(list(checkpoint.save(iter([]))), [])
+
+        resumed = Checkpoint(self.checkpoint_path,
+                             SimpleAggregator(['direction']),
+                             CSVMessageCodec, resume=True)
+        self.assertEqual(resumed.mark, {'offset': 0, 'checksum': None})
+        # Nothing was read, so all of the file is.
+        self.assertEqual(
+            self.process(checkpoint_path=self.checkpoint_path, resume=True),
+            self.process())
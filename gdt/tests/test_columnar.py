@@ -0,0 +1,161 @@
+import os
+import json
+import shutil
+import tempfile
+from StringIO import StringIO
+from datetime import datetime
+from unittest import TestCase, skipIf
+
+from gdt.codec import CSVMessageCodec, JSONMessageCodec
+from gdt.columnar import (ColumnarStore, ColumnarMessageCodec,
+                          ColumnarException, ConvertPipeline, is_columnar,
+                          NO_TIMESTAMP)
+from gdt.batch import numpy
+from gdt.filters import (FilterPipeline, DirectionalFilter, RegexFilter,
+                         TimestampFilter)
+from gdt.extractors import ExtractorPipeline, FieldExtractor
+from gdt.aggregators import AggregatorPipeline, SimpleAggregator
+from gdt.pipeline import ChainedPipeline
+
+
+class ColumnarTestCase(TestCase):
+
+    HEADER = 'timestamp,from_addr,content,direction,session_event\r\n'
+    CSV = HEADER + (
+        '2013-09-10 19:24:03.289543,+27817030792,"hello\r\nworld",'
+        'inbound,new\r\n'
+        '2013-09-10 19:25:03.289543,+27817030793,\xc3\xa9,outbound,\r\n'
+        '2013-09-11 19:24:03.289543,+27817030792,,inbound,close\r\n')
+    JSON = '\n'.join([
+        json.dumps({'timestamp': '2013-09-11 19:24:03.289543',
+                    'direction': 'inbound', 'content': u'\xe9',
+                    'helper_metadata': {'go': {'user_account': 'abc'}}}),
+        json.dumps({'timestamp': '2013-09-10 19:24:03.289543',
+                    'direction': 'outbound', 'in_reply_to': None}),
+    ]) + '\n'
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.path, 'export')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def convert(self, data, codec_class):
+        ConvertPipeline(self.output_path, codec_class=codec_class).process(
+            stdin=StringIO(data), stdout=StringIO())
+        return ColumnarStore(self.output_path)
+
+    def process(self, make_pipeline, data, codec_class=CSVMessageCodec,
+                batch_size=None):
+        store = self.convert(data, codec_class)
+        pipeline = make_pipeline()
+        pipeline.codec_class = codec_class
+        expected = StringIO()
+        pipeline.process(stdin=StringIO(data), stdout=expected)
+        pipeline = make_pipeline()
+        pipeline.codec_class = ColumnarMessageCodec
+        pipeline.batch_size = batch_size
+        stdout = StringIO()
+        pipeline.process(stdin=store, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), expected.getvalue())
+        return stdout.getvalue()
+
+    def test_convert_csv(self):
+        store = self.convert(self.CSV, CSVMessageCodec)
+        self.assertTrue(is_columnar(self.output_path))
+        self.assertEqual(len(store), 3)
+        self.assertTrue(store.sorted)
+        self.assertEqual(store.fields, [
+            'timestamp', 'from_addr', 'content', 'direction',
+            'session_event'])
+        rows = list(store.readrows())
+        self.assertEqual(rows[0]['content'], 'hello\r\nworld')
+        self.assertEqual(rows[1]['content'], '\xc3\xa9')
+        self.assertEqual(rows[1]['session_event'], '')
+        self.assertEqual(rows[2].get('from_addr'), '+27817030792')
+        self.assertEqual(rows[2].get('foo'), None)
+        self.assertRaises(KeyError, lambda: rows[2]['foo'])
+        self.assertEqual(store.epochs()[0], 1378841043289543)
+
+    def test_convert_json(self):
+        store = self.convert(self.JSON, JSONMessageCodec)
+        self.assertFalse(store.sorted)
+        rows = list(store.readrows())
+        self.assertEqual(rows[0]['helper_metadata'],
+                         {'go': {'user_account': 'abc'}})
+        self.assertFalse('in_reply_to' in rows[0])
+        self.assertTrue('in_reply_to' in rows[1])
+        self.assertEqual(rows[1]['in_reply_to'], None)
+        self.assertEqual(dict(rows[1].items()), {
+            'timestamp': '2013-09-10 19:24:03.289543',
+            'direction': 'outbound', 'in_reply_to': None})
+
+    def test_row_updates(self):
+        store = self.convert(self.CSV, CSVMessageCodec)
+        row = store.readrows().next()
+        row['foo'] = 'bar'
+        row['direction'] = 'outbound'
+        self.assertEqual(row['foo'], 'bar')
+        self.assertEqual(row['direction'], 'outbound')
+        self.assertTrue('foo' in row.keys())
+
+    def test_missing_timestamp(self):
+        store = self.convert('from_addr\r\n+123\r\n', CSVMessageCodec)
+        self.assertEqual(store.epochs()[0], NO_TIMESTAMP)
+
+    def test_not_columnar(self):
+        self.assertRaises(ColumnarException, ColumnarStore, self.path)
+
+    def test_filter_pipeline(self):
+        self.process(
+            lambda: FilterPipeline([DirectionalFilter('inbound'),
+                                    RegexFilter('content', '\xc3', False)]),
+            self.CSV)
+        self.process(
+            lambda: FilterPipeline([DirectionalFilter('inbound')]),
+            self.JSON, JSONMessageCodec)
+
+    @skipIf(numpy is None, 'NumPy is not installed.')
+    def test_batches(self):
+        make_pipeline = lambda: FilterPipeline([
+            DirectionalFilter('inbound').chain(
+                TimestampFilter(datetime(2013, 9, 11))),
+            RegexFilter('content', 'hello', False)])
+        output = self.process(make_pipeline, self.CSV, batch_size=2)
+        self.assertEqual(output.count('inbound'), 2)
+        output = self.process(make_pipeline, self.JSON, JSONMessageCodec,
+                              batch_size=2)
+        self.assertEqual(output.count('inbound'), 1)
+        store = self.convert(self.CSV, CSVMessageCodec)
+        [batch] = store.read_batches(3)
+        codes, categories = batch.categorical('direction')
+        self.assertEqual([categories[code] for code in codes],
+                         ['inbound', 'outbound', 'inbound'])
+        self.assertEqual(batch.timestamps().tolist(),
+                         store.read_epochs(0, 3).tolist())
+        # Selected rows are read with all of their values, in order.
+        [row] = batch.select(numpy.array([False, True, False]))
+        self.assertTrue(row.index is store.index)
+        self.assertEqual(row.values, [
+            '2013-09-10 19:25:03.289543', '+27817030793', '\xc3\xa9',
+            'outbound', ''])
+
+    @skipIf(numpy is None, 'NumPy is not installed.')
+    def test_read_fields(self):
+        store = self.convert(self.CSV, CSVMessageCodec)
+        codec = ColumnarMessageCodec(store, StringIO())
+        codec.select_fields(['direction', 'foo', 'timestamp'])
+        rows = list(codec.readrows())
+        self.assertEqual([row['direction'] for row in rows],
+                         ['inbound', 'outbound', 'inbound'])
+        self.assertEqual(rows[2]['timestamp'], '2013-09-11 19:24:03.289543')
+        self.assertFalse('content' in rows[0])
+
+    def test_chained_pipeline(self):
+        self.assertEqual(
+            self.process(lambda: ChainedPipeline([
+                ExtractorPipeline([FieldExtractor(['from_addr'], '%d')]),
+                AggregatorPipeline(SimpleAggregator(['from_addr'])),
+            ]), self.CSV),
+            'timestamp,from_addr\r\n10,2\r\n11,1\r\n')
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from gdt.contacts import ContactSet, normalize_msisdn, address_key
+from gdt.sketches import BloomFilter, SketchException
+
+
+class ContactsTestCase(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_addresses(self, addresses):
+        path = os.path.join(self.path, 'contacts.txt')
+        fp = open(path, 'wb')
+        fp.write('\n'.join(addresses) + '\n\n')
+        fp.close()
+        return path
+
+    def test_normalize_msisdn(self):
+        self.assertEqual(normalize_msisdn('+27 82 123-4567'), '+27821234567')
+        self.assertEqual(normalize_msisdn('0027821234567'), '+27821234567')
+        self.assertEqual(normalize_msisdn('0821234567'), '0821234567')
+        self.assertEqual(normalize_msisdn('0821234567', '27'), '+27821234567')
+        self.assertEqual(normalize_msisdn('27821234567', '27'), '+27821234567')
+        self.assertEqual(normalize_msisdn(u'+27821234567'), '+27821234567')
+        self.assertEqual(normalize_msisdn('*120*123#'), '*120*123#')
+        self.assertEqual(normalize_msisdn('user@example.org'),
+                         'user@example.org')
+        self.assertEqual(normalize_msisdn(None), None)
+        self.assertEqual(address_key('+27 82 123 4567'),
+                         address_key(u'+27821234567'))
+
+    def test_load(self):
+        path = self.write_addresses(['+2782000000%d' % (i,)
+                                     for i in range(5)])
+        contacts = ContactSet.load(['0820000009'], path, country_code='27')
+        self.assertTrue(contacts.exact)
+        self.assertEqual(len(contacts.keys), 6)
+        self.assertTrue('+27820000009' in contacts)
+        self.assertTrue('0820000004' in contacts)
+        self.assertFalse('+27820000005' in contacts)
+        self.assertFalse(None in contacts)
+
+    def test_bloom_filter(self):
+        addresses = ['+2782%07d' % (i,) for i in range(10000)]
+        path = self.write_addresses(addresses)
+        contacts = ContactSet.load(addresses_path=path, error_rate=0.01)
+        self.assertFalse(contacts.exact)
+        self.assertTrue(all(address in contacts for address in addresses))
+        false_positives = sum(
+            1 for i in range(10000) if '+2783%07d' % (i,) in contacts)
+        self.assertTrue(false_positives < 200)
+
+        self.assertRaises(SketchException, BloomFilter, 10, 0)
+        bloom = BloomFilter(0)
+        bloom.add(address_key('+123'))
+        self.assertTrue(address_key('+123') in bloom)
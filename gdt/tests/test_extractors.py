@@ -1,6 +1,7 @@
+from StringIO import StringIO
 from unittest import TestCase
 
-from gdt.extractors import FieldExtractor
+from gdt.extractors import ExtractorPipeline, FieldExtractor
 
 
 class ExtractorTestCase(TestCase):
@@ -34,3 +35,12 @@ class ExtractorTestCase(TestCase):
                 'foo': '1',
                 'timestamp': '2014',
             })
+
+    def test_extractor_pipeline(self):
+        stdout = StringIO()
+        ExtractorPipeline([FieldExtractor(['foo'], '%Y')]).process(
+            stdin=StringIO('timestamp,foo,bar\n2014-01-01,1,2\n'),
+            stdout=stdout)
+        # Only the extracted fields have a header.
+        self.assertEqual(stdout.getvalue().splitlines(),
+                         ['timestamp,foo', '2014,1'])
@@ -3,11 +3,12 @@ from StringIO import StringIO
 from unittest import TestCase
 from datetime import datetime
 
-from gdt.codec import CSVMessageCodec, JSONMessageCodec
+from gdt.codec import CSVMessageCodec, JSONMessageCodec, get_json_backend
 from gdt.filters import (
     DirectionalFilter, MSISDNFilter, TimestampFilter,
     FilterPipeline, FilterException, IsAReplyFilter, IsNotAReplyFilter,
-    SessionEventFilter, WeekFilter)
+    SessionEventFilter, WeekFilter, ContactFilter, compile_predicate,
+    order_chains)
 
 
 
@@ -28,6 +29,21 @@ class FilterTestCase(TestCase):
         self.assertTrue(f.apply({'from_addr': '123'}))
         self.assertFalse(f.apply({'to_addr': '123'}))
 
+    def test_contact_filter(self):
+        f = ContactFilter(['+27 82 000 0001', '0027820000002'])
+        self.assertTrue(f.apply({'from_addr': '+27820000001'}))
+        self.assertTrue(f.apply({'from_addr': '+27820000002'}))
+        self.assertFalse(f.apply({'from_addr': '+27820000003'}))
+        self.assertFalse(f.apply({'to_addr': '+27820000001'}))
+
+        f = ContactFilter(['0820000001'], addr_type='to_addr',
+                          country_code='27')
+        self.assertTrue(f.apply({'to_addr': '+27820000001'}))
+        self.assertFalse(f.apply({'from_addr': '+27820000001'}))
+
+        self.assertRaises(FilterException, ContactFilter)
+        self.assertRaises(FilterException, ContactFilter, ['1'], None, 'foo')
+
     def test_timestamp_filter(self):
         f = TimestampFilter(datetime(2013, 1, 1))
         self.assertTrue(f.apply({'timestamp': '2013-01-01'}))
@@ -76,6 +92,70 @@ class FilterTestCase(TestCase):
 
 
 
+class FilterOrderingTestCase(TestCase):
+
+    ROWS = [{'direction': ['inbound', 'outbound'][i % 10 == 0],
+             'timestamp': '2013-09-%02d 10:00:00' % (i % 30 + 1,)}
+            for i in range(300)]
+
+    def test_compile_predicate(self):
+        predicate = compile_predicate([[bool, lambda row: row > 1], [bool]])
+        self.assertTrue(predicate(2))
+        self.assertTrue(predicate(1))
+        self.assertFalse(predicate(0))
+        self.assertFalse(compile_predicate([])(1))
+
+    def test_order_chains(self):
+        timestamp = TimestampFilter(datetime(2013, 9, 1))
+        direction = DirectionalFilter('outbound')
+        never = MSISDNFilter('from_addr', '+1')
+        always = IsNotAReplyFilter()
+        [chain] = order_chains([[always, direction]], self.ROWS)
+        self.assertEqual(chain, [direction, always])
+        # Nothing is moved ahead of a filter that can raise.
+        [chain] = order_chains([[timestamp, direction]], self.ROWS)
+        self.assertEqual(chain, [timestamp, direction])
+        [chain] = order_chains([[direction, timestamp, never]], self.ROWS)
+        self.assertEqual(chain, [direction, timestamp, never])
+
+        self.assertEqual(order_chains([[never], [always]], self.ROWS),
+                         [[always], [never]])
+        self.assertEqual(order_chains([[timestamp], [always]], self.ROWS),
+                         [[timestamp], [always]])
+
+    def test_identical_results(self):
+        def process(warmup_size):
+            pipeline = FilterPipeline([
+                TimestampFilter(datetime(2013, 9, 5),
+                                datetime(2013, 9, 20)).chain(
+                    DirectionalFilter('outbound')),
+                DirectionalFilter('inbound').chain(
+                    WeekFilter(2013, [36])),
+            ])
+            pipeline.warmup_size = warmup_size
+            return list(pipeline.process_rows(self.ROWS))
+
+        self.assertEqual(process(10), process(0))
+        # Rows the filters raise an error for in the order given still do.
+        rows = [{'direction': 'outbound', 'timestamp': '2013-09-10'}] * 10
+        rows.append({'direction': 'inbound', 'timestamp': 'foo'})
+        pipeline = FilterPipeline([DirectionalFilter('outbound').chain(
+            TimestampFilter(datetime(2013, 9, 1)))])
+        pipeline.warmup_size = 5
+        self.assertEqual(len(list(pipeline.process_rows(rows))), 10)
+
+        # & rows they raise an error for aren't dropped by a filter moved
+        # ahead of them.
+        rows = [{'direction': 'inbound', 'timestamp': '2013-09-10'}] * 10
+        rows.append({'direction': 'outbound', 'timestamp': 'garbage'})
+        for warmup_size in [0, 5]:
+            pipeline = FilterPipeline([TimestampFilter(
+                datetime(2013, 9, 1)).chain(DirectionalFilter('outbound'))])
+            pipeline.warmup_size = warmup_size
+            self.assertRaises(
+                Exception, list, pipeline.process_rows(rows))
+
+
 class CSVFilterPipelineTestCase(TestCase):
 
     CODEC_CLASS = CSVMessageCodec
@@ -192,3 +272,103 @@ class JSONFilterPipelineTestCase(TestCase):
             d1, d2,
             'Line 1:\n%s\n\nDoes not match Line 2:\n%s' % (
                 json.dumps(d1, indent=2), json.dumps(d2, indent=2)))
+
+
+class JSONMessageCodecTestCase(TestCase):
+
+    ROWS = [{'id': i, 'content': u'caf\xe9 %s' % (i,), 'url': 'a/b'}
+            for i in range(25)]
+
+    def make_codec(self, rows=(), **kwargs):
+        stdin = StringIO(''.join(json.dumps(row) + '\n' for row in rows))
+        codec = JSONMessageCodec(stdin, StringIO())
+        for name, value in kwargs.items():
+            setattr(codec, name, value)
+        return codec
+
+    def test_readrows(self):
+        codec = self.make_codec(self.ROWS)
+        self.assertEqual(list(codec.readrows()), self.ROWS)
+
+    def test_readrows_invalid(self):
+        codec = self.make_codec(self.ROWS)
+        codec.stdin = StringIO(codec.stdin.getvalue() + '{"id": \n')
+        rows = codec.readrows()
+        for _ in range(20):
+            rows.next()
+        self.assertRaises(ValueError, list, rows)
+        # Two rows on one line aren't read as two rows.
+        codec.stdin = StringIO('{"id": 1}\n{"id": 2},{"id": 3}\n')
+        self.assertRaises(ValueError, list, codec.readrows())
+
+    def test_writerow(self):
+        codec = self.make_codec(write_batch_size=10)
+        for row in self.ROWS[:15]:
+            codec.writerow(row)
+        self.assertEqual(len(codec.stdout.getvalue().splitlines()), 10)
+        for row in self.ROWS[15:]:
+            codec.writerow(row)
+        codec.flush()
+        self.assertEqual([json.loads(line)
+                          for line in codec.stdout.getvalue().splitlines()],
+                         self.ROWS)
+        self.assertTrue('a/b' in codec.stdout.getvalue())
+
+    def test_get_json_backend(self):
+        self.assertEqual(get_json_backend(['not_a_json_module']), json)
+        self.assertEqual(get_json_backend(['not_a_json_module', 'json']),
+                         json)
+
+
+class CSVMessageCodecTestCase(TestCase):
+
+    SAMPLE = ('timestamp,direction,content\r\n'
+              '2013-09-10,inbound,"foo\nbar"\r\n'
+              '\r\n'
+              '2013-09-11,outbound\r\n')
+
+    def make_codec(self):
+        return CSVMessageCodec(StringIO(self.SAMPLE), StringIO(),
+                               write_header=False)
+
+    def test_rows(self):
+        rows = list(self.make_codec().readrows())
+        self.assertEqual(rows, [
+            {'timestamp': '2013-09-10', 'direction': 'inbound',
+             'content': 'foo\nbar'},
+            {'timestamp': '2013-09-11', 'direction': 'outbound',
+             'content': None},
+        ])
+        row = rows[0]
+        self.assertEqual(row.keys(), ['timestamp', 'direction', 'content'])
+        self.assertEqual(row.get('foo', 'bar'), 'bar')
+        self.assertRaises(KeyError, lambda: row['foo'])
+        row['foo'] = 'bar'
+        row['direction'] = 'outbound'
+        self.assertTrue('foo' in row)
+        self.assertEqual(dict(row), {
+            'timestamp': '2013-09-10', 'direction': 'outbound',
+            'content': 'foo\nbar', 'foo': 'bar'})
+
+    def test_select_fields(self):
+        codec = self.make_codec()
+        codec.select_fields(['direction', 'timestamp', 'missing'])
+        self.assertEqual(list(codec.readrows()), [
+            {'timestamp': '2013-09-10', 'direction': 'inbound'},
+            {'timestamp': '2013-09-11', 'direction': 'outbound'},
+        ])
+
+    def test_writerow(self):
+        codec = self.make_codec()
+        codec.add_field_names(['match'])
+        codec.write_header()
+        for index, row in enumerate(codec.readrows()):
+            if index:
+                row['match'] = 'yes'
+            codec.writerow(row)
+        codec.writerow({'timestamp': '2013-09-12', 'match': 'no'})
+        self.assertEqual(codec.stdout.getvalue(), (
+            'timestamp,direction,content,match\r\n'
+            '2013-09-10,inbound,"foo\nbar",\r\n'
+            '2013-09-11,outbound,,yes\r\n'
+            '2013-09-12,,,no\r\n'))
@@ -0,0 +1,313 @@
+import os
+import json
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from StringIO import StringIO
+from unittest import TestCase
+
+from gdt.codec import CSVMessageCodec, JSONMessageCodec
+from gdt.contacts import address_key
+from gdt.columnar import ConvertPipeline, ColumnarStore
+from gdt.extractors import ExtractorPipeline, FieldExtractor
+from gdt.filters import (FilterPipeline, TimestampFilter, WeekFilter,
+                         DirectionalFilter, MSISDNFilter, ContactFilter)
+from gdt.index import (TimestampIndex, AddressIndex, IndexPipeline,
+                       iter_records, intersect_windows, merge_ranges,
+                       open_indexed)
+from gdt.pipeline import ChainedPipeline
+
+
+class IndexHelpersTestCase(TestCase):
+
+    def test_iter_records(self):
+        data = StringIO('a,b\n1,"x\ny"\n3,4\n5,"')
+        self.assertEqual(list(iter_records(data, 0)), [
+            (0, 'a,b\n'), (4, '1,"x\ny"\n'), (12, '3,4\n')])
+
+    def test_merge_ranges(self):
+        self.assertEqual(merge_ranges([(5, 10), (0, 5), (20, 30), (25, 26)]),
+                         [(0, 10), (20, 30)])
+
+    def test_intersect_windows(self):
+        self.assertEqual(intersect_windows(None, [(1, 2)]), [(1, 2)])
+        self.assertEqual(intersect_windows([(1, 2)], None), [(1, 2)])
+        self.assertEqual(
+            intersect_windows([(1, 5), (7, None)], [(None, 3), (4, 8)]),
+            [(1, 3), (4, 5), (7, 8)])
+        self.assertEqual(intersect_windows([(1, 2)], [(3, 4)]), [])
+
+    def test_filter_time_windows(self):
+        f = TimestampFilter(datetime(2013, 1, 1)).chain(
+            TimestampFilter(datetime(2012, 1, 1), datetime(2013, 2, 1)))
+        self.assertEqual(f.get_chain_time_windows(),
+                         [(datetime(2013, 1, 1), datetime(2013, 2, 1))])
+        self.assertEqual(DirectionalFilter('inbound').get_time_windows(),
+                         None)
+        self.assertEqual(
+            FilterPipeline([f, DirectionalFilter('inbound')])
+            .get_time_windows(), None)
+        self.assertEqual(
+            ChainedPipeline([
+                FilterPipeline([DirectionalFilter('inbound')]),
+                FilterPipeline([f]),
+                ExtractorPipeline([FieldExtractor(['from_addr'], '%Y')]),
+                FilterPipeline([TimestampFilter(datetime(2014, 1, 1))]),
+            ]).get_time_windows(),
+            [(datetime(2013, 1, 1), datetime(2013, 2, 1))])
+
+    def test_week_filter_time_windows(self):
+        for year in [2012, 2013, 2018]:
+            f = WeekFilter(year, [0, 1, 20, 52, 53])
+            windows = f.get_time_windows()
+            day = datetime(year - 1, 12, 25)
+            while day < datetime(year + 1, 1, 7):
+                timestamp = str(day)
+                self.assertEqual(
+                    bool(f.apply({'timestamp': timestamp})),
+                    any(start <= day < end for start, end in windows))
+                day += timedelta(hours=6)
+
+
+class TimestampIndexTestCase(TestCase):
+
+    HEADER = 'timestamp,content,direction\r\n'
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.export_path = os.path.join(self.path, 'export.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_rows(self, count, start=datetime(2013, 9, 1), shuffle=False):
+        rows = []
+        for i in range(count):
+            hours = (i * 7919) % count if shuffle else i
+            rows.append((str(start + timedelta(hours=hours)),
+                         '"message %s\r\nnext line"' % (i,),
+                         ['inbound', 'outbound'][i % 2]))
+        return rows
+
+    def write(self, rows, mode='wb', header=True):
+        fp = open(self.export_path, mode)
+        if header:
+            fp.write(self.HEADER)
+        for row in rows:
+            fp.write('%s\r\n' % (','.join(row),))
+        fp.close()
+
+    def query(self, make_pipeline):
+        index = TimestampIndex(self.export_path, CSVMessageCodec).update()
+        pipeline = make_pipeline()
+        stdout = StringIO()
+        pipeline.process(
+            stdin=index.open(pipeline.get_time_windows()),
+            stdout=stdout)
+        pipeline = make_pipeline()
+        expected = StringIO()
+        pipeline.process(
+            stdin=open(self.export_path, 'rb'), stdout=expected)
+        self.assertEqual(stdout.getvalue(), expected.getvalue())
+        return stdout.getvalue()
+
+    def test_sorted(self):
+        self.write(self.make_rows(1000))
+        index = TimestampIndex(
+            self.export_path, CSVMessageCodec, block_size=10).update()
+        self.assertTrue(index.sorted)
+        self.assertEqual(len(index.blocks), 100)
+        self.assertEqual(index.header, self.HEADER)
+        ranges = index.get_ranges(
+            [(datetime(2013, 9, 2), datetime(2013, 9, 3))])
+        self.assertEqual(len(ranges), 1)
+        [(start, end)] = ranges
+        self.assertEqual(start, index.blocks[2][0])
+        self.assertEqual(end, index.blocks[4][1])
+
+        output = self.query(lambda: FilterPipeline([TimestampFilter(
+            datetime(2013, 9, 2), datetime(2013, 9, 3))]))
+        self.assertEqual(output.count('\r\nnext line'), 24)
+
+    def test_unsorted(self):
+        self.write(self.make_rows(1000, shuffle=True))
+        index = TimestampIndex(
+            self.export_path, CSVMessageCodec, block_size=10).update()
+        self.assertFalse(index.sorted)
+        self.query(lambda: FilterPipeline([
+            WeekFilter(2013, [36]),
+            TimestampFilter(datetime(2013, 10, 1), datetime(2013, 10, 2)),
+        ]))
+
+    def test_json(self):
+        fp = open(self.export_path, 'wb')
+        for timestamp, content, direction in self.make_rows(100):
+            fp.write(json.dumps({'timestamp': timestamp,
+                                 'direction': direction}) + '\n')
+        fp.close()
+        index = TimestampIndex(
+            self.export_path, JSONMessageCodec, block_size=10).update()
+        self.assertEqual(
+            len(list(index.open(
+                [(datetime(2013, 9, 2), datetime(2013, 9, 3))]))), 30)
+
+    def test_invalid_timestamps(self):
+        rows = self.make_rows(100)
+        rows[55] = ('foo', 'bar', 'inbound')
+        self.write(rows)
+        index = TimestampIndex(
+            self.export_path, CSVMessageCodec, block_size=10).update()
+        self.assertFalse(index.sorted)
+        self.assertEqual(
+            index.get_ranges([(datetime(2013, 9, 1), datetime(2013, 9, 2))]),
+            [(index.blocks[0][0], index.blocks[2][1]),
+             (index.blocks[5][0], index.blocks[5][1])])
+
+    def test_update(self):
+        rows = self.make_rows(100)
+        self.write(rows[:50])
+        index = TimestampIndex(
+            self.export_path, CSVMessageCodec, block_size=10).update()
+        self.assertEqual(len(index.blocks), 5)
+
+        # Appended rows are picked up even before the index is updated.
+        self.write(rows[50:], mode='ab', header=False)
+        self.assertEqual(index.get_ranges([(datetime(2013, 9, 4), None)]),
+                         [(index.size, os.path.getsize(self.export_path))])
+        index = TimestampIndex(self.export_path, CSVMessageCodec).update()
+        self.assertEqual(len(index.blocks), 10)
+        self.assertEqual(index.block_size, 10)
+        self.assertEqual(index.size, os.path.getsize(self.export_path))
+
+        # A rewritten file is indexed from scratch.
+        self.write(self.make_rows(20, start=datetime(2014, 1, 1)))
+        index = TimestampIndex(self.export_path, CSVMessageCodec).update()
+        self.assertEqual(len(index.blocks), 2)
+        self.query(lambda: FilterPipeline([
+            TimestampFilter(datetime(2014, 1, 1, 5))]))
+
+    def test_partial_record(self):
+        self.write(self.make_rows(10))
+        size = os.path.getsize(self.export_path)
+        fp = open(self.export_path, 'ab')
+        fp.write('2013-09-05 00:00:00,"still being\r\nwritten')
+        fp.close()
+        index = TimestampIndex(self.export_path, CSVMessageCodec).update()
+        self.assertEqual(index.size, size)
+
+    def test_columnar(self):
+        self.write(self.make_rows(100))
+        output_path = os.path.join(self.path, 'export')
+        ConvertPipeline(output_path).process(
+            stdin=open(self.export_path, 'rb'), stdout=StringIO())
+        store = ColumnarStore(output_path)
+        store.restrict([(datetime(2013, 9, 2), datetime(2013, 9, 3)),
+                        (datetime(2013, 9, 4, 12), None)])
+        self.assertEqual(store.row_ranges, [(24, 48), (84, 100)])
+        rows = list(store.readrows())
+        self.assertEqual(len(rows), 40)
+        self.assertEqual(rows[0]['timestamp'], '2013-09-02 00:00:00')
+
+
+class AddressIndexTestCase(TestCase):
+
+    HEADER = 'timestamp,from_addr,to_addr,content\r\n'
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.export_path = os.path.join(self.path, 'export.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_rows(self, count, start=0):
+        return [('2013-09-01 00:00:00', '+2781%07d' % ((i * 37) % 50,),
+                 '+2782%07d' % (i % 7,), '"message %s\r\nnext line"' % (i,))
+                for i in range(start, start + count)]
+
+    def write(self, rows, mode='wb', header=True):
+        fp = open(self.export_path, mode)
+        if header:
+            fp.write(self.HEADER)
+        for row in rows:
+            fp.write('%s\r\n' % (','.join(row),))
+        fp.close()
+
+    def query(self, make_pipeline):
+        IndexPipeline(self.export_path, CSVMessageCodec,
+                      addresses=True).process()
+        pipeline = make_pipeline()
+        stdout = StringIO()
+        stdin = open_indexed(self.export_path, pipeline)
+        self.assertNotEqual(stdin, None)
+        pipeline.process(stdin=stdin, stdout=stdout)
+        pipeline = make_pipeline()
+        expected = StringIO()
+        pipeline.process(
+            stdin=open(self.export_path, 'rb'), stdout=expected)
+        self.assertEqual(stdout.getvalue(), expected.getvalue())
+        return stdout.getvalue()
+
+    def test_lookups(self):
+        self.write(self.make_rows(500))
+        output = self.query(lambda: FilterPipeline([
+            MSISDNFilter('from_addr', '+27810000003')]))
+        self.assertEqual(output.count('next line'), 10)
+        self.query(lambda: FilterPipeline([
+            MSISDNFilter('to_addr', '+27820000001'),
+            ContactFilter(['+27810000003', '+27810000004', '+2780']),
+        ]))
+        self.query(lambda: FilterPipeline([
+            ContactFilter(['+27 82 000 0001'], addr_type='to_addr')]))
+        self.query(lambda: FilterPipeline([
+            DirectionalFilter('inbound').chain(
+                MSISDNFilter('to_addr', '+27820000001'))]))
+
+    def test_lookups_required(self):
+        self.write(self.make_rows(10))
+        self.assertEqual(
+            FilterPipeline([MSISDNFilter('from_addr', '+1'),
+                            DirectionalFilter('inbound')])
+            .get_address_lookups(), None)
+        self.assertEqual(
+            ChainedPipeline([
+                FilterPipeline([DirectionalFilter('inbound')]),
+                FilterPipeline([MSISDNFilter('from_addr', '+1')]),
+            ]).get_address_lookups(), [('from_addr', [address_key('+1')])])
+        self.assertEqual(open_indexed(self.export_path, FilterPipeline([
+            MSISDNFilter('from_addr', '+1')])), None)
+
+    def test_update(self):
+        rows = self.make_rows(200)
+        self.write(rows[:100])
+        index = AddressIndex(self.export_path, CSVMessageCodec).update()
+        self.assertEqual(index.header, self.HEADER)
+
+        # Appended rows are read even before the index is updated.
+        self.write(rows[100:], mode='ab', header=False)
+        keys = [address_key('+27810000003')]
+        lookups = [('from_addr', keys)]
+        self.assertEqual(
+            len([line for line in index.open(lookups)
+                 if 'next line' in line]), 2 + 100)
+        index = AddressIndex(self.export_path, CSVMessageCodec).update()
+        self.assertEqual(index.size, os.path.getsize(self.export_path))
+        self.assertEqual(len(index.find_offsets('from_addr', keys)), 4)
+        self.query(lambda: FilterPipeline([
+            MSISDNFilter('from_addr', '+27810000003')]))
+
+        # A rewritten file is indexed from scratch.
+        self.write(self.make_rows(20, start=1020))
+        index = AddressIndex(self.export_path, CSVMessageCodec).update()
+        self.assertEqual(len(index.find_offsets('from_addr', keys)), 0)
+
+    def test_json(self):
+        fp = open(self.export_path, 'wb')
+        for timestamp, from_addr, to_addr, content in self.make_rows(100):
+            fp.write(json.dumps({'timestamp': timestamp,
+                                 'from_addr': from_addr,
+                                 'to_addr': to_addr}) + '\n')
+        fp.close()
+        index = AddressIndex(self.export_path, JSONMessageCodec).update()
+        lookups = [('to_addr', [address_key(u'+27820000001')])]
+        self.assertEqual(len(list(index.open(lookups))), 15)
@@ -0,0 +1,139 @@
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from gdt import inputs
+from gdt.codec import CSVMessageCodec, JSONMessageCodec
+from gdt.inputs import (InputReader, InputException, Decompressor,
+                        expand_paths, is_compressed, read_inputs,
+                        split_header)
+
+
+class InputsTestCase(TestCase):
+
+    EXPORT = os.path.join(os.path.dirname(__file__),
+                          'messages-export-good.csv')
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.data = open(self.EXPORT, 'rb').read()
+        # Small buffers so records span several of them.
+        self.buffer_size = inputs.BUFFER_SIZE
+        inputs.BUFFER_SIZE = 100
+
+    def tearDown(self):
+        inputs.BUFFER_SIZE = self.buffer_size
+        shutil.rmtree(self.path)
+
+    def write(self, name, data, compression=None):
+        path = os.path.join(self.path, name)
+        if compression == 'gzip':
+            fp = gzip.open(path, 'wb')
+        elif compression == 'bz2':
+            fp = bz2.BZ2File(path, 'wb')
+        else:
+            fp = open(path, 'wb')
+        fp.write(data)
+        fp.close()
+        return path
+
+    def read(self, path):
+        return ''.join(InputReader.open(path))
+
+    def test_uncompressed(self):
+        path = self.write('export.csv', self.data)
+        self.assertFalse(is_compressed(path))
+        self.assertEqual(self.read(path), self.data)
+        self.assertEqual(list(InputReader.open(path)),
+                         StringIO(self.data).readlines())
+
+    def test_gzip(self):
+        path = self.write('export.csv.gz', self.data, 'gzip')
+        self.assertTrue(is_compressed(path))
+        self.assertEqual(self.read(path), self.data)
+
+    def test_bz2(self):
+        path = self.write('export.csv.bz2', self.data, 'bz2')
+        self.assertTrue(is_compressed(path))
+        self.assertEqual(self.read(path), self.data)
+
+    def test_concatenated_streams(self):
+        for compression in ['gzip', 'bz2']:
+            first = open(self.write('a', self.data[:500], compression),
+                         'rb').read()
+            second = open(self.write('b', self.data[500:], compression),
+                          'rb').read()
+            path = self.write('export', first + second)
+            self.assertEqual(self.read(path), self.data)
+
+    def test_xz_without_lzma(self):
+        lzma, inputs.lzma = inputs.lzma, None
+        try:
+            self.assertRaises(InputException, Decompressor, 'xz')
+        finally:
+            inputs.lzma = lzma
+
+    def test_errors(self):
+        path = self.write('export.csv.gz', '\x1f\x8b' + self.data)
+        self.assertRaises(Exception, self.read, path)
+
+    def test_readline(self):
+        path = self.write('export.csv.gz', self.data, 'gzip')
+        reader = InputReader.open(path)
+        self.assertEqual(reader.readline(), self.data.split('\n')[0] + '\n')
+        self.assertEqual(''.join(iter(reader.readline, '')),
+                         self.data.split('\n', 1)[1])
+        reader.close()
+
+    def test_peek(self):
+        path = self.write('export.csv.gz', self.data, 'gzip')
+        for size in [5, len(self.data) + 1]:
+            reader = InputReader.open(path)
+            self.assertEqual(reader.peek(size), self.data[:size])
+            self.assertEqual(reader.read(5), self.data[:5])
+            self.assertEqual(list(reader),
+                             StringIO(self.data[5:]).readlines())
+
+    def test_codec(self):
+        path = self.write('export.csv.gz', self.data, 'gzip')
+        codec = CSVMessageCodec(InputReader.open(path), StringIO(),
+                                write_header=False)
+        self.assertEqual(
+            list(codec.readrows()),
+            list(CSVMessageCodec(StringIO(self.data), StringIO(),
+                                 write_header=False).readrows()))
+
+    def test_split_header(self):
+        header, lines = split_header(['"a\n', 'b",c\n', '1,2\n'])
+        self.assertEqual(header, ['"a\n', 'b",c\n'])
+        self.assertEqual(list(lines), ['1,2\n'])
+
+    def test_expand_paths(self):
+        paths = [self.write('export-%s.csv' % (index,), self.data)
+                 for index in [2, 1, 3]]
+        self.assertEqual(expand_paths(paths[0]), paths[:1])
+        self.assertEqual(expand_paths(os.path.join(self.path, '*.csv')),
+                         sorted(paths))
+        self.assertRaises(InputException, expand_paths,
+                          os.path.join(self.path, '*.json'))
+
+    def test_read_inputs(self):
+        header, rest = self.data.split('\n', 1)
+        paths = [self.write('a.csv.gz', self.data, 'gzip'),
+                 self.write('b.csv', self.data),
+                 self.write('c.csv.bz2', self.data, 'bz2')]
+        self.assertEqual(''.join(read_inputs(paths, CSVMessageCodec)),
+                         header + '\n' + rest * 3)
+        # JSON has no header to skip.
+        self.assertEqual(''.join(read_inputs(paths, JSONMessageCodec)),
+                         self.data * 3)
+
+    def test_read_inputs_mismatched(self):
+        paths = [self.write('a.csv', self.data),
+                 self.write('b.csv', 'foo,bar\n1,2\n')]
+        self.assertRaises(InputException, list,
+                          read_inputs(paths, CSVMessageCodec))
@@ -0,0 +1,101 @@
+import os
+import json
+import tempfile
+from datetime import datetime
+from StringIO import StringIO
+from unittest import TestCase
+
+from gdt.codec import CSVMessageCodec, JSONMessageCodec
+from gdt.filters import (FilterPipeline, DirectionalFilter, RegexFilter,
+                         TimestampFilter)
+from gdt.extractors import ExtractorPipeline, FieldExtractor
+from gdt.parallel import (ParallelPipeline, ParallelException,
+                          find_record_boundaries)
+
+
+class FindRecordBoundariesTestCase(TestCase):
+
+    def test_boundaries(self):
+        data = StringIO('a,b\r\n1,2\r\n3,4\r\n')
+        self.assertEqual(
+            find_record_boundaries(data, 0, [1, 6, 10, 11]), [5, 10, 15])
+
+    def test_quoted_newlines(self):
+        data = StringIO('a,b\n1,"x\ny"\n3,"""\n"""\n5,6\n')
+        self.assertEqual(
+            find_record_boundaries(data, 0, [1, 5, 13]), [4, 12, 22])
+
+    def test_unquoted_newlines(self):
+        data = StringIO('{"a": "\\""}\n{"a": "\\""}\n')
+        self.assertEqual(
+            find_record_boundaries(data, 0, [1], quoted_newlines=False),
+            [12])
+
+    def test_start(self):
+        data = StringIO('a,b\n1,"x\ny"\n3,4\n')
+        self.assertEqual(find_record_boundaries(data, 4, [2, 5]), [4, 12])
+
+
+class ParallelPipelineTestCase(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def write_csv(self, count):
+        fp = open(self.path, 'wb')
+        fp.write('timestamp,content,direction\r\n')
+        for i in range(count):
+            fp.write('2013-09-%02d 10:00:00,"line %s\r\nwith ""quotes""",%s'
+                     '\r\n' % (i % 28 + 1, i,
+                               ['inbound', 'outbound'][i % 3 == 0]))
+        fp.close()
+
+    def write_json(self, count):
+        fp = open(self.path, 'wb')
+        for i in range(count):
+            fp.write(json.dumps({
+                'timestamp': '2013-09-%02d 10:00:00' % (i % 28 + 1,),
+                'content': 'line %s\nwith "quotes"' % (i,),
+                'direction': ['inbound', 'outbound'][i % 3 == 0],
+            }) + '\n')
+        fp.close()
+
+    def assertParallelOutput(self, pipeline, chunk_size):
+        stdout = StringIO()
+        pipeline.process(stdin=open(self.path, 'rb'), stdout=stdout)
+        parallel_stdout = StringIO()
+        ParallelPipeline(pipeline, 3, chunk_size=chunk_size).process(
+            self.path, stdout=parallel_stdout)
+        self.assertTrue(stdout.getvalue())
+        self.assertEqual(parallel_stdout.getvalue(), stdout.getvalue())
+
+    def test_csv(self):
+        self.write_csv(100)
+        pipeline = FilterPipeline([
+            DirectionalFilter('inbound'),
+            RegexFilter('content', r'line \d*5', False),
+        ], codec_class=CSVMessageCodec)
+        for chunk_size in [1, 7, 100, 1024 * 1024]:
+            self.assertParallelOutput(pipeline, chunk_size)
+
+    def test_json(self):
+        self.write_json(100)
+        pipeline = FilterPipeline([
+            TimestampFilter(datetime(2013, 9, 10), datetime(2013, 9, 20)),
+        ], codec_class=JSONMessageCodec)
+        for chunk_size in [1, 7, 100, 1024 * 1024]:
+            self.assertParallelOutput(pipeline, chunk_size)
+
+    def test_header_only(self):
+        self.write_csv(0)
+        pipeline = FilterPipeline([DirectionalFilter('inbound')])
+        self.assertParallelOutput(pipeline, 1)
+
+    def test_filters_only(self):
+        self.assertRaises(
+            ParallelException, ParallelPipeline,
+            ExtractorPipeline([FieldExtractor(['content'])]), 2)
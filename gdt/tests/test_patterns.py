@@ -0,0 +1,120 @@
+import os
+import re
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from gdt.codec import JSONMessageCodec
+from gdt.filters import FilterPipeline, RegexFilter, FilterException
+from gdt.extractors import ExtractorPipeline, FieldExtractor
+from gdt.patterns import (LiteralMatcher, PatternSet, PatternException,
+                          get_required_literal)
+from gdt.pipeline import ChainedPipeline
+
+
+class PatternsTestCase(TestCase):
+
+    PATTERNS = [r'^we think', r'.*\bstop\b', r'(?i).*hello (world|there)',
+                r'\d+', r'.*cat(egory)?', r'.*category', r'.*a|b',
+                r'.*\xc3\xa9t\xc3\xa9']
+
+    TEXTS = ['we think so', 'We think so', 'please STOP', 'please stop now',
+             'HELLO there', 'say hello world', '1234 abc', 'a category',
+             'concatenate', 'b', '', 'summer \xc3\xa9t\xc3\xa9', 'x' * 50]
+
+    def test_get_required_literal(self):
+        self.assertEqual(get_required_literal('^we think'), 'we think')
+        self.assertEqual(get_required_literal('ab*cdef?'), 'cde')
+        self.assertEqual(get_required_literal('(?i)Hello (World|x)'),
+                         'hello ')
+        self.assertEqual(get_required_literal('foo|bar'), '')
+        self.assertEqual(get_required_literal('x(abc)y'), 'abc')
+        self.assertEqual(get_required_literal('Abc', re.IGNORECASE), 'abc')
+
+    def test_literal_matcher(self):
+        matcher = LiteralMatcher(['he', 'she', 'his', 'hers'])
+        self.assertEqual(matcher.find('ushers'), set(['he', 'she', 'hers']))
+        self.assertEqual(matcher.find('this'), set(['his']))
+        self.assertEqual(matcher.find('xyz'), set())
+
+    def test_pattern_set(self):
+        for ignore_case in [False, True]:
+            flags = re.IGNORECASE if ignore_case else 0
+            patterns = PatternSet(self.PATTERNS, ignore_case)
+            for text in self.TEXTS + [text.decode('utf-8')
+                                      for text in self.TEXTS]:
+                expected = None
+                for pattern in self.PATTERNS:
+                    if re.match(pattern, text, flags):
+                        expected = pattern
+                        break
+                self.assertEqual(patterns.match(text), expected)
+
+        self.assertRaises(PatternException, PatternSet, [])
+        self.assertRaises(PatternException, PatternSet, ['('])
+
+
+class RegexFilterTestCase(TestCase):
+
+    CSV = ('timestamp,content\r\n'
+           '2013-09-01 00:00:00,hello world\r\n'
+           '2013-09-01 00:00:00,"stop\r\nnow"\r\n'
+           '2013-09-01 00:00:00,nothing\r\n')
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.patterns_path = os.path.join(self.path, 'patterns.txt')
+        fp = open(self.patterns_path, 'wb')
+        fp.write('stop\r\n\r\nhello\r\n')
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_match_field(self):
+        stdout = StringIO()
+        FilterPipeline([RegexFilter(
+            'content', 'HELLO', True, self.patterns_path, 'keyword')]
+        ).process(stdin=StringIO(self.CSV), stdout=stdout)
+        self.assertEqual(stdout.getvalue(), (
+            'timestamp,content,keyword\r\n'
+            '2013-09-01 00:00:00,hello world,HELLO\r\n'
+            '2013-09-01 00:00:00,"stop\r\nnow",stop\r\n'))
+
+        stdout = StringIO()
+        FilterPipeline([RegexFilter(
+            'content', patterns_path=self.patterns_path, match_field='k')],
+            codec_class=JSONMessageCodec,
+        ).process(stdin=StringIO('{"content": "hello"}\n{"content": "x"}\n'),
+                  stdout=stdout)
+        self.assertEqual(stdout.getvalue(),
+                         '{"content": "hello", "k": "hello"}\n')
+
+    def test_chained(self):
+        stdout = StringIO()
+        ChainedPipeline([
+            FilterPipeline([RegexFilter(
+                'content', patterns_path=self.patterns_path,
+                match_field='keyword')]),
+            ExtractorPipeline([FieldExtractor(['keyword'], '%Y')]),
+        ]).process(stdin=StringIO(self.CSV), stdout=stdout)
+        self.assertEqual(stdout.getvalue(),
+                         'timestamp,keyword\r\n2013,hello\r\n2013,stop\r\n')
+
+    def test_single_pattern_file(self):
+        path = os.path.join(self.path, 'single.txt')
+        fp = open(path, 'wb')
+        fp.write('hello\n')
+        fp.close()
+        stdout = StringIO()
+        FilterPipeline([RegexFilter('content', patterns_path=path)]).process(
+            stdin=StringIO(self.CSV), stdout=stdout)
+        self.assertEqual(stdout.getvalue(), (
+            'timestamp,content\r\n'
+            '2013-09-01 00:00:00,hello world\r\n'))
+
+    def test_no_patterns(self):
+        self.assertRaises(FilterException, RegexFilter, 'content')
+        self.assertRaises(FilterException, RegexFilter, 'content', '(', False,
+                          self.patterns_path)
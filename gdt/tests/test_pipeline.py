@@ -0,0 +1,123 @@
+from StringIO import StringIO
+from unittest import TestCase
+
+from gdt.cmdline import build_pipeline, get_parser
+from gdt.codec import CSVMessageCodec
+from gdt.filters import FilterPipeline, DirectionalFilter, MSISDNFilter
+from gdt.extractors import ExtractorPipeline, FieldExtractor
+from gdt.aggregators import AggregatorPipeline, SimpleAggregator
+from gdt.pipeline import ChainedPipeline, PipelineException
+
+
+class ChainedPipelineTestCase(TestCase):
+
+    HEADER = ("timestamp,from_addr,to_addr,content,message_id,in_reply_to,"
+              "session_event,transport_type,direction,"
+              "network_handover_status,network_handover_reason,"
+              "delivery_status,endpoint\r\n")
+    INBOUND = ("2013-09-10 19:24:03.289543,+27817030792,*120*8864*1203#,"
+               ",af266289e40949388b5a8cacb4a2d13a,,new,ussd,inbound"
+               ",,,,default\r\n")
+    INBOUND_OTHER = ("2013-09-10 20:24:03.289543,+27817030793,"
+                     "*120*8864*1203#,,af266289e40949388b5a8cacb4a2d13c,,"
+                     "new,ussd,inbound,,,,default\r\n")
+    OUTBOUND = ("2013-09-11 19:24:03.289543,+27817030792,27123456789,"
+                ",af266289e40949388b5a8cacb4a2d13b,,resume,ussd,outbound"
+                ",,,,default\r\n")
+    SAMPLE = HEADER + INBOUND + INBOUND_OTHER + OUTBOUND
+
+    def process(self, pipeline):
+        stdout = StringIO()
+        pipeline.process(stdin=StringIO(self.SAMPLE), stdout=stdout)
+        return stdout.getvalue()
+
+    def test_filter_stages(self):
+        direction = FilterPipeline([DirectionalFilter('inbound')])
+        msisdn = FilterPipeline([MSISDNFilter('from_addr', '+27817030792')])
+        pipeline = ChainedPipeline([direction, msisdn],
+                                   codec_class=CSVMessageCodec)
+        self.assertEqual(self.process(pipeline), self.HEADER + self.INBOUND)
+        # The two stages are run as one chain that can be reordered.
+        [stage] = pipeline.stages
+        [chain] = stage.filters
+        self.assertEqual([filter_.__class__ for filter_ in chain.get_chain()],
+                         [DirectionalFilter, MSISDNFilter])
+        self.assertEqual(direction.filters[0].get_chain(),
+                         direction.filters)
+
+    def test_extract_stage(self):
+        pipeline = ChainedPipeline([
+            FilterPipeline([DirectionalFilter('inbound')]),
+            ExtractorPipeline([FieldExtractor(['from_addr'], '%Y-%m-%d')]),
+        ])
+        self.assertEqual(
+            self.process(pipeline),
+            'timestamp,from_addr\r\n'
+            '2013-09-10,+27817030792\r\n'
+            '2013-09-10,+27817030793\r\n')
+
+    def test_aggregate_stage(self):
+        pipeline = ChainedPipeline([
+            ExtractorPipeline([FieldExtractor(['from_addr'], '%Y-%m-%d')]),
+            AggregatorPipeline(SimpleAggregator(['from_addr'])),
+        ])
+        self.assertEqual(
+            self.process(pipeline),
+            'timestamp,from_addr\r\n'
+            '2013-09-10,2\r\n'
+            '2013-09-11,1\r\n')
+
+    def test_required_fields(self):
+        pipeline = ChainedPipeline([
+            FilterPipeline([DirectionalFilter('inbound')]),
+            ExtractorPipeline([FieldExtractor(['from_addr'], '%Y-%m-%d')]),
+            AggregatorPipeline(SimpleAggregator(['from_addr'])),
+        ])
+        self.assertEqual(pipeline.get_required_fields(),
+                         ['direction', 'timestamp', 'from_addr'])
+        # Filters write rows out whole.
+        pipeline = ChainedPipeline([
+            FilterPipeline([DirectionalFilter('inbound')])])
+        self.assertEqual(pipeline.get_required_fields(), None)
+
+    def test_empty(self):
+        self.assertRaises(PipelineException, self.process, ChainedPipeline())
+
+    def test_run_subcommand(self):
+        args = vars(get_parser().parse_args([
+            'run',
+            'direction -d inbound',
+            'extract -f from_addr -df %Y-%m-%d',
+            'count -f from_addr']))
+        pipeline = build_pipeline(args, args.pop('codec_class'))
+        self.assertEqual(len(pipeline.stages), 3)
+        self.assertEqual(
+            self.process(pipeline),
+            'timestamp,from_addr\r\n'
+            '2013-09-10,2\r\n')
+
+    def test_run_subcommand_nested(self):
+        args = vars(get_parser().parse_args(['run', 'run "count -f to_addr"']))
+        self.assertRaises(
+            PipelineException, build_pipeline, args, args.pop('codec_class'))
+
+    def test_run_filter_stages(self):
+        def process(*stages):
+            args = vars(get_parser().parse_args(['run'] + list(stages)))
+            pipeline = build_pipeline(args, args.pop('codec_class'))
+            stdout = StringIO()
+            pipeline.process(stdin=StringIO(self.SAMPLE + malformed),
+                             stdout=stdout)
+            return stdout.getvalue()
+
+        malformed = self.OUTBOUND.replace('2013-09-11 19:24:03.289543',
+                                          'garbage')
+        # The direction filter rejects the malformed row before the date
+        # range filter parses it, however the filters get ordered.
+        self.assertEqual(
+            process('direction -d inbound',
+                    "daterange -s '2013-09-10 20:00:00'"),
+            self.HEADER + self.INBOUND_OTHER)
+        self.assertRaises(
+            Exception, process, "daterange -s '2013-09-10 20:00:00'",
+            'direction -d inbound')
@@ -0,0 +1,152 @@
+import os
+from StringIO import StringIO
+from unittest import TestCase
+
+from gdt.aggregators import AggregatorPipeline
+from gdt.codec import CSVMessageCodec
+from gdt.sessions import SessionAggregator, SessionException
+
+
+def message(timestamp, msisdn, session_event=None, direction='inbound'):
+    inbound = direction == 'inbound'
+    return {
+        'timestamp': timestamp,
+        'from_addr': msisdn if inbound else '*120#',
+        'to_addr': '*120#' if inbound else msisdn,
+        'session_event': session_event,
+        'direction': direction,
+    }
+
+
+class SessionAggregatorTestCase(TestCase):
+
+    def aggregate(self, rows, **kwargs):
+        aggregator = SessionAggregator(**kwargs)
+        for row in rows:
+            aggregator.aggregate(row)
+        return aggregator
+
+    def test_sessions(self):
+        path = os.path.join(os.path.dirname(__file__),
+                            'messages-export-good.csv')
+        with open(path, 'rb') as fp:
+            rows = sorted(CSVMessageCodec(fp, StringIO()).readrows(),
+                          key=lambda row: row['timestamp'])
+        # Three sessions closed after 111, 37 & 28 seconds.
+        self.assertEqual(list(self.aggregate(rows).get_data()), [{
+            'timestamp': '2013-09-09',
+            'sessions': 3,
+            'closed_sessions': 3,
+            'mean_duration': 58.696,
+            'visitors': 1,
+            'new_visitors': 1,
+            'returning_visitors': 0,
+        }])
+
+    def test_timeout(self):
+        aggregator = self.aggregate([
+            message('2013-09-01 10:00:00', '1', 'new'),
+            message('2013-09-01 10:00:01', '1', direction='outbound'),
+            message('2013-09-01 10:00:10', '1', 'resume'),
+            message('2013-09-01 10:00:20', '2', 'new'),
+            # Both have timed out by now, 1 without a `new`.
+            message('2013-09-01 10:02:00', '1', 'resume'),
+            message('2013-09-01 10:02:30', '1', 'close'),
+        ], timeout=60)
+        self.assertEqual(aggregator.active, {})
+        self.assertEqual(list(aggregator.get_data()), [{
+            'timestamp': '2013-09-01',
+            'sessions': 3,
+            'closed_sessions': 1,
+            'mean_duration': 13.333,
+            'visitors': 2,
+            'new_visitors': 2,
+            'returning_visitors': 0,
+        }])
+
+    def test_new_ends_session(self):
+        aggregator = self.aggregate([
+            message('2013-09-01 10:00:00', '1', 'new'),
+            message('2013-09-01 10:00:05', '1', 'resume'),
+            message('2013-09-01 10:00:10', '1', 'new'),
+        ])
+        [data] = aggregator.get_data()
+        self.assertEqual(data['sessions'], 2)
+        self.assertEqual(data['closed_sessions'], 0)
+        self.assertEqual(data['mean_duration'], 2.5)
+
+    def test_idle_sessions_evicted(self):
+        aggregator = SessionAggregator(timeout=60)
+        for i in range(10000):
+            aggregator.aggregate(message(
+                '2013-09-01 %02d:%02d:%02d' % (i // 3600, i // 60 % 60,
+                                               i % 60), str(i), 'new'))
+            self.assertTrue(len(aggregator.active) <= 61)
+            self.assertTrue(len(aggregator.idle) <= 61)
+        [data] = aggregator.get_data()
+        self.assertEqual(data['sessions'], 10000)
+
+    def test_returning_visitors(self):
+        rows = [
+            message('2013-09-01 10:00:00', '1', 'new'),
+            message('2013-09-01 11:00:00', '1', 'new'),
+            message('2013-09-01 12:00:00', '2', 'new'),
+            message('2013-09-02 10:00:00', '1', 'new'),
+            message('2013-09-02 11:00:00', '3', 'new'),
+            message('2013-09-03 10:00:00', '1', 'new'),
+            message('2013-09-03 11:00:00', '2', 'new'),
+        ]
+        self.assertEqual([
+            (data['timestamp'], data['sessions'], data['visitors'],
+             data['new_visitors'], data['returning_visitors'])
+            for data in self.aggregate(rows).get_data()], [
+            ('2013-09-01', 3, 2, 2, 0),
+            ('2013-09-02', 2, 2, 1, 1),
+            ('2013-09-03', 2, 2, 0, 2),
+        ])
+        self.assertEqual(
+            list(self.aggregate(rows, cohorts=True).get_data()), [
+                {'cohort': '2013-09-01', 'timestamp': '2013-09-01',
+                 'visitors': 2},
+                {'cohort': '2013-09-01', 'timestamp': '2013-09-02',
+                 'visitors': 1},
+                {'cohort': '2013-09-01', 'timestamp': '2013-09-03',
+                 'visitors': 2},
+                {'cohort': '2013-09-02', 'timestamp': '2013-09-02',
+                 'visitors': 1},
+            ])
+
+    def test_approximate(self):
+        rows = [message('2013-09-%02d 10:00:00' % (day,), str(msisdn), 'new')
+                for day in range(1, 4)
+                for msisdn in range(day * 500, day * 500 + 1000)]
+        exact = list(self.aggregate(rows).get_data())
+        approximate = list(self.aggregate(rows, error_rate=0.001,
+                                          capacity=5000).get_data())
+        self.assertEqual([data['new_visitors'] for data in exact],
+                         [1000, 500, 500])
+        for expected, result in zip(exact, approximate):
+            self.assertEqual(expected['sessions'], result['sessions'])
+            self.assertTrue(
+                abs(expected['new_visitors'] - result['new_visitors']) <= 5)
+            self.assertTrue(abs(expected['visitors'] - result['visitors']) <=
+                            50)
+
+    def test_invalid(self):
+        self.assertRaises(SessionException, SessionAggregator, timeout=0)
+        self.assertRaises(SessionException, SessionAggregator, cohorts=True,
+                          error_rate=0.01)
+
+    def test_pipeline(self):
+        stdin = StringIO(
+            'timestamp,from_addr,to_addr,session_event,direction\n'
+            '2013-09-01 10:00:00,1,*120#,new,inbound\n'
+            '2013-09-01 10:00:01,*120#,1,None,outbound\n'
+            '2013-09-01 10:00:09,1,*120#,close,inbound\n')
+        stdout = StringIO()
+        AggregatorPipeline(SessionAggregator()).process(stdin, stdout)
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            'timestamp,sessions,closed_sessions,mean_duration,visitors,'
+            'new_visitors,returning_visitors',
+            '2013-09-01,1,1,9.0,1,1,0',
+        ])
@@ -0,0 +1,106 @@
+import random
+from unittest import TestCase
+
+from gdt.sketches import (HyperLogLog, SpaceSaving, SketchException,
+                          hash_value, DEFAULT_PRECISION)
+
+
+class HyperLogLogTestCase(TestCase):
+
+    def assertClose(self, sketch, count):
+        # Well within 4 standard errors.
+        self.assertTrue(
+            abs(sketch.count() - count) <= 4 * sketch.error * count,
+            '%s is too far from %s' % (sketch.count(), count))
+
+    def test_count(self):
+        sketch = HyperLogLog()
+        self.assertEqual(len(sketch), 0)
+        for i in range(20):
+            sketch.add('+2782%07d' % (i,))
+            sketch.add(u'+2782%07d' % (i,))
+        self.assertEqual(len(sketch), 20)
+
+        for precision in [4, 10, DEFAULT_PRECISION]:
+            sketch = HyperLogLog(precision)
+            for i in range(50000):
+                sketch.add('+2782%07d' % (i % 25000,))
+            self.assertEqual(len(sketch.registers), 2 ** precision)
+            self.assertClose(sketch, 25000)
+
+    def test_merge(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(10000):
+            first.add(i)
+            second.add(i + 5000)
+        merged = first.copy().merge(second)
+        self.assertClose(merged, 15000)
+        self.assertClose(first, 10000)
+        self.assertRaises(SketchException, first.merge, HyperLogLog(10))
+
+    def test_precision(self):
+        self.assertRaises(SketchException, HyperLogLog, 3)
+        self.assertRaises(SketchException, HyperLogLog, 17)
+
+    def test_hash_value(self):
+        self.assertEqual(hash_value(u'\xe9'), hash_value('\xc3\xa9'))
+        self.assertNotEqual(hash_value(None), hash_value('None'))
+
+
+class SpaceSavingTestCase(TestCase):
+
+    def zipf(self, count, offset=0):
+        # Value `i` appears about `1 / i` as often as the most frequent one.
+        values = []
+        for i in range(1, 2000):
+            values.extend([str(i + offset)] * (count // i))
+        return values
+
+    def assertBounded(self, summary, values):
+        counts = {}
+        for value in values:
+            counts[value] = counts.get(value, 0) + 1
+        bound = len(values) / float(summary.capacity)
+        for value, count, error in summary.top(summary.capacity):
+            self.assertTrue(count - error <= counts[value] <= count)
+            self.assertTrue(error <= bound)
+        # Every value more frequent than the bound is kept.
+        for value, count in counts.items():
+            if count > bound:
+                self.assertTrue(value in summary.counters)
+
+    def test_top(self):
+        summary = SpaceSaving(10)
+        for value in ['a', 'b', 'a', 'c', 'a', 'b']:
+            summary.add(value)
+        self.assertEqual(summary.top(2), [('a', 3, 0), ('b', 2, 0)])
+        summary.add('c', 5)
+        self.assertEqual(summary.top(1), [('c', 6, 0)])
+        self.assertEqual(summary.total, 11)
+
+        values = self.zipf(1000)
+        random.Random(0).shuffle(values)
+        summary = SpaceSaving(50)
+        for value in values:
+            summary.add(value)
+        self.assertEqual(len(summary), 50)
+        self.assertEqual(
+            [value for value, _, _ in summary.top(5)],
+            ['1', '2', '3', '4', '5'])
+        self.assertBounded(summary, values)
+
+    def test_merge(self):
+        first, second = SpaceSaving(50), SpaceSaving(50)
+        values = self.zipf(1000), self.zipf(500, offset=3)
+        for summary, summary_values in zip([first, second], values):
+            random.Random(1).shuffle(summary_values)
+            for value in summary_values:
+                summary.add(value)
+        merged = first.copy().merge(second)
+        self.assertEqual(len(merged), 50)
+        self.assertEqual(merged.total, first.total + second.total)
+        self.assertEqual(
+            [value for value, _, _ in merged.top(3)], ['1', '4', '2'])
+        self.assertBounded(merged, values[0] + values[1])
+        self.assertRaises(SketchException, first.merge, SpaceSaving(10))
+        self.assertRaises(SketchException, SpaceSaving, 0)
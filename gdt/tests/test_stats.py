@@ -0,0 +1,85 @@
+import json
+import os
+from StringIO import StringIO
+from unittest import TestCase
+
+from gdt.aggregators import AggregatorPipeline, SimpleAggregator
+from gdt.binary import BinaryWriter
+from gdt.extractors import ExtractorPipeline, FieldExtractor
+from gdt.filters import (FilterPipeline, DirectionalFilter,
+                         SessionEventFilter)
+from gdt.pipeline import ChainedPipeline
+from gdt.stats import Stats
+
+
+class StatsTestCase(TestCase):
+
+    EXPORT = os.path.join(os.path.dirname(__file__),
+                          'messages-export-good.csv')
+
+    def process(self, pipeline):
+        stats = Stats()
+        stats.instrument(pipeline)
+        stdout = StringIO()
+        pipeline.process(stdin=open(self.EXPORT, 'rb'), stdout=stdout)
+        return stdout.getvalue(), stats.to_dict()
+
+    def test_filter(self):
+        expected = StringIO()
+        FilterPipeline([DirectionalFilter('inbound')]).process(
+            stdin=open(self.EXPORT, 'rb'), stdout=expected)
+        output, stats = self.process(FilterPipeline([
+            DirectionalFilter('inbound').chain(SessionEventFilter('new'))]))
+        self.assertEqual(stats['rows_read'], 19)
+        self.assertEqual(stats['rows_written'], 3)
+        self.assertEqual(len(output.splitlines()), 4)
+        [stage] = stats['stages']
+        self.assertEqual(stage['name'], 'FilterPipeline')
+        self.assertEqual((stage['rows_in'], stage['rows_out']), (19, 3))
+        self.assertEqual(
+            [(filter_['name'], filter_['rows_in'], filter_['rows_out'])
+             for filter_ in stage['filters']],
+            [('DirectionalFilter', 19, 11), ('SessionEventFilter', 11, 3)])
+        self.assertEqual(stage['filters'][0]['selectivity'], 11 / 19.0)
+        self.assertTrue(stats['seconds'] >= stats['codec']['read_seconds'])
+        self.assertTrue(stats['peak_rss_mb'] > 0)
+
+    def test_chain(self):
+        pipeline = ChainedPipeline([
+            FilterPipeline([DirectionalFilter('inbound')]),
+            ExtractorPipeline([FieldExtractor(['to_addr'], '%Y')]),
+            AggregatorPipeline(SimpleAggregator(['to_addr'])),
+        ])
+        output, stats = self.process(pipeline)
+        self.assertEqual(output, 'timestamp,to_addr\r\n2013,11\r\n')
+        self.assertEqual(stats['rows_read'], 19)
+        self.assertEqual(stats['rows_written'], 1)
+        self.assertEqual(
+            [(stage['name'], stage['rows_in'], stage['rows_out'])
+             for stage in stats['stages']],
+            [('FilterPipeline', 19, 11), ('ExtractorPipeline', 11, 11),
+             ('AggregatorPipeline', 11, 1)])
+
+    def test_writer_class(self):
+        pipeline = FilterPipeline([DirectionalFilter('outbound')])
+        pipeline.writer_class = BinaryWriter
+        output, stats = self.process(pipeline)
+        self.assertTrue(output.startswith('\x00gdt'))
+        self.assertEqual(stats['rows_written'], 8)
+
+    def test_partial(self):
+        pipeline = AggregatorPipeline(SimpleAggregator(['to_addr']),
+                                      partial=True)
+        _, stats = self.process(pipeline)
+        self.assertEqual(stats['rows_read'], 19)
+        self.assertEqual(stats['rows_written'], None)
+
+    def test_report(self):
+        stats = Stats()
+        stats.instrument(FilterPipeline([DirectionalFilter('inbound')]))
+        report = StringIO()
+        stats.write_report(report)
+        self.assertTrue('DirectionalFilter' not in report.getvalue())
+        dump = StringIO()
+        stats.write_json(dump)
+        self.assertEqual(json.loads(dump.getvalue())['rows_read'], 0)
@@ -0,0 +1,88 @@
+import os
+from StringIO import StringIO
+from unittest import TestCase
+
+from gdt.aggregators import AggregatorPipeline, SimpleAggregator
+from gdt.extractors import ExtractorPipeline, FieldExtractor
+from gdt.filters import FilterPipeline, DirectionalFilter
+from gdt.pipeline import ChainedPipeline
+from gdt.threads import ThreadedWriter, read_ahead
+
+
+class ListWriter(object):
+
+    def __init__(self, fail_at=None):
+        self.rows = []
+        self.flushed = False
+        self.fail_at = fail_at
+
+    def writerow(self, row):
+        if row == self.fail_at:
+            raise ValueError(row)
+        self.rows.append(row)
+
+    def flush(self):
+        self.flushed = True
+
+
+class ThreadsTestCase(TestCase):
+
+    EXPORT = os.path.join(os.path.dirname(__file__),
+                          'messages-export-good.csv')
+
+    def test_read_ahead(self):
+        self.assertEqual(list(read_ahead(iter(range(100)), batch_size=7,
+                                         queue_size=2)), range(100))
+        self.assertEqual(list(read_ahead([])), [])
+
+    def test_read_ahead_error(self):
+        def rows():
+            yield 1
+            raise ValueError('bad row')
+        self.assertRaises(ValueError, list, read_ahead(rows(), batch_size=1))
+
+    def test_read_ahead_stopped(self):
+        rows = read_ahead(iter(range(10000)), batch_size=1, queue_size=1)
+        self.assertEqual(next(rows), 0)
+        # Closing it early unblocks & stops the thread.
+        rows.close()
+
+    def test_writer(self):
+        output = ListWriter()
+        writer = ThreadedWriter(output, batch_size=3, queue_size=1)
+        for row in range(100):
+            writer.writerow(row)
+        writer.flush()
+        self.assertEqual(output.rows, range(100))
+        self.assertTrue(output.flushed)
+
+    def test_writer_error(self):
+        writer = ThreadedWriter(ListWriter(fail_at=5), batch_size=2,
+                                queue_size=1)
+
+        def write():
+            for row in range(100):
+                writer.writerow(row)
+            writer.flush()
+        self.assertRaises(ValueError, write)
+
+    def process(self, pipeline, threaded):
+        for stage in [pipeline] + getattr(pipeline, 'stages', []):
+            stage.threaded = threaded
+        stdout = StringIO()
+        pipeline.process(stdin=open(self.EXPORT, 'rb'), stdout=stdout)
+        return stdout.getvalue()
+
+    def test_pipelines(self):
+        for make_pipeline in [
+                lambda: FilterPipeline([DirectionalFilter('inbound')]),
+                lambda: ExtractorPipeline([
+                    FieldExtractor(['to_addr'], '%Y-%m-%d %H')]),
+                lambda: AggregatorPipeline(SimpleAggregator(['to_addr'])),
+                lambda: ChainedPipeline([
+                    FilterPipeline([DirectionalFilter('inbound')]),
+                    ExtractorPipeline([FieldExtractor(['to_addr'], '%H')]),
+                    AggregatorPipeline(SimpleAggregator(['to_addr']))])]:
+            expected = self.process(make_pipeline(), False)
+            self.assertTrue(expected)
+            self.assertEqual(self.process(make_pipeline(), True), expected)
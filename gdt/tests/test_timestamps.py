@@ -0,0 +1,112 @@
+from datetime import datetime
+from unittest import TestCase
+
+import dateutil.parser
+
+from gdt.timestamps import (COARSEN, GRANULARITIES, TimestampParser,
+                            format_bucket, get_prefix_length, to_epoch)
+
+
+class TimestampParserTestCase(TestCase):
+
+    TIMESTAMPS = [
+        '2013-09-09 19:24:03.289543',
+        '2013-09-09 19:24:03.2895',
+        '2013-09-09 19:24:03',
+        '2013-09-09T19:24:03.289543',
+        '2013-09-09',
+        # handed to dateutil
+        '2013-09-09 19:24',
+        'Sep 9 2013 19:24:03',
+    ]
+
+    def setUp(self):
+        self.parser = TimestampParser()
+
+    def test_parse(self):
+        for timestamp in self.TIMESTAMPS:
+            self.assertEqual(
+                self.parser.parse(timestamp),
+                dateutil.parser.parse(timestamp))
+
+    def test_parse_invalid(self):
+        self.assertRaises(ValueError, self.parser.parse, '2013-13-01')
+
+    def test_week(self):
+        self.assertEqual(self.parser.week('2013-01-06 23:59:59'), (2013, 0))
+        self.assertEqual(self.parser.week('2013-01-07 00:00:00'), (2013, 1))
+        self.assertEqual(self.parser.week('2013-01-07 23:00:00'), (2013, 1))
+        self.assertEqual(self.parser.week('Jan 14 2013'), (2013, 2))
+
+    def test_format(self):
+        for date_format in ['%Y-%m-%d', '%H', '%M', '%Y-%m-%d %H:%M:%S.%f']:
+            for timestamp in self.TIMESTAMPS:
+                self.assertEqual(
+                    self.parser.format(timestamp, date_format),
+                    dateutil.parser.parse(timestamp).strftime(date_format))
+
+    def test_format_cache_buckets(self):
+        self.assertEqual(
+            self.parser.format('2013-09-09 19:24:03.289543', '%H'), '19')
+        self.assertEqual(
+            self.parser.format('2013-09-09 20:24:03.289543', '%H'), '20')
+        self.assertEqual(
+            self.parser.format('2013-09-09 20:25:03.289543', '%H:%M'),
+            '20:25')
+        self.assertEqual(self.parser.format_cache, {
+            ('2013-09-09 19', '%H'): '19',
+            ('2013-09-09 20', '%H'): '20',
+            ('2013-09-09 20:25', '%H:%M'): '20:25',
+        })
+
+    def test_minute(self):
+        for value in self.TIMESTAMPS:
+            timestamp = dateutil.parser.parse(value)
+            self.assertEqual(self.parser.minute(value),
+                             to_epoch(timestamp) // (60 * 1000000))
+        self.assertEqual(self.parser.minute('1970-01-02 01:02:59'), 1502)
+        self.assertEqual(self.parser.minute('1969-12-31 23:59:59'), -1)
+
+    def test_rollup_buckets(self):
+        def buckets(value):
+            bucket = self.parser.minute(value)
+            result = [format_bucket('minute', bucket)]
+            for granularity in GRANULARITIES[1:]:
+                bucket = COARSEN[granularity](bucket)
+                result.append(format_bucket(granularity, bucket))
+            return result
+
+        self.assertEqual(buckets('2013-09-09 19:24:03.289543'), [
+            '2013-09-09 19:24', '2013-09-09 19:00', '2013-09-09',
+            '2013-W37'])
+        # ISO weeks start on Mondays & belong to the year of their Thursday.
+        for value, week in [('2014-12-28 23:59:59', '2014-W52'),
+                            ('2014-12-29', '2015-W01'),
+                            ('2012-01-01', '2011-W52'),
+                            ('2012-01-02', '2012-W01'),
+                            ('1969-12-31', '1970-W01')]:
+            self.assertEqual(buckets(value)[-1], week)
+            self.assertEqual(buckets(value)[-1], '%04d-W%02d' % (
+                dateutil.parser.parse(value).isocalendar()[:2]))
+
+    def test_cache_size(self):
+        parser = TimestampParser(cache_size=2)
+        parser.week('2013-01-01')
+        parser.week('2013-01-02')
+        parser.week('2013-01-03')
+        self.assertEqual(parser.week_cache, {'2013-01-03': (2013, 0)})
+
+    def test_get_prefix_length(self):
+        self.assertEqual(get_prefix_length('%Y-%m-%d'), 10)
+        self.assertEqual(get_prefix_length('%W'), 10)
+        self.assertEqual(get_prefix_length('%Y %H'), 13)
+        self.assertEqual(get_prefix_length('%H:%M'), 16)
+        self.assertEqual(get_prefix_length('%S'), 19)
+        self.assertEqual(get_prefix_length('%f'), None)
+        self.assertEqual(get_prefix_length('%Z'), None)
+
+    def test_to_epoch(self):
+        self.assertEqual(to_epoch(datetime(1970, 1, 2, 0, 0, 1, 5)),
+                         86401000005)
+        self.assertEqual(to_epoch(datetime(1969, 12, 31, 23, 59, 59)),
+                         -1000000)
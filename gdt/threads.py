@@ -0,0 +1,132 @@
+import sys
+import threading
+from itertools import islice
+from Queue import Queue
+
+from gdt.batch import Batches
+
+
+# Rows handed between threads at a time.
+BATCH_SIZE = 1000
+
+# Batches a thread can get ahead of the next one by, this bounds the memory
+# used to the rows of a few batches.
+QUEUE_SIZE = 8
+
+
+def start_thread(target):
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def read_ahead(rows, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE):
+    """
+    Returns `rows`, read in a background thread. Reading & decoding the
+    input then overlaps with processing it, instead of waiting on a slow
+    disk or pipe between rows.
+    """
+    if isinstance(rows, Batches):
+        # Already read in batches, which are handed over one at a time.
+        return Batches(iter_ahead(rows.batches, 1, queue_size))
+    return iter_ahead(rows, batch_size, queue_size)
+
+
+def iter_ahead(rows, batch_size, queue_size):
+    queue = Queue(queue_size)
+    stopped = threading.Event()
+
+    def read():
+        try:
+            iterator = iter(rows)
+            while True:
+                batch = list(islice(iterator, batch_size))
+                # NOTE: checked before every `put()` so that once the rows
+                #       stop being read the queue only needs emptying once.
+                if stopped.is_set():
+                    return
+                if not batch:
+                    break
+                queue.put(batch)
+            queue.put(None)
+        except Exception:
+            queue.put(sys.exc_info())
+
+    start_thread(read)
+    try:
+        while True:
+            batch = queue.get()
+            if batch is None:
+                return
+            if isinstance(batch, tuple):
+                raise batch[0], batch[1], batch[2]
+            for row in batch:
+                yield row
+    finally:
+        # Unblock the thread if it's waiting for room in the queue.
+        stopped.set()
+        while not queue.empty():
+            queue.get()
+
+
+class ThreadedWriter(object):
+    """
+    Writes rows with `output`, a codec or writer, in a background thread so
+    that encoding & waiting on whatever reads the output overlaps with
+    processing the rows. Rows are written in order & `flush()` waits for
+    all of them, it's only called once at the end.
+    """
+
+    def __init__(self, output, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE):
+        self.output = output
+        self.batch_size = batch_size
+        self.queue = Queue(queue_size)
+        self.batch = []
+        self.error = None
+        self.thread = start_thread(self.write)
+
+    def write(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            # Once writing fails the rest are dropped, but the queue is
+            # still emptied so `writerow()` never blocks.
+            if self.error is not None:
+                continue
+            try:
+                for row in batch:
+                    self.output.writerow(row)
+            except Exception:
+                self.error = sys.exc_info()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def writerow(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.raise_error()
+            self.queue.put(self.batch)
+            self.batch = []
+
+    def flush(self):
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+        self.queue.put(None)
+        self.thread.join()
+        self.raise_error()
+        self.output.flush()
+
+
+def overlap(rows, output, threaded):
+    """
+    Returns `rows` & `output` as they are, or if `threaded` read & written
+    in threads of their own.
+    """
+    if not threaded:
+        return rows, output
+    return read_ahead(rows), ThreadedWriter(output)
@@ -0,0 +1,185 @@
+import re
+from datetime import datetime, timedelta
+
+import dateutil.parser
+
+
+# Vumi always writes timestamps as `YYYY-MM-DD HH:MM:SS.ffffff`, anything
+# that doesn't look like that is handed to dateutil.
+VUMI_TIMESTAMP = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[ T](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?)?$')
+
+# How many characters of a Vumi timestamp determine the value of a
+# `strftime` directive.
+DAY_DIRECTIVES = set('aAbBCdDeGghjmuUVwWyY%')
+HOUR_DIRECTIVES = set('HIklp')
+MINUTE_DIRECTIVES = set('MR')
+SECOND_DIRECTIVES = set('crsSTxX')
+DIRECTIVE = re.compile(r'%(.)')
+
+PREFIX_DAY = 10
+PREFIX_HOUR = 13
+PREFIX_MINUTE = 16
+PREFIX_SECOND = 19
+
+EPOCH = datetime(1970, 1, 1)
+
+# Microseconds in a minute.
+MINUTE = 60 * 1000000
+
+# Rollup granularities, finest first. Buckets are counted from the epoch in
+# integers & each is worked out from a bucket of the one before.
+GRANULARITIES = ['minute', 'hour', 'day', 'week']
+
+COARSEN = {
+    'hour': lambda minute: minute // 60,
+    'day': lambda hour: hour // 24,
+    # 1970-01-01 was a Thursday, weeks start on Mondays like ISO weeks do.
+    'week': lambda day: (day + 3) // 7,
+}
+
+
+def get_prefix_length(date_format):
+    """
+    Returns how much of a Vumi timestamp needs to be looked at to know
+    what `date_format` will render to or `None` if the result depends on
+    sub-second precision or on something other than the timestamp.
+    """
+    prefix_length = PREFIX_DAY
+    for directive in DIRECTIVE.findall(date_format):
+        if directive in DAY_DIRECTIVES:
+            continue
+        elif directive in HOUR_DIRECTIVES:
+            prefix_length = max(prefix_length, PREFIX_HOUR)
+        elif directive in MINUTE_DIRECTIVES:
+            prefix_length = max(prefix_length, PREFIX_MINUTE)
+        elif directive in SECOND_DIRECTIVES:
+            prefix_length = max(prefix_length, PREFIX_SECOND)
+        else:
+            return None
+    return prefix_length
+
+
+def to_epoch(timestamp):
+    """
+    Returns a naive datetime as microseconds since the epoch.
+    """
+    delta = timestamp - EPOCH
+    return ((delta.days * 86400 + delta.seconds) * 1000000 +
+            delta.microseconds)
+
+
+def format_bucket(granularity, bucket):
+    """
+    Returns a rollup bucket as a timestamp, `YYYY-Www` for ISO weeks.
+    """
+    if granularity == 'week':
+        year, week, _ = (EPOCH + timedelta(days=bucket * 7 - 3)).isocalendar()
+        return '%04d-W%02d' % (year, week)
+    if granularity == 'day':
+        return (EPOCH + timedelta(days=bucket)).strftime('%Y-%m-%d')
+    if granularity == 'hour':
+        return (EPOCH + timedelta(hours=bucket)).strftime('%Y-%m-%d %H:00')
+    return (EPOCH + timedelta(minutes=bucket)).strftime('%Y-%m-%d %H:%M')
+
+
+class TimestampParser(object):
+
+    cache_size = 100000
+
+    def __init__(self, cache_size=None):
+        if cache_size is not None:
+            self.cache_size = cache_size
+        self.week_cache = {}
+        self.day_cache = {}
+        self.format_cache = {}
+        self.prefix_lengths = {}
+
+    def cache(self, cache, key, value):
+        if len(cache) >= self.cache_size:
+            cache.clear()
+        cache[key] = value
+        return value
+
+    def parse(self, value):
+        match = VUMI_TIMESTAMP.match(value)
+        if match is None:
+            return dateutil.parser.parse(value)
+        year, month, day, hour, minute, second, fraction = match.groups()
+        try:
+            if hour is None:
+                return datetime(int(year), int(month), int(day))
+            return datetime(
+                int(year), int(month), int(day),
+                int(hour), int(minute), int(second),
+                int(fraction.ljust(6, '0')) if fraction else 0)
+        except ValueError:
+            return dateutil.parser.parse(value)
+
+    def week(self, value):
+        """
+        Returns the `(year, week)` a timestamp falls in, where weeks are
+        numbered like `strftime('%W')` does.
+        """
+        if VUMI_TIMESTAMP.match(value) is None:
+            return self.get_week(self.parse(value))
+
+        key = value[:PREFIX_DAY]
+        try:
+            return self.week_cache[key]
+        except KeyError:
+            return self.cache(
+                self.week_cache, key, self.get_week(self.parse(value)))
+
+    def minute(self, value):
+        """
+        Returns the minutes since the epoch of a timestamp, adding the hour
+        & minute of a Vumi timestamp to the minutes of its day.
+        """
+        if VUMI_TIMESTAMP.match(value) is None:
+            return to_epoch(self.parse(value)) // MINUTE
+
+        key = value[:PREFIX_DAY]
+        try:
+            day = self.day_cache[key]
+        except KeyError:
+            day = self.cache(
+                self.day_cache, key, to_epoch(self.parse(key)) // MINUTE)
+        if len(value) < PREFIX_MINUTE:
+            return day
+        return day + int(value[11:13]) * 60 + int(value[14:16])
+
+    def get_week(self, timestamp):
+        return int(timestamp.strftime('%Y')), int(timestamp.strftime('%W'))
+
+    def format(self, value, date_format):
+        """
+        Returns `value` formatted with `strftime(date_format)`, reusing
+        earlier results for timestamps in the same day, hour, minute or
+        second bucket.
+        """
+        try:
+            prefix_length = self.prefix_lengths[date_format]
+        except KeyError:
+            prefix_length = self.prefix_lengths[date_format] = (
+                get_prefix_length(date_format))
+
+        if prefix_length is None or VUMI_TIMESTAMP.match(value) is None:
+            return self.parse(value).strftime(date_format)
+
+        key = (value[:prefix_length], date_format)
+        try:
+            return self.format_cache[key]
+        except KeyError:
+            return self.cache(
+                self.format_cache, key,
+                self.parse(value).strftime(date_format))
+
+
+default_parser = TimestampParser()
+
+parse_timestamp = default_parser.parse
+week_of = default_parser.week
+minute_of = default_parser.minute
+format_timestamp = default_parser.format
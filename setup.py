@@ -17,6 +17,11 @@ setup(
     install_requires=[
         'python-dateutil==2.2',
     ],
+    extras_require={
+        'batch': ['numpy'],
+        'xz': ['backports.lzma'],
+        'json': ['ujson'],
+    },
     scripts=['scripts/gdt'],
     classifiers=[
         'Development Status :: 3 - Alpha',